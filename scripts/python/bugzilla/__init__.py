@@ -8,7 +8,7 @@
 
 from .apiversion import version, __version__
 from .base import Bugzilla
-from .exceptions import BugzillaError
+from .exceptions import BugzillaError, BugRefreshError
 from .oldclasses import (Bugzilla3, Bugzilla32, Bugzilla34, Bugzilla36,
         Bugzilla4, Bugzilla42, Bugzilla44,
         NovellBugzilla, RHBugzilla, RHBugzilla3, RHBugzilla4)
@@ -22,7 +22,7 @@ __all__ = [
     "Bugzilla4", "Bugzilla42", "Bugzilla44",
     "NovellBugzilla",
     "RHBugzilla3", "RHBugzilla4", "RHBugzilla",
-    'BugzillaError',
+    'BugzillaError', 'BugRefreshError',
     'Bugzilla', "version",
 ]
 
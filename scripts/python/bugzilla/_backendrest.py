@@ -33,11 +33,16 @@ class _BackendREST(_BackendBase):
     # Internal REST helpers #
     #########################
 
-    def _handle_response(self, text):
+    def _handle_response(self, response):
         try:
-            ret = dict(json.loads(text))
+            # Decode straight from the body bytes, response.text would
+            # first make a str copy of the whole, possibly huge, reply
+            ret = json.loads(response.content)
+            if not isinstance(ret, dict):
+                ret = dict(ret)
         except Exception:  # pragma: no cover
-            log.debug("Failed to parse REST response. Output is:\n%s", text)
+            log.debug("Failed to parse REST response. Output is:\n%s",
+                    response.text)
             raise
 
         if ret.get("error", False):
@@ -57,7 +62,7 @@ class _BackendREST(_BackendBase):
 
         response = self._bugzillasession.request(method, fullurl, data=data,
                 params=authparams)
-        return self._handle_response(response.text)
+        return self._handle_response(response)
 
     def _get(self, *args, **kwargs):
         return self._op("GET", *args, **kwargs)
@@ -66,6 +71,29 @@ class _BackendREST(_BackendBase):
     def _post(self, *args, **kwargs):
         return self._op("POST", *args, **kwargs)
 
+    def _get_bugs_sub(self, sub, bug_ids, paramdict, found):
+        """
+        GET /bug/<id>/<sub> for all bug_ids at once: the first id goes
+        in the url, the rest in the ids parameter. Bugs the server left
+        out of the reply, according to found(reply), are then fetched
+        one at a time.
+        """
+        bug_ids = listify(bug_ids)
+        if not bug_ids:
+            return []
+        data = paramdict.copy()
+        if len(bug_ids) > 1:
+            data["ids"] = bug_ids[1:]
+        replies = [self._get("/bug/%s/%s" % (bug_ids[0], sub), data)]
+
+        have = found(replies[0])
+        if len(have) < len(set(bug_ids)):
+            for bugid in bug_ids:
+                if str(bugid) not in have:
+                    replies.append(self._get("/bug/%s/%s" % (bugid, sub),
+                                             paramdict))
+        return replies
+
 
     #######################
     # API implementations #
@@ -121,17 +149,21 @@ class _BackendREST(_BackendBase):
         return self._put("/bug/attachment/%s" % paramdict["ids"][0], paramdict)
 
     def bug_comments(self, bug_ids, paramdict):
-        # XMLRPC supported mutiple fetch at once, but not REST
         ret = {}
-        for bugid in bug_ids:
-            out = self._get("/bug/%s/comment" % bugid, paramdict)
+        for out in self._get_bugs_sub("comment", bug_ids, paramdict,
+                lambda r: set(r.get("bugs", {}))):
             _update_key(ret, out, "bugs")
         return ret
     def bug_history(self, bug_ids, paramdict):
-        # XMLRPC supported mutiple fetch at once, but not REST
+        def _found(r):
+            ret = set()
+            for b in r.get("bugs", []):
+                ret.add(str(b.get("id")))
+                ret.update(listify(b.get("alias") or []))
+            return ret
+
         ret = {"bugs": []}
-        for bugid in bug_ids:
-            out = self._get("/bug/%s/history" % bugid, paramdict)
+        for out in self._get_bugs_sub("history", bug_ids, paramdict, _found):
             ret["bugs"].extend(out.get("bugs", []))
         return ret
 
@@ -2,6 +2,7 @@
 # See the COPYING file in the top-level directory.
 
 from logging import getLogger
+import re
 import sys
 from xmlrpc.client import (Binary, Fault, ProtocolError,
                            ServerProxy, Transport)
@@ -15,6 +16,13 @@ from ._util import listify
 
 log = getLogger(__name__)
 
+# XMLRPC methods that only read data, and so can be safely sent again
+# after a server error or a broken connection
+_READ_METHOD = re.compile(
+    rb"<methodName>[\w.]*\.(get\w*|search|comments|history|attachments|"
+    rb"fields|legal_values|version|extensions|time|timezone|"
+    rb"valid_login)</methodName>")
+
 
 class _BugzillaXMLRPCTransport(Transport):
     def __init__(self, bugzillasession):
@@ -42,7 +50,8 @@ class _BugzillaXMLRPCTransport(Transport):
         # pylint: disable=raise-missing-from
         try:
             response = self.__bugzillasession.request(
-                "POST", url, data=request_body)
+                "POST", url, data=request_body,
+                idempotent=bool(_READ_METHOD.search(request_body[:512])))
 
             return self.parse_response(response)
         except RequestException as e:
@@ -3,8 +3,13 @@
 
 from logging import getLogger
 
+import collections
+import contextlib
 import os
+import random
 import sys
+import threading
+import time
 import urllib.parse
 
 import requests
@@ -12,6 +17,52 @@ import requests
 
 log = getLogger(__name__)
 
+# Replies that say the server did not handle the request and it can be
+# sent again as is, whatever it was
+_THROTTLE_STATUS = (429, 503)
+# Replies worth retrying for requests that only read data
+_RETRY_STATUS = (500, 502, 504)
+
+
+def _env_number(name, default, conv=float):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    if value.lower() in ("none", "off"):
+        return None
+    return conv(value)
+
+
+class _TokenBucket(object):
+    """
+    Token bucket allowing rate requests per second on average and bursts
+    of up to burst requests
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for it if there is none.
+        Returns the time waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Going negative reserves a future token, so that waiting
+            # threads are served in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
 
 class _BugzillaSession(object):
     """
@@ -20,7 +71,22 @@ class _BugzillaSession(object):
     def __init__(self, url, user_agent,
             sslverify, cert, tokencache, api_key,
             is_redhat_bugzilla,
-            requests_session=None):
+            requests_session=None,
+            rate=-1, burst=None, concurrency=-1, retries=None, backoff=None):
+        """
+        :param rate: Average requests per second, None for no limit.
+            Defaults to $PYTHONBUGZILLA_RATE or 20.
+        :param burst: Requests that may go out at once before rate
+            applies, defaults to $PYTHONBUGZILLA_BURST or 20.
+        :param concurrency: Requests in flight at once, None for no
+            limit. Defaults to $PYTHONBUGZILLA_CONCURRENCY or 4.
+        :param retries: How often to retry a request the server
+            throttled, failed with a 5xx error or whose connection broke.
+            Only requests that read data are retried on 5xx errors and
+            broken connections. Defaults to $PYTHONBUGZILLA_RETRIES or 5.
+        :param backoff: First retry delay in seconds, doubled for each
+            further retry and jittered. Defaults to 1.
+        """
         self._url = url
         self._user_agent = user_agent
         self._scheme = urllib.parse.urlparse(url)[0]
@@ -29,6 +95,22 @@ class _BugzillaSession(object):
         self._is_xmlrpc = False
         self._use_auth_bearer = False
 
+        if rate == -1:
+            rate = _env_number("PYTHONBUGZILLA_RATE", 20)
+        if concurrency == -1:
+            concurrency = _env_number("PYTHONBUGZILLA_CONCURRENCY", 4)
+        self._bucket = rate and _TokenBucket(
+            rate, burst or _env_number("PYTHONBUGZILLA_BURST", 20))
+        self._slots = (concurrency and
+                       threading.BoundedSemaphore(int(concurrency)))
+        self._retries = (retries if retries is not None else
+                         _env_number("PYTHONBUGZILLA_RETRIES", 5, int))
+        self._backoff = backoff if backoff is not None else 1.0
+
+        self._stats_lock = threading.Lock()
+        self._stats = collections.Counter()
+        self._in_flight = 0
+
         if self._scheme not in ["http", "https"]:
             raise Exception("Invalid URL scheme: %s (%s)" % (
                 self._scheme, url))
@@ -92,12 +174,98 @@ class _BugzillaSession(object):
     def get_requests_session(self):
         return self._session
 
-    def request(self, *args, **kwargs):
+    def get_stats(self):
+        """
+        Return counters of the requests made through this session:
+        requests, retries, throttled (429/503 replies), server_errors
+        (other 5xx replies), connection_errors, rate_wait and
+        concurrency_wait (seconds spent waiting for the limits) and
+        max_in_flight
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    @contextlib.contextmanager
+    def _limited(self):
+        start = time.monotonic()
+        if self._slots:
+            self._slots.acquire()
+        try:
+            waited = time.monotonic() - start
+            rate_wait = self._bucket.acquire() if self._bucket else 0
+            with self._stats_lock:
+                self._stats["concurrency_wait"] += waited
+                self._stats["rate_wait"] += rate_wait
+                self._stats["requests"] += 1
+                self._in_flight += 1
+                self._stats["max_in_flight"] = max(
+                    self._stats["max_in_flight"], self._in_flight)
+            try:
+                yield
+            finally:
+                with self._stats_lock:
+                    self._in_flight -= 1
+        finally:
+            if self._slots:
+                self._slots.release()
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            try:
+                return float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                pass
+        delay = self._backoff * 2 ** attempt
+        return delay + random.uniform(0, delay / 2)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Send a request, subject to the rate and concurrency limits, and
+        retry it as described in __init__
+
+        :param idempotent: Whether the request only reads data, defaults
+            to True for GET and HEAD requests
+        """
         timeout = self._get_timeout()
         if "timeout" not in kwargs:
             kwargs["timeout"] = timeout
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD")
+
+        attempt = 0
+        while True:
+            response = None
+            try:
+                with self._limited():
+                    response = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                self._count("connection_errors")
+                if not idempotent or attempt >= self._retries:
+                    raise
+                reason = str(e)
+            else:
+                status = response.status_code
+                if status in _THROTTLE_STATUS:
+                    self._count("throttled")
+                elif status >= 500:
+                    self._count("server_errors")
+                if attempt >= self._retries or not (
+                        status in _THROTTLE_STATUS or
+                        (idempotent and status in _RETRY_STATUS)):
+                    break
+                reason = "HTTP %s" % status
 
-        response = self._session.request(*args, **kwargs)
+            delay = self._retry_delay(attempt, response)
+            log.debug("Bugzilla %s %s failed (%s), retry %d in %.1fs",
+                      method, url, reason, attempt + 1, delay)
+            self._count("retries")
+            time.sleep(delay)
+            attempt += 1
 
         if self._is_xmlrpc:
             # Yes this still appears to matter for properly decoding unicode
@@ -108,7 +276,9 @@ class _BugzillaSession(object):
             response.raise_for_status()
         except Exception as e:
             # Scrape the api key out of the returned exception string
+            # and keep the reply, it tells a rejected request from a lost one
             message = str(e).replace(self._api_key or "", "")
-            raise type(e)(message).with_traceback(sys.exc_info()[2])
+            raise type(e)(message, response=e.response).with_traceback(
+                sys.exc_info()[2])
 
         return response
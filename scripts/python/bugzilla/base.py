@@ -7,6 +7,7 @@
 # See the COPYING file in the top-level directory.
 
 import collections
+import concurrent.futures
 import getpass
 import locale
 from logging import getLogger
@@ -41,6 +42,22 @@ def _nested_update(d, u):
     return d
 
 
+def _merge_bulk_replies(replies):
+    # Helper to join the replies of a chunked bulk call: lists like
+    # getbugs' "bugs" and "faults" are concatenated, dicts keyed by
+    # bug id like get_comments' "bugs" are merged
+    ret = {}
+    for r in replies:
+        for k, v in r.items():
+            if isinstance(v, list):
+                ret.setdefault(k, []).extend(v)
+            elif isinstance(v, collections.abc.Mapping):
+                ret.setdefault(k, {}).update(v)
+            else:
+                ret.setdefault(k, v)
+    return ret
+
+
 class _FieldAlias(object):
     """
     Track API attribute names that differ from what we expose in users.
@@ -226,6 +243,19 @@ class Bugzilla(object):
         self._bug_autorefresh = False
         self._is_redhat_bugzilla = False
 
+        # With bug_autorefresh on, reading a Bug attribute that was not
+        # fetched refreshes the bug, one round trip per bug. Count those
+        # by attribute name, or raise BugRefreshError instead if strict.
+        self.bug_autorefresh_strict = False
+        self.implicit_refreshes = collections.Counter()
+
+        # Bulk fetches (getbugs, get_comments, bugs_history_raw) are
+        # split into chunks of this many ids, fetched by up to
+        # bulk_workers threads over the shared session, which limits
+        # and retries the requests.
+        self.bulk_chunk_size = 200
+        self.bulk_workers = 4
+
         self._rcfile = _BugzillaRCFile()
         self._tokencache = _BugzillaTokenCache()
 
@@ -551,6 +581,15 @@ class Bugzilla(object):
         """
         return self._backend.is_rest()
 
+    def get_request_stats(self):
+        """
+        Counters of the requests sent to the bugzilla instance since
+        connecting, see _BugzillaSession.get_stats()
+        """
+        if not self._session:
+            return {}
+        return self._session.get_stats()
+
     def get_requests_session(self):
         """
         Give API users access to the Requests.session object we use for
@@ -1060,26 +1099,44 @@ class Bugzilla(object):
         return self._is_redhat_bugzilla
 
 
+    def _bulk_fetch(self, fetch, idlist):
+        """
+        Call fetch() on chunks of at most bulk_chunk_size entries of
+        idlist, bulk_workers at a time, and merge the replies as if
+        fetch(idlist) had been called
+        """
+        idlist = list(idlist)
+        size = max(1, self.bulk_chunk_size or len(idlist) or 1)
+        chunks = [idlist[i:i + size] for i in range(0, len(idlist), size)]
+        if len(chunks) <= 1 or self.bulk_workers <= 1:
+            return _merge_bulk_replies([fetch(c) for c in chunks or [idlist]])
+
+        with concurrent.futures.ThreadPoolExecutor(
+                min(self.bulk_workers, len(chunks))) as executor:
+            replies = list(executor.map(fetch, chunks))
+        return _merge_bulk_replies(replies)
+
     def _getbugs(self, idlist, permissive,
             include_fields=None, exclude_fields=None, extra_fields=None):
         """
         Return a list of dicts of full bug info for each given bug id.
         bug ids that couldn't be found will return None instead of a dict.
         """
-        ids = []
-        aliases = []
-
         def _alias_or_int(_v):
             if str(_v).isdigit():
                 return int(_v), None
             return None, str(_v)
 
-        for idstr in idlist:
-            idint, alias = _alias_or_int(idstr)
-            if alias:
-                aliases.append(alias)
-            else:
-                ids.append(idstr)
+        def _bug_get(chunk):
+            ids = []
+            aliases = []
+            for idstr in chunk:
+                idint, alias = _alias_or_int(idstr)
+                if alias:
+                    aliases.append(alias)
+                else:
+                    ids.append(idstr)
+            return self._backend.bug_get(ids, aliases, getbugdata)
 
         extra_fields = listify(extra_fields or [])
         extra_fields += self._getbug_extra_fields()
@@ -1091,22 +1148,31 @@ class Bugzilla(object):
         getbugdata.update(self._process_include_fields(
             include_fields, exclude_fields, extra_fields))
 
-        r = self._backend.bug_get(ids, aliases, getbugdata)
+        r = self._bulk_fetch(_bug_get, idlist)
 
         # Do some wrangling to ensure we return bugs in the same order
-        # the were passed in, for historical reasons
+        # the were passed in, for historical reasons. Index the reply
+        # once so that large queries don't rescan it for every id; the
+        # first bug matching an id or alias wins, as it always did.
+        by_id = {}
+        by_alias = {}
+        for bugdict in r["bugs"]:
+            by_id.setdefault(bugdict.get("id", None), bugdict)
+            for alias in listify(bugdict.get("alias", None) or []):
+                by_alias.setdefault(alias, bugdict)
+
         ret = []
         for idval in idlist:
             idint, alias = _alias_or_int(idval)
-            for bugdict in r["bugs"]:
-                if idint and idint != bugdict.get("id", None):
-                    continue
-                aliaslist = listify(bugdict.get("alias", None) or [])
-                if alias and alias not in aliaslist:
-                    continue
-
+            if idint:
+                bugdict = by_id.get(idint)
+            elif alias:
+                bugdict = by_alias.get(alias)
+            else:
+                # "0" never matched an id check and took the first bug
+                bugdict = r["bugs"][0] if r["bugs"] else None
+            if bugdict is not None:
                 ret.append(bugdict)
-                break
         return ret
 
     def _getbug(self, objid, **kwargs):
@@ -1120,6 +1186,34 @@ class Bugzilla(object):
         """
         return self._getbugs([objid], permissive=False, **kwargs)[0]
 
+    def prefetch_bugs(self, bugs, fields):
+        """
+        Fetch the given fields for all Bug objects in bugs that miss any
+        of them, with one bulk call instead of an implicit refresh() per
+        bug when the attributes are first read.
+
+        Fields the server doesn't return for a bug are not refreshed
+        implicitly either.
+
+        :returns: The number of bugs that were fetched
+        """
+        fields = listify(fields)
+        missing = [b for b in bugs
+                   if not all(b._has_field(f) for f in fields)]
+        if not missing:
+            return 0
+
+        # _getbugs() may rename fields in the lists it is passed
+        r = self._getbugs([b.bug_id for b in missing], True,
+                include_fields=fields + ["id"], extra_fields=list(fields))
+        found = dict((d["id"], d) for d in r)
+        for b in missing:
+            b._prefetched.update(fields)
+            if b.bug_id in found:
+                b._update_dict(found[b.bug_id])
+        log.debug("Prefetched %s for %d bugs", fields, len(missing))
+        return len(missing)
+
     def getbug(self, objid,
                include_fields=None, exclude_fields=None, extra_fields=None):
         """
@@ -1146,12 +1240,19 @@ class Bugzilla(object):
                            autorefresh=self.bug_autorefresh)) or None
                 for b in data]
 
-    def get_comments(self, idlist):
+    def get_comments(self, idlist, include_fields=None):
         """
         Returns a dictionary of bugs and comments.  The comments key will
         be empty.  See bugzilla docs for details
+
+        :param include_fields: Only return these fields of each comment
         """
-        return self._backend.bug_comments(idlist, {})
+        paramdict = {}
+        if include_fields:
+            paramdict["include_fields"] = listify(include_fields)
+        return self._bulk_fetch(
+            lambda chunk: self._backend.bug_comments(chunk, paramdict),
+            listify(idlist))
 
 
     #################
@@ -1351,12 +1452,19 @@ class Bugzilla(object):
         if self._is_redhat_bugzilla:
             _RHBugzillaConverters.post_translation(query, bug)
 
-    def bugs_history_raw(self, bug_ids):
+    def bugs_history_raw(self, bug_ids, include_fields=None):
         """
         Experimental. Gets the history of changes for
         particular bugs in the database.
+
+        :param include_fields: Only return these fields of each bug
         """
-        return self._backend.bug_history(bug_ids, {})
+        paramdict = {}
+        if include_fields:
+            paramdict["include_fields"] = listify(include_fields)
+        return self._bulk_fetch(
+            lambda chunk: self._backend.bug_history(chunk, paramdict),
+            listify(bug_ids))
 
 
     #######################################
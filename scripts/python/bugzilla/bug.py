@@ -7,6 +7,8 @@
 import copy
 from logging import getLogger
 
+from .exceptions import BugRefreshError
+
 
 log = getLogger(__name__)
 
@@ -27,6 +29,7 @@ class Bug(object):
 
         self.bugzilla = bugzilla
         self._rawdata = {}
+        self._prefetched = set()
         self.autorefresh = autorefresh
 
         # pylint: disable=protected-access
@@ -81,6 +84,18 @@ class Bug(object):
             if refreshed or not self.autorefresh:
                 break
 
+            if name in self._prefetched:
+                # A bulk prefetch already asked for it, and got nothing
+                break
+
+            if self.bugzilla.bug_autorefresh_strict:
+                raise BugRefreshError(
+                    "Bug %i missing attribute '%s', not refreshing it in "
+                    "strict mode. Add it to include_fields for "
+                    "getbug/query, or fetch it for many bugs at once "
+                    "with Bugzilla.prefetch_bugs()." % (self.bug_id, name))
+            self.bugzilla.implicit_refreshes[name] += 1
+
             log.info("Bug %i missing attribute '%s' - doing implicit "
                 "refresh(). This will be slow, if you want to avoid "
                 "this, properly use query/getbug include_fields, and "
@@ -100,6 +115,18 @@ class Bug(object):
                     "to adjust your include_fields for getbug/query." % name)
         raise AttributeError(msg)
 
+    def _has_field(self, name):
+        """
+        Return True if the field name, or its alias, was fetched
+        """
+        if name in self.__dict__:
+            return True
+        for newname, oldname in self._aliases:
+            if name in (newname, oldname) and (
+                    newname in self.__dict__ or oldname in self.__dict__):
+                return True
+        return False
+
     def get_raw_data(self):
         """
         Return the raw API dictionary data that has been used to
@@ -163,6 +190,7 @@ class Bug(object):
 
     def __setstate__(self, vals):
         self._rawdata = {}
+        self._prefetched = set()
         self.bugzilla = None
         self._aliases = vals.get("_aliases", [])
         self.autorefresh = False
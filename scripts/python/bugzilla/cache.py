@@ -0,0 +1,257 @@
+"""Persistent local cache of bugs, comments and history
+
+Most security incident bugs don't change between two runs of the
+scripts querying them. BugCache keeps the bug dicts, comments and
+history it has seen in an SQLite database together with the
+last_change_time of each bug, and only asks Bugzilla again for bugs
+whose last_change_time moved since they were stored:
+
+    cache = BugCache(bzapi)
+    bugs = cache.query(bzapi.build_query(...))
+    comments = cache.get_comments([b.id for b in bugs])
+
+query() and getbugs() first fetch just the id and last_change_time of
+the matching bugs, which is cheap, and then the full data of the bugs
+that changed. get_comments() and bugs_history_raw() reuse the
+last_change_time seen by those calls. The methods return the same
+values as the Bugzilla methods of the same name, so BugCache can be
+used in their place.
+"""
+
+import json
+import os
+import sqlite3
+import urllib.parse
+import xmlrpc.client
+
+from .bug import Bug
+from ._util import listify
+
+
+# The fields needed to tell whether a cached bug is still current
+SYNC_FIELDS = ["id", "alias", "last_change_time"]
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER of old sqlite versions
+_SQL_CHUNK = 500
+
+
+def default_cache_file(url):
+    """
+    Return the default cache database for the bugzilla instance at url
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME",
+                               os.path.expanduser("~/.cache"))
+    host = urllib.parse.urlparse(url).netloc or "bugzilla"
+    return os.path.join(cache_dir, "bugzilla", host + ".sqlite")
+
+
+def _encode(obj):
+    # XMLRPC returns timestamps as DateTime, keep them that way so that
+    # cached bugs look exactly like fresh ones
+    if isinstance(obj, xmlrpc.client.DateTime):
+        return {"__datetime__": obj.value}
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def _decode(d):
+    if len(d) == 1 and "__datetime__" in d:
+        return xmlrpc.client.DateTime(d["__datetime__"])
+    return d
+
+
+def _dumps(data):
+    return json.dumps(data, default=_encode)
+
+
+def _loads(data):
+    return json.loads(data, object_hook=_decode)
+
+
+class BugCache(object):
+    """
+    Cache of bugs, comments and history of one Bugzilla instance, see
+    the module documentation
+
+    :param bzapi: connected Bugzilla instance used to fetch missing data
+    :param path: SQLite database to use, defaults to a file per
+        bugzilla host in ~/.cache/bugzilla; it is made readable by the
+        user only
+    """
+    def __init__(self, bzapi, path=None):
+        self.bzapi = bzapi
+        self.path = path or default_cache_file(bzapi.url)
+        if self.path != ":memory:":
+            cache_dir = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, mode=0o700)
+            # the bugs may be embargoed, keep them private to the user
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            if os.stat(self.path).st_mode & 0o077:
+                os.chmod(self.path, 0o600)
+        self._db = sqlite3.connect(self.path)
+        with self._db:
+            for table in ("bugs", "comments", "history"):
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, "
+                    "stamp TEXT NOT NULL, fields TEXT, data TEXT NOT NULL)" %
+                    table)
+
+        # last_change_time of each bug as seen from Bugzilla by this
+        # instance; cached data with the same stamp is current
+        self._stamps = {}
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self._db.close()
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _record_stamps(self, bugdicts):
+        for b in bugdicts:
+            self._stamps[b["id"]] = str(b["last_change_time"])
+
+    def _stamp_unknown(self, ids):
+        unknown = [i for i in ids if i not in self._stamps]
+        if unknown:
+            self._record_stamps(self.bzapi._getbugs(
+                unknown, True, include_fields=list(SYNC_FIELDS)))
+
+    def _load(self, table, ids):
+        rows = {}
+        for i in range(0, len(ids), _SQL_CHUNK):
+            chunk = ids[i:i + _SQL_CHUNK]
+            cur = self._db.execute(
+                "SELECT id, stamp, fields, data FROM %s WHERE id IN (%s)" %
+                (table, ",".join("?" * len(chunk))), chunk)
+            for bugid, stamp, fields, data in cur:
+                rows[bugid] = (stamp, fields and json.loads(fields), data)
+        return rows
+
+    def _store(self, table, entries):
+        # entries are (id, fields, data) tuples
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?)" % table,
+                [(bugid, self._stamps[bugid],
+                  fields is not None and json.dumps(fields) or None,
+                  _dumps(data)) for bugid, fields, data in entries])
+
+    def _current(self, table, ids):
+        """
+        Return the current cached data of ids in table and the ids
+        that need to be fetched
+        """
+        ids = [int(i) for i in ids]
+        self._stamp_unknown(ids)
+        rows = self._load(table, ids)
+        ret = {}
+        stale = []
+        for bugid in ids:
+            if bugid not in self._stamps:
+                continue
+            row = rows.get(bugid)
+            if row and row[0] == self._stamps[bugid]:
+                self.hits += 1
+                ret[bugid] = _loads(row[2])
+            else:
+                self.misses += 1
+                stale.append(bugid)
+        return ret, stale
+
+    def _bugdicts(self, ids, include_fields):
+        """
+        Return current bug dicts for ids, whose stamps are known, with at
+        least include_fields
+        """
+        rows = self._load("bugs", ids)
+        ret = {}
+        stale = []
+        fields = set(include_fields or [])
+        for bugid in ids:
+            row = rows.get(bugid)
+            if (row and row[0] == self._stamps[bugid] and
+                (row[1] is None or (include_fields and
+                                    fields.issubset(row[1])))):
+                self.hits += 1
+                ret[bugid] = _loads(row[2])
+                continue
+            self.misses += 1
+            stale.append(bugid)
+            if row and row[1] is not None and include_fields:
+                # Keep what was cached for other callers
+                fields.update(row[1])
+
+        if stale:
+            fetch_fields = include_fields and sorted(fields | {"id"})
+            # _getbugs() may rename fields in the list it is passed
+            fetched = self.bzapi._getbugs(
+                stale, True, include_fields=fetch_fields and
+                list(fetch_fields))
+            self._store("bugs", [(b["id"], fetch_fields, b)
+                                 for b in fetched if b["id"] in self._stamps])
+            ret.update((b["id"], b) for b in fetched)
+        return [ret[i] for i in ids if i in ret]
+
+    def _bugs(self, bugdicts):
+        return [Bug(self.bzapi, dict=b, autorefresh=self.bzapi.bug_autorefresh)
+                for b in bugdicts]
+
+    ##################
+    # Public methods #
+    ##################
+
+    def query(self, query):
+        """
+        Like Bugzilla.query(), but only fetch matching bugs that changed
+        since they were cached
+        """
+        include_fields = query.get("include_fields")
+        probe = dict(query)
+        probe["include_fields"] = list(SYNC_FIELDS)
+        found = self.bzapi.query(probe)
+        self._record_stamps(b.get_raw_data() for b in found)
+        return self._bugs(self._bugdicts([b.id for b in found],
+                                         include_fields))
+
+    def getbugs(self, idlist, include_fields=None):
+        """
+        Like Bugzilla.getbugs(), but only fetch bugs that changed since
+        they were cached
+        """
+        probe = self.bzapi._getbugs(listify(idlist), True,
+                                    include_fields=list(SYNC_FIELDS))
+        self._record_stamps(probe)
+        return self._bugs(self._bugdicts([b["id"] for b in probe],
+                                         include_fields))
+
+    def get_comments(self, idlist):
+        """
+        Like Bugzilla.get_comments(), but only fetch comments of bugs
+        that changed since they were cached
+        """
+        ret, stale = self._current("comments", listify(idlist))
+        if stale:
+            fetched = self.bzapi.get_comments(stale)["bugs"]
+            entries = [(int(k), None, v) for k, v in fetched.items()]
+            self._store("comments", [e for e in entries
+                                     if e[0] in self._stamps])
+            ret.update((e[0], e[2]) for e in entries)
+        return {"bugs": dict((str(k), v) for k, v in ret.items()),
+                "comments": {}}
+
+    def bugs_history_raw(self, bug_ids):
+        """
+        Like Bugzilla.bugs_history_raw(), but only fetch the history of
+        bugs that changed since they were cached
+        """
+        bug_ids = listify(bug_ids)
+        ret, stale = self._current("history", bug_ids)
+        if stale:
+            fetched = self.bzapi.bugs_history_raw(stale)["bugs"]
+            self._store("history", [(h["id"], None, h) for h in fetched
+                                    if h["id"] in self._stamps])
+            ret.update((h["id"], h) for h in fetched)
+        return {"bugs": [ret[int(i)] for i in bug_ids if int(i) in ret]}
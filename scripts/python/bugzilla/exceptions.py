@@ -36,3 +36,12 @@ class BugzillaError(Exception):
         if self.code:
             message += " (code=%s)" % self.code
         Exception.__init__(self, message)
+
+
+class BugRefreshError(BugzillaError, AttributeError):
+    """
+    Raised when reading a Bug attribute that was not fetched, instead of
+    implicitly refreshing the bug, if Bugzilla.bug_autorefresh_strict
+    is set. It is an AttributeError, so hasattr() and getattr() with a
+    default keep working.
+    """
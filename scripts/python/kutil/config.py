@@ -3,13 +3,16 @@
 Synopsis: determine the current kernel source version from a series of patches
           as being referenced from series.conf
 
-Usage: {appname} [-hVp:]
+Usage: {appname} [-hVnp:c:]
        -h, --help           this message
        -V, --version        print version and exit
        -p, --patches dir    directory, where patches.* reside, referenced in
                             series.conf [default: '{patchdir}']
                             series.conf is read from . and config.sh from
                             the directory from which {appname} is executed
+       -c, --cache file     use the checkpoint cache file, also enabled by
+                            setting $COMPUTE_PATCHVERSION_CACHE to a file
+       -n, --no-cache       do not use the checkpoint cache
 
 Description:
 The executable part of this script replaces the old compute-PATCHVERSION.sh
@@ -27,6 +30,12 @@ top level Makefile to the four version defining symbols: VERSION, PATCHLEVEL,
 SUBLEVEL, and EXTRAVERSION. The result should consitute the latest kernel
 patch level.
 
+The version after each patch is recorded in a checkpoint cache, keyed by a hash
+of the series.conf prefix and the git blob ids of the patch files. When only
+the end of the series changes, only the patches after the first changed
+series.conf entry are replayed. The cache is not used by default; it keeps
+the checkpoints of the few series.conf files used most recently.
+
 Version: {version}
 Copyright: (c)2026 by {company}
 Author: {author}
@@ -41,7 +50,10 @@ License: {license}
 
 import configparser
 import subprocess
+import tempfile
+import hashlib
 import shlex
+import json
 import re
 import os
 
@@ -56,28 +68,41 @@ def init_repo(tmpdirname, repo, branch):
     return os.path.join(tmpdirname, repo)
 
 def get_source_timestamp(directory):
-    with open(os.path.join(directory, 'source-timestamp'), 'r') as fd:
-        source_timestamp = fd.read().splitlines()
+    source_timestamp = tar_up_dir(directory).source_timestamp
     return '\n'.join(source_timestamp[1:] + [source_timestamp[0]])
 
-def list_files(directory):
+def scan_files(directory):
+    """Return a dictionary of all files below directory (relative path -> stat result)"""
     if len(directory) > 1:
         directory = directory.rstrip('/')
-    result = []
-    for root, _, filenames in os.walk(directory):
-        for f in filenames:
-            result.append(os.path.join(root, f)[len(directory)+1:])
-    return sorted(result)
+    result = {}
+    if not hasattr(os, 'scandir'):  # SLE 12
+        for root, _, filenames in os.walk(directory):
+            for f in filenames:
+                path = os.path.join(root, f)
+                result[path[len(directory)+1:]] = os.stat(path)
+        return result
+    dirs = [directory]
+    while dirs:
+        d = dirs.pop()
+        for entry in os.scandir(d):
+            # Like os.walk do not descend into symlinked directories nor list them
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    dirs.append(entry.path)
+            else:
+                result[entry.path[len(directory)+1:]] = entry.stat()
+    return result
+
+def list_files(directory):
+    return tar_up_dir(directory).file_list
 
 def list_specs(directory):
-    ext = '.spec'
-    return [f[0:-len(ext)] for f in list_files(directory) if f.endswith(ext)]
+    return tar_up_dir(directory).specs
 
 def read_source_timestamp(directory):
-    file = os.path.join(directory, 'source-timestamp')
     cp = configparser.ConfigParser(delimiters=(':'), interpolation=None)
-    with open(file, 'r') as fd:
-        cp.read_string('[section]\nDate: ' + fd.read())
+    cp.read_string('[section]\nDate: ' + '\n'.join(tar_up_dir(directory).source_timestamp))
     config = cp['section']
     return config
 
@@ -155,9 +180,7 @@ class CaseInsensitiveDict(dict):
         return SrcVersion(self.get(key))
 
 
-def read_config_sh(package_tar_up_dir):
-    """Parse config.sh file and return a dict with key value pairs"""
-    config_sh = os.path.join(package_tar_up_dir, 'config.sh')
+def _parse_config_sh(config_sh):
     config = CaseInsensitiveDict()
     lnnr = 0
     with open(config_sh, 'r') as f:
@@ -179,8 +202,103 @@ def read_config_sh(package_tar_up_dir):
 
     return config
 
+# While the sources do contain config.conf the tar-up can produce sources
+# for fewer architectures than specified in config.conf when using -a
+# option (ie. disable some architectures)
+# The architectures to build for have to be read from the spec file
+# ExclusiveArch tags as a result. While not every spec file may have one
+# for all binary packages the tag is generated based on the list of
+# architectures for which the config is enabled.
+# In general the tag coulld be wrapped as e-mail headers can but we only
+# need to support spec files generated from kernel spec file templates in
+# which the list of architectures is always on one line.
+# Multiple ExclusiveArgs tags may exist because of repository conditionals.
+# Dummy architectures like do_not_build or noarch are not provided by
+# repositories and do not affect the repository selection.
+def _parse_exclusive_arch(spec_file):
+    tag = 'ExclusiveArch:'.lower()
+    archs = []
+    with open(spec_file, 'r') as f:
+        for l in f.read().splitlines():
+            if l.lower().startswith(tag):
+                l = l[len(tag):]
+                # limit expansion to what can realistically be expected in OBS project configuration
+                # local rpm may have different ideas or be completely unavailable, use fixed expansion
+                l = l.replace('%ix86', 'i386 i486 i586 i686')
+                l = l.replace('%arm', 'armv6l armv6hl armv7l armv7hl')
+                l = l.replace('\t', ' ').strip()
+                assert '%' not in l  # will need to do more macro expansion otherwise
+                archs += l.split(' ')
+    return archs
+
+class TarUpDir:
+    """Parsed content of a directory produced by tar-up
+
+    The file list, config.sh, source-timestamp and spec file ExclusiveArch tags
+    are read on first use and kept for the lifetime of the object. All the
+    helpers taking a tar-up directory accept either a path or a TarUpDir, pass
+    a TarUpDir to share the parsed data between calls."""
+    spec_ext = '.spec'
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self._files = None
+        self._config = None
+        self._source_timestamp = None
+        self._spec_archs = {}
+
+    @property
+    def files(self):
+        """dictionary of relative file path -> stat result"""
+        if self._files is None:
+            self._files = scan_files(self.directory)
+        return self._files
+
+    @property
+    def file_list(self):
+        return sorted(self.files.keys())
+
+    @property
+    def spec_files(self):
+        return [f for f in self.file_list if f.endswith(self.spec_ext)]
+
+    @property
+    def specs(self):
+        return [f[0:-len(self.spec_ext)] for f in self.spec_files]
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = _parse_config_sh(os.path.join(self.directory, 'config.sh'))
+        return self._config
+
+    @property
+    def source_timestamp(self):
+        """lines of the source-timestamp file"""
+        if self._source_timestamp is None:
+            with open(os.path.join(self.directory, 'source-timestamp'), 'r') as fd:
+                self._source_timestamp = fd.read().splitlines()
+        return self._source_timestamp
+
+    def spec_archs(self, spec_file):
+        """architectures listed in ExclusiveArch tags of spec_file"""
+        if spec_file not in self._spec_archs:
+            self._spec_archs[spec_file] = _parse_exclusive_arch(os.path.join(self.directory, spec_file))
+        return self._spec_archs[spec_file]
+
+def tar_up_dir(directory):
+    """Return directory as a TarUpDir, parsing it when a path is given"""
+    if isinstance(directory, TarUpDir):
+        return directory
+    return TarUpDir(directory)
+
+def read_config_sh(package_tar_up_dir):
+    """Parse config.sh file and return a dict with key value pairs"""
+    return tar_up_dir(package_tar_up_dir).config
+
 def get_kernel_project_package(package_tar_up_dir):
-    rpm_config = read_config_sh(package_tar_up_dir)
+    tar_up = tar_up_dir(package_tar_up_dir)
+    rpm_config = tar_up.config
     if 'ibs_project' in rpm_config:
         project = rpm_config.get('ibs_project')
     else:
@@ -188,7 +306,7 @@ def get_kernel_project_package(package_tar_up_dir):
     if 'variant' in rpm_config:
         return (project, 'kernel-source' + rpm_config.get('variant'))
     # kgraft patches have only one spec file, use file list
-    lst = list_specs(package_tar_up_dir)
+    lst = tar_up.specs
     assert len(lst) == 1
     specname = lst[0]
     assert '/' not in specname
@@ -208,48 +326,23 @@ def get_kernel_projects(package_tar_up_dir):
                 ibs_projects[suffix] = 'openSUSE.org:' + rpm_config[var]
     return {'IBS': ibs_projects, 'OBS': obs_projects}
 
-# While the sources do contain config.conf the tar-up can produce sources
-# for fewer architectures than specified in config.conf when using -a
-# option (ie. disable some architectures)
-# The architectures to build for have to be read from the spec file
-# ExclusiveArch tags as a result. While not every spec file may have one
-# for all binary packages the tag is generated based on the list of
-# architectures for which the config is enabled.
-# In general the tag coulld be wrapped as e-mail headers can but we only
-# need to support spec files generated from kernel spec file templates in
-# which the list of architectures is always on one line.
-# Multiple ExclusiveArgs tags may exist because of repository conditionals.
-# Dummy architectures like do_not_build or noarch are not provided by
-# repositories and do not affect the repository selection.
 def get_package_archs(package_tar_up_dir, limit_packages=None):
-    ext = '.spec'
-    tag = 'ExclusiveArch:'.lower()
+    tar_up = tar_up_dir(package_tar_up_dir)
+    ext = TarUpDir.spec_ext
     limit_packages = limit_packages if limit_packages else []
     limit_packages = [ spec if spec.endswith(ext) else spec + ext for spec in limit_packages ]
     limit_packages = limit_packages + [ 'kernel-' + spec for spec in limit_packages ] # limit-packages fuzzing, this may need to go to caller
-    lst = list_files(package_tar_up_dir)
-    lst = [f for f in lst if f.endswith(ext)]
     archs = []
-    for spec in lst:
+    for spec in tar_up.spec_files:
         if limit_packages and spec not in limit_packages:
             continue
-        with open(os.path.join(package_tar_up_dir, spec), 'r') as f:
-            for l in f.read().splitlines():
-                if l.lower().startswith(tag):
-                    l = l[len(tag):]
-                    # limit expansion to what can realistically be expected in OBS project configuration
-                    # local rpm may have different ideas or be completely unavailable, use fixed expansion
-                    l = l.replace('%ix86', 'i386 i486 i586 i686')
-                    l = l.replace('%arm', 'armv6l armv6hl armv7l armv7hl')
-                    l = l.replace('\t', ' ').strip()
-                    assert '%' not in l  # will need to do more macro expansion otherwise
-                    archs += l.split(' ')
+        archs += tar_up.spec_archs(spec)
     return sorted(list(set(archs)))
 
 # here starts the new compute-PATCHVERSION.py implementation
 
-def parse_series_conf(patchdir, series_conf):
-    """Parse the series.conf file, taking guards into account, and return a list of patch files"""
+def list_series_patches(series_conf):
+    """Parse the series.conf file, taking guards into account, and return a list of all patch files"""
     # Use grep to extract patch file names from series.conf.
     # In a plain quilt series file the non-whitespace thing at the start of a line that is not a comment is
     # a patch filename. However, the series.conf in kernel-source may contain 'guards'. While complex semantic
@@ -261,16 +354,23 @@ def parse_series_conf(patchdir, series_conf):
     if pipe.returncode == 2:
         raise RuntimeError('%s\n%s' % (pipe.args, errors))
     # The resulting patch filenames can be prefixed with whitespace.
-    # However, they are fed to xargs which splits on whitespace conveniently stripping the leading whitespace
-    # from the patch filenames. This alleviates the need to ever touch the buffer from python
+    return [p.decode().strip() for p in patches.splitlines()]
+
+def filter_makefile_patches(patchdir, patches):
+    """Return the patches from the list that touch the top level Makefile"""
+    if not patches:
+        return []
     pipe = subprocess.Popen(['xargs', 'grep', '-lE', '^[+][+][+][^/]+/Makefile'],
                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=patchdir)
-    output, errors = pipe.communicate(input=patches)
+    output, errors = pipe.communicate(input='\n'.join(patches).encode())
     if errors:  # The return value from xargs grep is fairly meaningless but stderr should be empty
         raise RuntimeError('%s\n%s' % (pipe.args, errors))
-    patches = [p.decode() for p in output.splitlines()]
+    return [p.decode() for p in output.splitlines()]
 
-    return patches
+def parse_series_conf(patchdir, series_conf):
+    """Parse the series.conf file, taking guards into account, and return a list of patch files
+    that touch the top level Makefile"""
+    return filter_makefile_patches(patchdir, list_series_patches(series_conf))
 
 def parse_makefiles(diff_text):
     """Locate changes to the toplevel Makefile in a unified diff file
@@ -320,8 +420,106 @@ def parse_makefiles(diff_text):
 
     return changes
 
-def compute_patchversion(bindir, rpmdir, patchdir):
-    """Compute patchversion from config.sh, series.conf and patch files"""
+def default_cache_path(name):
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_dir, name)
+
+def git_blob_id(path, algorithm='sha1', content_hash=None):
+    """Compute the git blob id of a file without running git, algorithm is the repository object format
+    content_hash, a hashlib object, is updated with the file content as well so the file is read only once"""
+    size = os.stat(path).st_size
+    h = hashlib.new(algorithm, ('blob %i\0' % (size,)).encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+            if content_hash:
+                content_hash.update(chunk)
+    return h.hexdigest()
+
+def save_json(path, data):
+    """Atomically replace path with data stored as JSON, concurrent readers see either the old or the new file
+    Failing to write is not an error, this is used for caches only"""
+    tmp = None
+    try:
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(path) + '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+        tmp = None
+    except OSError:
+        pass
+    finally:
+        if tmp:
+            os.unlink(tmp)
+
+def load_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class PatchversionCache:
+    """Checkpoint cache for compute_patchversion, stored as a JSON file
+
+    For each of the max_series series.conf used most recently the cache records
+        chain       hash chain over the source version and each series entry
+                    (patch name and blob id), one shortened hash per prefix
+        versions    [index, version dict] for every patch changing the version
+        blobs       patch name -> [size, mtime_ns, blob id] so that unchanged
+                    patch files need not be read again
+    """
+    format = 1
+    max_series = 4
+
+    def __init__(self, path):
+        self.path = path
+        self.data = load_json(path)
+        if not isinstance(self.data, dict) or self.data.get('format', None) != self.format:
+            self.data = {'format': self.format, 'series': {}}
+
+    def get(self, series_conf):
+        return self.data['series'].get(os.path.abspath(series_conf), {})
+
+    def set(self, series_conf, entry):
+        # the series are kept in the order of use, the most recent last
+        series = self.data['series']
+        series.pop(os.path.abspath(series_conf), None)
+        series[os.path.abspath(series_conf)] = entry
+        for key in [k for k in series.keys() if not os.path.exists(k)]:
+            del series[key]
+        for key in list(series.keys())[0:-self.max_series]:
+            del series[key]
+
+    def save(self):
+        save_json(self.path, self.data)
+
+def _patch_blob(patchdir, patch, cached):
+    try:
+        st = os.stat(os.path.join(patchdir, patch))
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached
+        return [st.st_size, st.st_mtime_ns, git_blob_id(os.path.join(patchdir, patch))]
+    except OSError as e:
+        raise RuntimeError('%s: %s' % (patch, e.strerror))
+
+def apply_makefile_changes(src_version, patchdir, patch):
+    """Apply changes of the top level Makefile version variables in patch to src_version
+    returns True if the patch contains any such changes"""
+    with open(os.path.join(patchdir, patch), 'r') as f:
+        changeset = parse_makefiles(f.read())
+    for ch in changeset:
+        src_version.update(ch['variable'], ch['value'])
+    return bool(changeset)
+
+def compute_patchversion(bindir, rpmdir, patchdir, cache=None):
+    """Compute patchversion from config.sh, series.conf and patch files
+
+    When a PatchversionCache is passed only the patches after the first series.conf
+    entry that differs from the cached checkpoints are replayed."""
     patchdir = str(patchdir)
     if not os.path.isdir(patchdir):
         raise FileNotFoundError('patch directory {} not found'.format(patchdir))
@@ -334,23 +532,43 @@ def compute_patchversion(bindir, rpmdir, patchdir):
 
     # fetch patch files from series.conf
     series_conf = os.path.join(str(rpmdir), 'series.conf')
-    patches = parse_series_conf(patchdir, series_conf)
-
-    # collect top level Makefile changesets from patch files
-    changes = []
+    patches = list_series_patches(series_conf)
+
+    if not cache:
+        # collect top level Makefile changesets from patch files and apply them
+        for patch in filter_makefile_patches(patchdir, patches):
+            apply_makefile_changes(src_version, patchdir, patch)
+        return src_version
+
+    entry = cache.get(series_conf)
+    cached_blobs = entry.get('blobs', {})
+    cached_chain = entry.get('chain', [])
+    blobs = {}
+    chain = []
+    key = hashlib.sha256(str(src_version).encode()).hexdigest()
     for patch in patches:
-        patch = os.path.join(patchdir, patch)
-        with open(patch, 'r') as f:
-            patch_data = f.read()
-            changeset = parse_makefiles(patch_data)
-            if changeset:
-                changes.append(changeset)
-
-    # iterate over all changesets, and apply them
-    for changeset in changes:
-        for ch in changeset:
-            src_version.update(ch['variable'], ch['value'])
-
+        blobs[patch] = _patch_blob(patchdir, patch, cached_blobs.get(patch, None))
+        key = hashlib.sha256(' '.join([key, patch, blobs[patch][2]]).encode()).hexdigest()
+        chain.append(key[:16])
+
+    # find the first series entry that differs from the cached run
+    start = 0
+    while start < len(chain) and start < len(cached_chain) and chain[start] == cached_chain[start]:
+        start += 1
+    versions = [v for v in entry.get('versions', []) if v[0] < start]
+    if versions:
+        for part, value in versions[-1][1].items():
+            src_version.update(part, value)
+
+    # replay the remaining patches
+    makefile_patches = set(filter_makefile_patches(patchdir, patches[start:]))
+    for index in range(start, len(patches)):
+        if patches[index] in makefile_patches:
+            if apply_makefile_changes(src_version, patchdir, patches[index]):
+                versions.append([index, dict(src_version)])
+
+    cache.set(series_conf, {'chain': chain, 'versions': versions, 'blobs': blobs})
+    cache.save()
     return src_version
 
 if __name__ == "__main__":
@@ -375,6 +593,7 @@ if __name__ == "__main__":
         license = __license__
         rpmdir = '.'
         patchdir = '.'
+        cache = os.environ.get('COMPUTE_PATCHVERSION_CACHE', None)
 
     def stdout(*msg):
         print(*msg, file = sys.stdout, flush = True)
@@ -396,8 +615,8 @@ if __name__ == "__main__":
             argv = sys.argv[1:]
 
         try:
-            optlist, _ = getopt.getopt(argv, 'hVvp:',
-                ('help', 'version', 'verbose', 'patches=')
+            optlist, _ = getopt.getopt(argv, 'hVvnp:c:',
+                ('help', 'version', 'verbose', 'no-cache', 'patches=', 'cache=')
             )
         except getopt.error as msg:
             exit(1, msg, True)
@@ -409,12 +628,17 @@ if __name__ == "__main__":
                 exit(msg = 'version {}'.format(gpar.version))
             elif opt in ('-p', '--patches'):
                 gpar.patchdir = par
+            elif opt in ('-c', '--cache'):
+                gpar.cache = par
+            elif opt in ('-n', '--no-cache'):
+                gpar.cache = None
 
         # ignore broken pipe errors (SIGPIPE)
         signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
         try:
-            stdout(str(compute_patchversion(gpar.appdir, gpar.rpmdir, gpar.patchdir)))
+            cache = PatchversionCache(gpar.cache) if gpar.cache else None
+            stdout(str(compute_patchversion(gpar.appdir, gpar.rpmdir, gpar.patchdir, cache)))
             return 0
         except (ValueError, IOError, OSError, RuntimeError) as exc:
             stderr('Sorry, we hit a snag: {}'.format(exc))
@@ -0,0 +1,182 @@
+"""Indexed local store of the SUSE CVE feeds used by check-kernel-fix
+
+The security team publishes which bug tracks a CVE (cve2bugzilla) and the
+CVSS score SUSE assigned to it (suse-cvss-scores.yaml) as flat files.
+CveDB downloads them into the check-kernel-fix cache directory, the same
+files and expiry the shell helpers in scripts/common-functions always
+used, and imports them into an SQLite database whenever the downloaded
+file changes, so that looking up a CVE is an index lookup instead of a
+grep over the whole feed:
+
+    db = CveDB()
+    db.bugs(['CVE-2024-26581', 'CVE-2024-26582'])
+    -> {'CVE-2024-26581': 1220337, 'CVE-2024-26582': 1220338}
+"""
+#
+# vim:set et ts=8 sw=4:
+#
+
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import urllib.request
+
+from kutil.config import default_cache_path
+
+CACHE_DIR = 'check-kernel-fix'
+
+# SQLite of old distributions limits the number of host parameters
+_SQL_CHUNK = 500
+
+# cve2bugzilla lists one or more bugs per CVE, the first listed is the
+# primary one
+_BUG_LINE = re.compile(r'^(CVE-[0-9]+-[0-9]+),.*?BUGZILLA:([0-9]+)')
+_SCORE_KEY = re.compile(r'''^['"]?(CVE-[0-9]+-[0-9]+)['"]?:''')
+# how many lines after the CVE key the score may appear
+_SCORE_LINES = 3
+
+
+class CveDBError(Exception):
+    pass
+
+
+def parse_cve2bugzilla(f):
+    """Yield (cve, bug) pairs of the cve2bugzilla feed, the primary bug of each CVE only"""
+    seen = set()
+    for line in f:
+        m = _BUG_LINE.match(line)
+        if m and m.group(1) not in seen:
+            seen.add(m.group(1))
+            yield m.group(1), int(m.group(2))
+
+
+def parse_cvss_scores(f):
+    """Yield (cve, score) pairs of the suse-cvss-scores.yaml feed
+
+    The file is far too large to load it with a YAML parser on every
+    update, the score is the first score: line within a few lines of the
+    CVE key instead"""
+    cve, left = None, 0
+    for line in f:
+        m = _SCORE_KEY.match(line)
+        if m:
+            cve, left = m.group(1), _SCORE_LINES
+            continue
+        if not left:
+            continue
+        left -= 1
+        key, _, value = line.partition(':')
+        if key.strip() == 'score':
+            yield cve, value.strip().strip('\'"')
+            left = 0
+
+
+class Feed:
+    def __init__(self, name, url, expire, table, parse):
+        self.name = name
+        self.url = url
+        self.expire = expire
+        self.table = table
+        self.parse = parse
+
+
+# The file names are shared with fetch_cve2bugzilla and fetch_cve2cvss
+FEEDS = {
+    'bugs': Feed('cve2bugzilla',
+                 'https://gitlab.suse.de/security/cve-database/-/raw/master/data/cve2bugzilla',
+                 1, 'bugs', parse_cve2bugzilla),
+    'scores': Feed('cve2cvss',
+                   'http://ftp.suse.com/pub/projects/security/yaml/suse-cvss-scores.yaml',
+                   1, 'scores', parse_cvss_scores),
+}
+
+
+class CveDB:
+    """CVE to bug and CVE to CVSS score lookups, see the module documentation
+
+    cache_dir   directory of the downloaded feeds and of the database,
+                defaults to the check-kernel-fix cache directory
+    refresh     download the feeds again on first use even if they did not
+                expire yet
+    """
+    def __init__(self, cache_dir=None, refresh=False):
+        self.cache_dir = cache_dir or default_cache_path(CACHE_DIR)
+        self.refresh = refresh
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # check-kernel-fix runs in parallel, wait for a concurrent import
+        self._db = sqlite3.connect(os.path.join(self.cache_dir, 'cve.sqlite'), timeout=120)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS feeds (name TEXT PRIMARY KEY, stamp TEXT NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS bugs (cve TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS scores (cve TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._current = set()
+
+    def close(self):
+        self._db.close()
+
+    def feed_path(self, feed):
+        return os.path.join(self.cache_dir, feed.name)
+
+    def _fetch(self, feed):
+        path = self.feed_path(feed)
+        try:
+            st = os.stat(path)
+            if st.st_size and not self.refresh and time.time() - st.st_mtime < feed.expire * 86400:
+                return path
+        except OSError:
+            pass
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=feed.name + '.')
+        try:
+            with os.fdopen(fd, 'wb') as f, urllib.request.urlopen(feed.url, timeout=30) as r:
+                while True:
+                    chunk = r.read(1 << 20)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            os.replace(tmp, path)
+            tmp = None
+        except OSError as e:
+            # an outdated feed is still better than none
+            if not os.path.exists(path):
+                raise CveDBError('unable to fetch %s: %s' % (feed.url, e))
+        finally:
+            if tmp:
+                os.unlink(tmp)
+        return path
+
+    def update(self, feed):
+        """Download feed if it expired and import it if it changed since the last import"""
+        if feed.name in self._current:
+            return
+        path = self._fetch(feed)
+        st = os.stat(path)
+        stamp = '%d:%d' % (st.st_size, st.st_mtime_ns)
+        row = self._db.execute('SELECT stamp FROM feeds WHERE name = ?', (feed.name,)).fetchone()
+        if not row or row[0] != stamp:
+            with self._db, open(path, 'r', errors='replace') as f:
+                self._db.execute('DELETE FROM %s' % (feed.table,))
+                self._db.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?)' % (feed.table,),
+                                     feed.parse(f))
+                self._db.execute('INSERT OR REPLACE INTO feeds VALUES (?, ?)', (feed.name, stamp))
+        self._current.add(feed.name)
+
+    def _lookup(self, feed, cves):
+        self.update(feed)
+        cves = [c.upper() for c in cves]
+        ret = {}
+        for i in range(0, len(cves), _SQL_CHUNK):
+            chunk = cves[i:i + _SQL_CHUNK]
+            ret.update(self._db.execute('SELECT cve, value FROM %s WHERE cve IN (%s)' %
+                                        (feed.table, ','.join('?' * len(chunk))), chunk))
+        return ret
+
+    def bugs(self, cves):
+        """Return a dict of the primary bug number of those cves that have one"""
+        return self._lookup(FEEDS['bugs'], cves)
+
+    def scores(self, cves):
+        """Return a dict of the CVSS score string of those cves that have one"""
+        return self._lookup(FEEDS['scores'], cves)
@@ -0,0 +1,167 @@
+"""Data derived from git objects, kept on disk keyed by the object ids
+
+Git objects never change, so whatever is computed from one stays valid as
+long as the object id is the same. This is used for
+
+  - the commits referenced by the Git-commit and Alt-commit tags of the
+    patches in a kernel-source tree, read again only for patches whose blob
+    changed, including those changed in the worktree:
+
+        hashdict = get_hashdict('patches.suse', 'hashdict.json')
+        -> {'d7b6...': 'patches.suse/foo.patch', ...}
+
+  - the line statistics and the touched paths of commits:
+
+        stats = CommitStats(git.Repository(linux_git), 'commit-stats.json')
+        stats.get('v6.8-rc1')
+        -> {'added': 12, 'removed': 3, 'files': 2, 'paths': [...]}
+        stats.save()
+"""
+#
+# vim:set et ts=8 sw=4:
+#
+
+import os
+import string
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import kutil.pygit2_wrapper as git
+from kutil.config import git_blob_id, load_json, save_json
+
+HASHDICT_FORMAT = 1
+
+_TAGS = ('Git-commit: ', 'Alt-commit: ')
+_READ_BATCH = 256
+
+
+def _is_sha(s):
+    return all(c in string.hexdigits for c in s)
+
+
+def _read_batch(paths):
+    ret = dict()
+    for p in paths:
+        ret[p] = []
+        with open(p, 'r', errors='ignore') as f:
+            for l in f:
+                if l.startswith(_TAGS):
+                    sha = l.split()[1]
+                    if _is_sha(sha):
+                        ret[p].append(sha)
+    return ret
+
+
+def read_tags(path, names):
+    """Return a dict of the Git-commit and Alt-commit shas of each patch of names, relative to path"""
+    paths = [os.path.join(path, n) for n in names]
+    result = dict()
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(_read_batch, paths[i:i + _READ_BATCH]) for i in range(0, len(paths), _READ_BATCH)]
+        for f in as_completed(futures):
+            result.update(f.result())
+    return result
+
+
+def patch_blobs(path, cache):
+    """Return a dict of the blob id of every file under path, relative to path
+
+    The ids are taken from the tree of HEAD and corrected by the changes in
+    the worktree, files which are the same as in HEAD are not read. The tree
+    part is kept in cache, a dict, and reused as long as the tree id is the
+    same. Raises git.GitError when path is not in a git repository."""
+    repo_path = git.discover_repository(path)
+    if not repo_path:
+        raise git.GitError(f'{path} is not in a git repository')
+    repo = git.Repository(repo_path)
+    workdir = os.path.realpath(repo.workdir)
+    rel = os.path.relpath(os.path.realpath(path), workdir).replace(os.sep, '/')
+    prefix = '' if rel == '.' else rel + '/'
+    try:
+        tree = repo.revparse_single(f'HEAD:{rel}' if prefix else 'HEAD^{tree}')
+    except KeyError:
+        tree = None
+    tree_id = str(tree.id) if tree else None
+    if cache.get('tree') != tree_id or 'files' not in cache:
+        files = dict()
+        stack = [('', tree)] if tree else []
+        while stack:
+            p, t = stack.pop()
+            for e in t:
+                if e.type_str == 'tree':
+                    stack.append((f'{p}{e.name}/', repo[e.id]))
+                elif e.type_str == 'blob':
+                    files[p + e.name] = str(e.id)
+        cache['tree'], cache['files'] = tree_id, files
+    ret = dict(cache['files'])
+    for p in repo.status():
+        if not p.startswith(prefix):
+            continue
+        name = p[len(prefix):]
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            ret[name] = git_blob_id(full)
+        else:
+            ret.pop(name, None)
+    return ret
+
+
+def get_hashdict(path, cache_path):
+    """Map every commit referenced by a Git-commit or Alt-commit tag of a patch under path to the patch
+
+    The tags of each patch blob are kept in cache_path, so only the patches
+    changed since the last call are read. Raises git.GitError when path is
+    not in a git repository, see read_all_tags."""
+    cache = load_json(cache_path)
+    if not isinstance(cache, dict) or cache.get('format') != HASHDICT_FORMAT:
+        cache = { 'format': HASHDICT_FORMAT, 'blobs': dict() }
+    tree_id = cache.get('tree')
+    files = patch_blobs(path, cache)
+    blobs = cache['blobs']
+    missing = [f for f, blob in files.items() if blob not in blobs]
+    if missing:
+        for p, shas in read_tags(path, missing).items():
+            blobs[files[os.path.relpath(p, path)]] = shas
+    if missing or tree_id != cache['tree']:
+        used = set(files.values())
+        cache['blobs'] = dict((b, shas) for b, shas in blobs.items() if b in used)
+        save_json(cache_path, cache)
+    return dict((sha, os.path.join(path, f)) for f, blob in files.items() for sha in blobs[blob])
+
+
+def read_all_tags(path):
+    """get_hashdict without a cache, reading every file under path"""
+    names = [os.path.relpath(os.path.join(d, f), path) for d, _, fs in os.walk(path) for f in fs]
+    return dict((sha, p) for p, shas in read_tags(path, names).items() for sha in shas)
+
+
+class CommitStats:
+    """Line statistics and touched paths of the commits of repo, kept in
+    cache_path across runs
+
+    libgit2 counts the lines and lists the files itself, there is no need to
+    render the patch text for this."""
+    def __init__(self, repo, cache_path=None):
+        self.repo = repo
+        self.cache_path = cache_path
+        self.stats = (load_json(cache_path) if cache_path else None) or dict()
+        self.new_stats = dict()
+
+    def get(self, h):
+        """Return a dict of the lines added and removed, the number of files changed and the
+        paths not deleted by commit h"""
+        commit_id = str(self.repo.revparse_single(h).peel(git.Commit).id)
+        if commit_id not in self.stats:
+            diff = self.repo.diff(self.repo.revparse_single(commit_id + '^'), self.repo.revparse_single(commit_id))
+            stats = diff.stats
+            self.stats[commit_id] = self.new_stats[commit_id] = {
+                'added': stats.insertions,
+                'removed': stats.deletions,
+                'files': stats.files_changed,
+                'paths': sorted(set(d.new_file.path for d in diff.deltas if d.status_char() != 'D')) }
+        return self.stats[commit_id]
+
+    def save(self):
+        """Store the new statistics, merged with what other runs may have stored in the meantime"""
+        if self.cache_path and self.new_stats:
+            save_json(self.cache_path, { **(load_json(self.cache_path) or dict()), **self.new_stats })
+            self.new_stats = dict()
@@ -0,0 +1,164 @@
+"""Run memory-hungry shell jobs in parallel as the available memory permits
+
+Jobs like check-kernel-fix are limited by memory rather than by cores, so
+MemoryScheduler admits a new job only if its expected peak RSS fits. The
+estimate is the largest peak seen so far, but never less than
+JOB_RSS_GUESS, as a job ending before its RSS was sampled seems to need
+nothing. It has to fit into MemAvailable minus MEMORY_RESERVE and what
+the running jobs may still grow by, and into the optional budget of all the
+jobs together. A job is always admitted when nothing runs. The RSS of each
+job is sampled from its whole process tree:
+
+    scheduler = MemoryScheduler(max_workers=8, budget=parse_size('16G'))
+    for job, res, wall, peak in scheduler.run([('make', 'make.log')]):
+        ...
+"""
+#
+# vim:set et ts=8 sw=4:
+#
+
+import os
+import subprocess
+import tempfile
+import time
+
+JOB_RSS_GUESS = 1 << 30
+MEMORY_RESERVE = 1 << 30
+POLL_INTERVAL = 0.5
+
+_UNITS = { 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40 }
+
+
+def parse_size(size):
+    """Return the number of bytes of size, a number optionally followed by K, M, G or T"""
+    unit = _UNITS.get(size[-1:].upper(), None)
+    r = int(size[:-1] if unit else size) * (unit or 1)
+    if r < 1:
+        raise ValueError('%s is less than one byte' % (size,))
+    return r
+
+
+def format_size(n):
+    return f'{n / (1 << 20):.0f} MiB'
+
+
+def read_meminfo(key):
+    """Return the value of key in /proc/meminfo in bytes, None if unknown"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for l in f:
+                if l.startswith(key + ':'):
+                    return int(l.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def tree_rss(pids):
+    """Return a dict of the sum of the RSS of each of pids and all their descendants,
+    from one scan of /proc"""
+    children, rss = dict(), dict()
+    try:
+        for d in os.listdir('/proc'):
+            if not d.isdigit():
+                continue
+            try:
+                with open(f'/proc/{d}/stat', 'r') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            children.setdefault(int(fields[1]), []).append(int(d))
+            rss[int(d)] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        pass
+    ret = dict()
+    for pid in pids:
+        total, todo = 0, [pid]
+        while todo:
+            p = todo.pop()
+            total += rss.get(p, 0)
+            todo.extend(children.get(p, []))
+        ret[pid] = total
+    return ret
+
+
+class RunningJob:
+    """A job, a tuple of the shell command and its description, started with its
+    output going to temporary files"""
+    def __init__(self, job):
+        self.job = job
+        self.out = tempfile.TemporaryFile('w+')
+        self.err = tempfile.TemporaryFile('w+')
+        self.start = time.time()
+        self.proc = subprocess.Popen(job[0], shell=True, stdout=self.out, stderr=self.err, universal_newlines=True)
+        self.rss = 0
+        self.peak = 0
+
+    def sample(self, rss):
+        self.rss = rss
+        self.peak = max(self.peak, rss)
+
+    def poll(self):
+        """Return the CompletedProcess once the job is done, None while it is running"""
+        # the peak is sampled, ru_maxrss of the child would include the memory of the parent at the time of the fork
+        rc = self.proc.poll()
+        if rc is None:
+            return None
+        self.wall = time.time() - self.start
+        outputs = []
+        for f in (self.out, self.err):
+            f.seek(0)
+            outputs.append(f.read())
+            f.close()
+        return subprocess.CompletedProcess(self.job[0], rc, *outputs)
+
+
+class MemoryScheduler:
+    """Run jobs, at most max_workers of them at once, as the memory permits,
+    see the module documentation
+
+    max_workers the most jobs to run at once
+    budget      the memory all the running jobs may use together, in bytes
+    """
+    def __init__(self, max_workers, budget=None):
+        self.max_workers = max_workers
+        self.budget = budget
+        self.peaks = []
+        self.most_running = 0
+
+    def estimate(self):
+        return max(self.peaks + [JOB_RSS_GUESS])
+
+    def admit(self, running):
+        """Whether to start another job next to the running ones"""
+        if not running:
+            return True
+        if len(running) >= self.max_workers:
+            return False
+        need = self.estimate()
+        if self.budget and sum(max(need, r.rss) for r in running) + need > self.budget:
+            return False
+        available = read_meminfo('MemAvailable')
+        if available is None:
+            return True
+        growth = sum(max(0, need - r.rss) for r in running)
+        return need + growth + MEMORY_RESERVE <= available
+
+    def run(self, jobs):
+        """Yield (job, CompletedProcess, wall time, peak RSS) of jobs as they finish"""
+        pending = list(reversed(jobs))
+        running = []
+        while pending or running:
+            while pending and self.admit(running):
+                running.append(RunningJob(pending.pop()))
+            self.most_running = max(self.most_running, len(running))
+            time.sleep(POLL_INTERVAL)
+            rss = tree_rss([r.proc.pid for r in running])
+            for r in list(running):
+                # the last sample before the job is reaped, its process tree is gone afterwards
+                r.sample(rss[r.proc.pid])
+                res = r.poll()
+                if res is not None:
+                    running.remove(r)
+                    self.peaks.append(r.peak)
+                    yield r.job, res, r.wall, r.peak
@@ -0,0 +1,136 @@
+"""CVE index of the kernel CNA vulnerability database (vulns.git)
+
+The vulns.git tree keeps one set of files per CVE, e.g.
+
+    cve/published/2024/CVE-2024-26581.sha1        the fixing commit(s)
+    cve/published/2024/CVE-2024-26581.vulnerable  the breaking commit(s)
+    cve/rejected/2024/CVE-2024-26583.sha1
+
+Finding the files of a CVE, or the CVE of a commit, means walking the
+whole tree. VulnsIndex walks it once per tree id and stores the content
+of the .sha1 and .vulnerable files in an SQLite database, indexed both by
+CVE and by sha, so lookups are cheap from then on:
+
+    index = VulnsIndex(os.environ['VULNS_GIT'])
+    index.lookup(['CVE-2024-26581'])
+    -> {'CVE-2024-26581': {'published': ['d7b6...'], 'vulnerable': [...]}}
+"""
+#
+# vim:set et ts=8 sw=4:
+#
+
+import os
+import re
+import sqlite3
+import time
+
+import kutil.pygit2_wrapper as git
+from kutil.config import default_cache_path
+from kutil.cvedb import CACHE_DIR
+
+_CVE_FILE = re.compile(r'^(CVE-[0-9]+-[0-9]+)\.(sha1|vulnerable)$')
+
+# SQLite of old distributions limits the number of host parameters
+_SQL_CHUNK = 500
+
+# how many indexed trees to keep, e.g. HEAD and origin/master
+_KEEP_TREES = 4
+
+
+# the file suffix and the top directory of the file decide the kind of entry
+def _kind(top, suffix):
+    if suffix == 'vulnerable':
+        return 'vulnerable'
+    if top in ('published', 'rejected'):
+        return top
+    return None
+
+
+def walk_vulns_tree(repo, tree):
+    """Yield (cve, kind, sha) of all the commits listed in the cve/ directory of tree"""
+    try:
+        cve_tree = repo[tree['cve'].id]
+    except KeyError:
+        return
+    stack = [(None, cve_tree)]
+    while stack:
+        top, t = stack.pop()
+        for e in t:
+            if e.type_str == 'tree':
+                stack.append((top or e.name, repo[e.id]))
+                continue
+            m = _CVE_FILE.match(e.name)
+            kind = m and _kind(top, m.group(2))
+            if kind:
+                for sha in repo[e.id].data.decode('ascii', errors='replace').split():
+                    yield m.group(1), kind, sha
+
+
+class VulnsIndex:
+    """CVE to commit and commit to CVE lookups in a vulns.git clone, see
+    the module documentation
+
+    path        the vulns.git clone
+    rev         which tree of the clone to index, the checkout by default
+    db_path     SQLite database of the index, shared by all clones
+    """
+    def __init__(self, path, rev='HEAD', db_path=None):
+        self.repo = git.Repository(path)
+        self.tree = str(self.repo.revparse_single(rev).peel(git.Tree).id)
+        self.db_path = db_path or os.path.join(default_cache_path(CACHE_DIR), 'vulns.sqlite')
+        cache_dir = os.path.dirname(os.path.abspath(self.db_path))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self._db = sqlite3.connect(self.db_path, timeout=120)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS trees (tree TEXT PRIMARY KEY, used REAL NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries (tree TEXT NOT NULL, cve TEXT NOT NULL, kind TEXT NOT NULL, sha TEXT NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_cve ON entries (tree, cve)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_sha ON entries (tree, sha)')
+        self._update()
+
+    def close(self):
+        self._db.close()
+
+    def _update(self):
+        with self._db:
+            known = self._db.execute('UPDATE trees SET used = ? WHERE tree = ?', (time.time(), self.tree)).rowcount
+            if known:
+                return
+            self._db.execute('DELETE FROM entries WHERE tree = ?', (self.tree,))
+            self._db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?)',
+                                 ((self.tree, cve, kind, sha) for cve, kind, sha in
+                                  walk_vulns_tree(self.repo, self.repo[self.tree])))
+            self._db.execute('INSERT INTO trees VALUES (?, ?)', (self.tree, time.time()))
+            old = [r[0] for r in self._db.execute('SELECT tree FROM trees ORDER BY used DESC')][_KEEP_TREES:]
+            for t in old:
+                self._db.execute('DELETE FROM entries WHERE tree = ?', (t,))
+                self._db.execute('DELETE FROM trees WHERE tree = ?', (t,))
+
+    def lookup(self, cves):
+        """Return a dict of the kinds of commits of each of cves listed in the tree
+
+        The values are dicts of 'published', 'rejected' and 'vulnerable' to
+        the list of commits in the file order"""
+        cves = [c.upper() for c in cves]
+        ret = {}
+        for i in range(0, len(cves), _SQL_CHUNK):
+            chunk = cves[i:i + _SQL_CHUNK]
+            for cve, kind, sha in self._db.execute(
+                    'SELECT cve, kind, sha FROM entries WHERE tree = ? AND cve IN (%s) ORDER BY rowid' %
+                    ','.join('?' * len(chunk)), [self.tree] + chunk):
+                ret.setdefault(cve, {}).setdefault(kind, []).append(sha)
+        return ret
+
+    def cve2sha(self, cve):
+        """Return the fixing commits of cve, published or rejected"""
+        entry = self.lookup([cve]).get(cve.upper(), {})
+        return entry.get('published') or entry.get('rejected') or []
+
+    def sha2cve(self, sha):
+        """Return the CVEs fixed by commits starting with sha, published or rejected"""
+        sha = sha.lower()
+        cur = self._db.execute(
+            'SELECT DISTINCT cve FROM entries WHERE tree = ? AND sha BETWEEN ? AND ? AND kind != ? ORDER BY cve',
+            (self.tree, sha, sha + '~', 'vulnerable'))
+        return [r[0] for r in cur]
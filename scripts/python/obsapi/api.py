@@ -1,16 +1,26 @@
 from www_authenticate import www_authenticate
+from kutil.config import load_json, save_json
+import concurrent.futures
 import urllib.request
+import collections
+import contextlib
 import urllib.parse
+import urllib.error
 import email.policy
 import http.client
 import binascii
+import hashlib
 import certifi
 import base64
+import threading
+import select
 import email
 import json
+import time
 import yaml
 import ssl
 import sys
+import os
 
 class APIError(RuntimeError):
     def __init__(self, *args, status=None, **kwargs):
@@ -25,6 +35,23 @@ def _read_content(r):  # this could be a lambda in python 3.8 with walrus operat
     return r._read_data
 setattr(http.client.HTTPResponse, 'content', property(_read_content))
 setattr(http.client.HTTPResponse, 'text', property(lambda r: r.content.decode()))  # FIXME encoding
+
+def _iter_content(r, chunk_size=1 << 16):
+    if hasattr(r, '_read_data'):  # already read for logging
+        yield r._read_data
+        return
+    while True:
+        chunk = r.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+http.client.HTTPResponse.iter_content = _iter_content
+
+def _discard(r):
+    # the rest of the body is not read, the connection cannot be reused
+    r.will_close = True
+    r.close()
+http.client.HTTPResponse.discard = _discard
 http.client.HTTPResponse.json = lambda r: json.loads(r.text)  # FIXME content type
 
 def parse_content_type(content_type):
@@ -72,20 +99,321 @@ class NonRaisingHTTPErrorProcessor(urllib.request.HTTPErrorProcessor):
     https_response = http_response
 
 class SavingHTTPCookieProcessor(urllib.request.HTTPCookieProcessor):
+    def __init__(self, cookiejar=None):
+        super().__init__(cookiejar)
+        self._save_lock = threading.Lock()  # responses to concurrent requests
+
     # another completely undocumented API
     def http_response(self, request, response):  # Only override cookie extraction, adding is handled by base
         if 'Set-Cookie' in response.headers:  # Unlike base don't bother if the header is not present
-            self.cookiejar.extract_cookies(response, request)
-            try:
-                self.cookiejar.save()  # Presumably some cookie was extracted, save it to disk
-            except Exception as e:
-                sys.stderr.write("Error saving cookies: %s\n" % (repr(e),))
+            with self._save_lock:
+                self.cookiejar.extract_cookies(response, request)
+                try:
+                    self.cookiejar.save()  # Presumably some cookie was extracted, save it to disk
+                except Exception as e:
+                    sys.stderr.write("Error saving cookies: %s\n" % (repr(e),))
         return response
     https_response = http_response
 
+class Metrics:
+    """Per request measurements and named phase timers, shared by the APIs used for one task"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = []
+        self.phases = collections.OrderedDict()
+
+    def add_request(self, method, path, status, sent, received, duration, retries):
+        with self._lock:
+            self.requests.append({
+                'method': method,
+                'path': path,
+                'status': status,
+                'sent': sent,
+                'received': received,
+                'duration': round(duration, 6),
+                'retries': retries,
+                })
+
+    def add_time(self, phase, duration):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0) + duration
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.monotonic() - start)
+
+    def summary(self):
+        """Requests grouped by method and path template in the order first seen"""
+        groups = collections.OrderedDict()
+        with self._lock:
+            requests = list(self.requests)
+        for r in requests:
+            g = groups.setdefault((r['method'], r['path']), {
+                'method': r['method'], 'path': r['path'], 'count': 0, 'errors': 0, 'retries': 0,
+                'sent': 0, 'received': 0, 'duration': 0, 'max_duration': 0 })
+            g['count'] += 1
+            g['errors'] += 1 if r['status'] >= 400 else 0
+            g['retries'] += r['retries']
+            g['sent'] += r['sent']
+            g['received'] += r['received']
+            g['duration'] += r['duration']
+            g['max_duration'] = max(g['max_duration'], r['duration'])
+        return list(groups.values())
+
+    def format_summary(self):
+        lines = []
+        if self.phases:
+            lines.append('%-24s %10s' % ('phase', 'seconds'))
+            for phase, duration in self.phases.items():
+                lines.append('%-24s %10.3f' % (phase, duration))
+            lines.append('')
+        lines.append('%5s %6s %7s %12s %12s %9s %8s  %s' % ('count', 'errors', 'retries', 'sent', 'received', 'seconds', 'max', 'request'))
+        for g in self.summary():
+            lines.append('%5i %6i %7i %12i %12i %9.3f %8.3f  %s %s' % (g['count'], g['errors'], g['retries'], g['sent'], g['received'],
+                                                                      g['duration'], g['max_duration'], g['method'], g['path']))
+        return '\n'.join(lines) + '\n'
+
+    def json(self):
+        return { 'phases': dict(self.phases), 'summary': self.summary(), 'requests': list(self.requests) }
+
+class StreamingBody:
+    """Request body generated piecewise while it is being sent
+
+    parts is a list of bytes and (pathname, size) tuples. Files are sent base64
+    encoded, read in chunks, so the memory needed does not depend on the file
+    size. The length is known in advance, the body is sent with Content-Length.
+    The body can be iterated repeatedly, eg. when a request is re-sent."""
+    chunk = 3 * (1 << 18)  # multiple of 3 so that the base64 encoded chunks can be concatenated
+
+    def __init__(self, parts, description=None, metrics=None):
+        self.parts = parts
+        self.description = description
+        self.metrics = metrics
+
+    def __len__(self):
+        length = 0
+        for part in self.parts:
+            if isinstance(part, bytes):
+                length += len(part)
+            else:
+                length += 4 * ((part[1] + 2) // 3)
+        return length
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                with open(part[0], 'rb') as fd:
+                    for data in iter(lambda: fd.read(self.chunk), b''):
+                        start = time.monotonic()
+                        data = base64.standard_b64encode(data)
+                        if self.metrics:
+                            self.metrics.add_time('base64', time.monotonic() - start)
+                        yield data
+
+    def __bytes__(self):
+        return b''.join(self)
+
+class KeepAliveHTTPSHandler(urllib.request.HTTPSHandler):
+    """HTTPS handler keeping connections open for reuse by following requests to the same host
+
+    A connection is returned to the pool only once its response has been read
+    completely, the pool holds idle connections only. A response closed before
+    its end makes the connection close. Connections idle for longer than
+    idle_timeout or closed by the server are not reused. Requests other than
+    resend_methods always get a new connection; an idempotent request on a
+    reused connection that the server closed in the meantime is re-sent on a
+    new one."""
+    max_idle = 4  # per host
+    idle_timeout = 4  # seconds, below the keep-alive timeout of common servers
+    resend_methods = {'GET', 'HEAD', 'OPTIONS'}
+
+    def __init__(self, context):
+        super().__init__(context=context)
+        self._ssl_context = context
+        self._pool = {}
+        self._lock = threading.Lock()
+
+    def _get_connection(self, host, timeout, reuse=True):
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._pool.get(host, [])
+            while reuse and idle and not conn:
+                conn, since = idle.pop()
+                if time.monotonic() - since > self.idle_timeout or self._dropped(conn):
+                    stale.append(conn)
+                    conn = None
+        for c in stale:
+            c.close()
+        return conn or http.client.HTTPSConnection(host, context=self._ssl_context, timeout=timeout)
+
+    @staticmethod
+    def _dropped(conn):
+        # an idle connection is readable only when the server closed it (or sent garbage)
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def _put_connection(self, host, conn):
+        with self._lock:
+            idle = self._pool.setdefault(host, [])
+            idle.append((conn, time.monotonic()))
+            evicted = idle[0:-self.max_idle]
+            del idle[0:-self.max_idle]
+        for c, _ in evicted:
+            c.close()
+
+    def _release_on_close(self, host, conn, r):
+        # http.client calls _close_conn when the body has been read, close() calls it early
+        close_conn = r._close_conn
+        close = r.close
+
+        def release():
+            close_conn()
+            if r.will_close:
+                conn.close()
+            else:
+                self._put_connection(host, conn)
+
+        def early_close():
+            if not r.isclosed():
+                r.will_close = True
+            close()
+
+        r._close_conn = release
+        r.close = early_close
+
+    def close(self):
+        with self._lock:
+            pool = self._pool
+            self._pool = {}
+        for idle in pool.values():
+            for conn, _ in idle:
+                conn.close()
+
+    def https_open(self, req):
+        if req._tunnel_host:  # proxied, not worth the trouble
+            return self.do_open(http.client.HTTPSConnection, req, context=self._ssl_context)
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict([(k, v) for k, v in req.headers.items() if k not in headers]))
+        headers = dict([(name.title(), val) for name, val in headers.items()])
+        host = req.host
+        method = req.get_method()
+        # a request the server may have processed before closing the connection is never sent on a reused one
+        conn = self._get_connection(host, req.timeout, reuse=method in self.resend_methods)
+        reused = conn.sock is not None
+        resent = False
+        try:
+            conn.request(method, req.selector, req.data, headers)
+            r = conn.getresponse()
+        except (ConnectionError, http.client.HTTPException) as err:
+            conn.close()
+            if not reused:
+                raise urllib.error.URLError(err)
+            # stale keep-alive connection closed by the server, safe to send again
+            reused = False
+            resent = True
+            conn = http.client.HTTPSConnection(host, context=self._ssl_context, timeout=req.timeout)
+            try:
+                conn.request(method, req.selector, req.data, headers)
+                r = conn.getresponse()
+            except OSError as err:
+                conn.close()
+                raise urllib.error.URLError(err)
+        except OSError as err:
+            conn.close()
+            raise urllib.error.URLError(err)
+        if not r.will_close:
+            self._release_on_close(host, conn, r)
+        r.url = req.get_full_url()
+        r.msg = r.reason
+        r.reused = reused
+        r.resent = resent
+        return r
+
+class HTTPCache:
+    """On-disk cache of GET responses carrying an ETag or Last-Modified validator
+
+    Cached responses are never used without asking the server, the request is
+    sent with If-None-Match/If-Modified-Since and a 304 reply is answered from
+    disk. Each URL is stored in a file of its own which is replaced atomically
+    so the cache can be shared by concurrently running processes."""
+    format = 2
+    validators = [('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since')]
+    # only what revalidation and the callers need, never cookies or credentials
+    stored_headers = ['ETag', 'Last-Modified', 'Content-Type', 'X-Total-Count']
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def entry_path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def lookup(self, url):
+        path = self.entry_path(url)
+        entry = load_json(path)
+        if isinstance(entry, dict) and entry.get('format', None) != self.format:
+            with contextlib.suppress(OSError):
+                os.unlink(path)  # older formats may hold cookies
+            return None
+        if not isinstance(entry, dict) or entry.get('url', None) != url:
+            return None
+        return entry
+
+    def conditional_headers(self, entry):
+        headers = {}
+        for validator, condition in self.validators:
+            for name, value in entry['headers']:
+                if name.lower() == validator.lower():
+                    headers[condition] = value
+        return headers
+
+    def store(self, url, r):
+        if 'no-store' in r.headers.get('Cache-Control', ''):
+            return
+        if not [v for v, c in self.validators if v in r.headers]:
+            return
+        save_json(self.entry_path(url), {
+            'format': self.format,
+            'url': url,
+            'status': r.status,
+            'reason': r.reason,
+            'headers': [(name, value) for name, value in r.headers.items()
+                        if name.lower() in [h.lower() for h in self.stored_headers]],
+            'body': base64.standard_b64encode(r.content).decode(),
+            })
+
+    def restore(self, r, entry):
+        """Turn a 304 response into the cached one"""
+        _ = r.content  # 304 has no body, finish reading the reply
+        headers = http.client.HTTPMessage()
+        for name, value in entry['headers']:
+            headers[name] = value
+        for name in [v for v, c in self.validators] + ['Date', 'Cache-Control', 'Expires']:
+            if name in r.headers:
+                del headers[name]
+                headers[name] = r.headers[name]
+        r.headers = headers
+        r.status = entry['status']
+        r.reason = r.msg = entry['reason']
+        r._read_data = base64.standard_b64decode(entry['body'])
+        r.from_cache = True
+
 class API:
-    def __init__(self, URL, logfile, ca=None):
+    batch_in_flight = 4  # default concurrency of batch(), matches the idle connections kept per host
+
+    def __init__(self, URL, logfile, ca=None, http_cache=None):
         self.url = URL
+        self.http_cache = HTTPCache(http_cache) if http_cache else None
+        self.metrics = Metrics()
         if not ca:
             ca = certifi.where()
         self.ca = ca
@@ -97,6 +425,8 @@ class API:
                 logfile = open(logfile, 'a')
                 self._to_close = logfile
         self.logfile = logfile
+        self._log_lock = threading.Lock()
+        self._batch_local = threading.local()
         if hasattr(ssl, 'PROTOCOL_TLS_SERVER'):
             context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
         else:  # SLE 12
@@ -108,10 +438,12 @@ class API:
             cp = SavingHTTPCookieProcessor(self.cookiejar)
         else:
             cp = urllib.request.HTTPCookieProcessor()
-        self._opener = urllib.request.build_opener(urllib.request.HTTPSHandler(context=context),
-                                                   NonRaisingHTTPErrorProcessor(), cp)
+        self._https_handler = KeepAliveHTTPSHandler(context)
+        self._opener = urllib.request.build_opener(self._https_handler, NonRaisingHTTPErrorProcessor(), cp)
 
     def __del__(self):
+        if hasattr(self, '_https_handler'):
+            self._https_handler.close()
         if hasattr(self, '_to_close') and self._to_close:
             self._to_close.close()
 
@@ -176,6 +508,12 @@ class API:
         return result
 
     def format_request(self, method, path, args, r):
+        body = r.request.data
+        if isinstance(body, StreamingBody):
+            # logging a streamed request needs the whole body in memory
+            args = dict(args)
+            args['data'] = body.description
+            body = bytes(body)
         data = {
             'method': method,
             'path': path,
@@ -185,12 +523,14 @@ class API:
             'encoding': r.encoding,
             'headers': self.redact_cookies_hdr(r.headers),
             'url': r.url,
+            'duration': round(r.duration, 6),
+            'connection': 'reused' if getattr(r, 'reused', False) else 'new',
             'request': {
                 'url': r.request.full_url,
                 'method': r.request.method,
                 'headers': self.redact_auth_hdrs(r.request.headers),
                 'unredirected_hdrs': self.redact_auth_hdrs(r.request.unredirected_hdrs),
-                'body': r.request.data,
+                'body': body,
                 }}
         try:
             data['json'] = r.json()
@@ -203,11 +543,13 @@ class API:
         return '---\n' + yaml.dump(self.redact_content(data))
 
     def log(self, method, path, args, r):
-        self.logfile.write(self.format_request(method, path, args, r))
+        entry = self.format_request(method, path, args, r)
+        with self._log_lock:  # requests may be issued from several threads
+            self.logfile.write(entry)
 
     def call(self, method, path, **kwargs):
         for arg in kwargs.keys():
-            if arg not in ['data', 'json', 'params', 'headers', 'redirected', 'reauthenticated']:
+            if arg not in ['data', 'json', 'params', 'headers', 'stream', 'attempt', 'redirected', 'reauthenticated']:
                 raise ValueError('Unexpected argumen %s' % (arg,))
         if len(path) > 0 and path[0] != '/':
             raise ValueError('Path has to start with /')
@@ -237,15 +579,36 @@ class API:
             params = ''
         if isinstance(data, str):
             data = data.encode()
+        if isinstance(data, StreamingBody):
+            headers['Content-Length'] = str(len(data))
         if not kwargs.get('reauthenticated', None) and not hasattr(self, 'cookiejar'):  # LWPCookieJar is false :/
             kwargs['reauthenticated'] = True  # Only try to authenticate once per request
             headers.update(self.auth_header({}))
+        cached = None
+        if self.http_cache and method == 'GET':
+            cached = self.http_cache.lookup(self.url + path + params)
+            if cached:
+                headers.update(self.http_cache.conditional_headers(cached))
         req = urllib.request.Request(method=method, url=self.url + path + params, data=data, headers=headers)
+        start = time.monotonic()
         r = self._opener.open(req)
+        r.duration = time.monotonic() - start  # until the response headers are received
         r.request = req
         r.method = method
+        if not kwargs.get('stream', None):
+            _ = r.content  # the connection goes back to the pool once the response is read
+        if hasattr(r, '_read_data'):
+            received = len(r._read_data)
+        else:
+            received = int(r.headers.get('Content-Length', None) or 0)
+        self.metrics.add_request(method, self.path_template(path), r.status, len(data) if data else 0, received,
+                                 time.monotonic() - start, kwargs.get('attempt', 0) + (1 if getattr(r, 'resent', False) else 0))
         if self.logfile:
             self.log(method, path, kwargs, r)
+        if cached and r.status == 304:
+            self.http_cache.restore(r, cached)
+        elif self.http_cache and method == 'GET' and r.status == 200:
+            self.http_cache.store(self.url + path + params, r)
         if not kwargs.get('reauthenticated', None) and r.status == 401:
             kwargs['reauthenticated'] = True  # Only try to authenticate once per request
             wwwa = {}
@@ -254,6 +617,8 @@ class API:
             headers = dict(kwargs.get('headers', {}))
             headers.update(self.auth_header(wwwa))
             kwargs['headers'] = headers
+            kwargs['attempt'] = kwargs.get('attempt', 0) + 1
+            _ = r.content
             return self.call(method, path, **kwargs)
         if not kwargs.get('redirected', None) and r.status in [301, 302, 303, 307, 308] and method in ['GET', 'HEAD']:
             if r.headers.get('location', None) or r.headers.get('uri', None):
@@ -263,9 +628,44 @@ class API:
                 else:
                     url = r.headers['uri']
                 path = urllib.parse.urlparse(url).path  # no cross-host redirect support
+            _ = r.content
             return self.call(method, path, **kwargs)
         return r
 
+    def path_template(self, path):
+        """path with the variable parts replaced by placeholders, for grouping request metrics"""
+        return path.split('?', 1)[0]
+
+    def batch(self, fn, keys, in_flight=None, return_exceptions=False):
+        """Call fn for each key in a thread pool and return a dictionary key -> result
+
+        A key is a tuple of arguments or a single argument. At most in_flight
+        calls run at a time, all of them share this object with its connections,
+        cookies and authentication. A batch started by fn runs its calls one at
+        a time so that nested batches do not multiply the requests in flight.
+        The exception of the first failed key is raised unless return_exceptions
+        is set, then it is returned as the result."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        in_flight = in_flight if in_flight else self.batch_in_flight
+        if getattr(self._batch_local, 'running', False):
+            in_flight = 1
+
+        def run(key):
+            self._batch_local.running = True
+            return fn(*key) if isinstance(key, tuple) else fn(key)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(in_flight, len(keys)))) as executor:
+            futures = [(key, executor.submit(run, key)) for key in keys]
+        results = {}
+        for key, future in futures:
+            e = future.exception()
+            if e is not None and not return_exceptions:
+                raise e
+            results[key] = e if e is not None else future.result()
+        return results
+
     def get(self, path, **kwargs):
         return self.call('GET', path, **kwargs)
 
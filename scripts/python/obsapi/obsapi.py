@@ -60,12 +60,12 @@ def process_scmsync(sync_text):
     return PkgRepo(sync.scheme + '://' + sync.netloc, org, repo, branch, commit)
 
 class OBSAPI(api.API):
-    def __init__(self, URL, logfile=None, config=None, cookiejar=None, ca=None):
+    def __init__(self, URL, logfile=None, config=None, cookiejar=None, ca=None, http_cache=None):
         self.config = config
         URL = URL.rstrip('/')
         self.url = URL
         self.get_token(cookiejar)
-        super().__init__(URL, logfile, ca)
+        super().__init__(URL, logfile, ca, http_cache)
 
     def get_token(self, cookiejar):
         if self.config == None:
@@ -166,6 +166,16 @@ class OBSAPI(api.API):
         raise RuntimeError('Authentication required but no usable credentials found\nRequested authorizarion: ' + str(dict(wwwa)) +
                            '\nAvailable credentials:  password: ' + str(not not self.passw) + '  SSH key: ' + str(not not self.sshkey))
 
+    def path_template(self, path):
+        parts = path.split('?', 1)[0].split('/')
+        if len(parts) > 2 and parts[1] == 'source':
+            for i, name in [(2, '{project}'), (3, '{package}'), (4, '{file}')]:
+                if len(parts) > i and not parts[i].startswith('_'):  # keep _meta, _link, ...
+                    parts[i] = name
+        elif len(parts) > 2 and parts[1] in ['group', 'person']:
+            parts[2] = '{name}'
+        return '/'.join(parts)
+
     def check_login(self):
         # This redirects creating 3 requests when not authenticated,
         # checking the relevant combinations of cookies and authentication
@@ -252,27 +262,69 @@ class OBSAPI(api.API):
             repo = PkgRepo(api, 'pool', package, None, None)
         return repo
 
+    def _iter_directory(self, path):
+        """Parse a directory listing while it is downloaded and yield (directory attributes, entry name)
+        Entries are dropped once parsed, stopping the iteration early closes the connection"""
+        r = self.check_get(path, stream=True)
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        root = None
+        attrib = None
+        depth = 0
+        done = False
+        try:
+            for chunk in r.iter_content():
+                parser.feed(chunk)
+                for event, e in parser.read_events():
+                    if event == 'start':
+                        depth += 1
+                        if root is None:
+                            root = e
+                            assert root.tag == 'directory'
+                            attrib = dict(root.attrib)
+                        continue
+                    depth -= 1
+                    if depth == 1:
+                        assert e.tag == 'entry'
+                        assert len(e.keys()) == 1
+                        yield (attrib, e.get('name'))
+                        root.clear()
+            parser.close()
+            done = True
+        finally:
+            if not done:
+                r.discard()
+
+    def iter_projects(self):
+        for attrib, name in self._iter_directory('/source'):
+            assert len(attrib) == 0
+            yield name
+
     def list_projects(self):
-        xml = ET.fromstring(self.check_get('/source').content)
-        assert xml.tag == 'directory'
-        assert len(xml.keys()) == 0
-        result = []
-        for e in xml.iter('entry'):
-            assert len(e.keys()) == 1
-            result.append(e.get('name'))
-        assert len(xml) == len(result)
-        return result
+        return list(self.iter_projects())
+
+    def iter_project_packages(self, project):
+        count = 0
+        attrib = {}
+        for attrib, name in self._iter_directory('/source/' + project):
+            assert len(attrib) == 1
+            count += 1
+            yield name
+        assert count == int(attrib.get('count', 0))
 
     def list_project_packages(self, project):
-        xml = ET.fromstring(self.check_get('/source/' + project).content)
-        assert xml.tag == 'directory'
-        assert len(xml.keys()) == 1
-        result = []
-        for e in xml.iter('entry'):
-            assert len(e.keys()) == 1
-            result.append(e.get('name'))
-        assert (len(xml) == len(result)) and (len(result) == int(xml.get('count')))
-        return result
+        return list(self.iter_project_packages(project))
+
+    def packages_exist(self, packages, in_flight=None, return_exceptions=False):
+        """package_exists() of many (project, package) pairs, concurrently"""
+        return self.batch(self.package_exists, packages, in_flight, return_exceptions)
+
+    def package_repos(self, packages, in_flight=None, return_exceptions=False):
+        """package_repo() of many (project, package) pairs, concurrently"""
+        return self.batch(self.package_repo, packages, in_flight, return_exceptions)
+
+    def packages_links(self, packages, in_flight=None, return_exceptions=False):
+        """list_package_links() of many (project, package) pairs, concurrently"""
+        return self.batch(self.list_package_links, packages, in_flight, return_exceptions)
 
     def list_package_links(self, project, package):
         xml = ET.fromstring(self.check_post('/source/' + project + '/' + package, params={'cmd': 'showlinked'}).content)
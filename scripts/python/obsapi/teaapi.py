@@ -1,12 +1,15 @@
-from kutil.config import init_repo, list_files
+from kutil.config import tar_up_dir, git_blob_id, load_json, save_json
 from obsapi import api
-import subprocess
-import tempfile
+import concurrent.futures
+import http.client
 import hashlib
 import base64
+import uuid
 import json
+import time
 import yaml
 import sys
+import re
 import os
 
 def maintainership_is_new_format(data):
@@ -41,13 +44,72 @@ def update_maintainership(data, package, maintainers):
         data[package] = maintainers
     return data
 
+def hash_content(pathname):
+    """Return the git blob id (sha256 object format) and the LFS oid of a file"""
+    oid = hashlib.sha256()
+    return (git_blob_id(pathname, 'sha256', oid), oid.hexdigest())
+
+class ContentHashCache:
+    """Git blob ids and LFS oids of local files keyed by path, size and mtime
+
+    With a path the cache is kept in a JSON file between uploads so that
+    files that did not change since the previous upload are not read again."""
+    format = 1
+
+    def __init__(self, path=None, workers=None):
+        self.path = path
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.data = load_json(path) if path else None
+        if not isinstance(self.data, dict) or self.data.get('format', None) != self.format:
+            self.data = {'format': self.format, 'files': {}}
+
+    def lookup(self, pathname, st):
+        entry = self.data['files'].get(pathname, None)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return (entry[2], entry[3])
+        return None
+
+    def hash_files(self, files):
+        """Hash the files (pathname -> stat result) not found in the cache in a thread pool
+        and return a dictionary pathname -> (blob id, LFS oid)"""
+        result = {}
+        missing = []
+        for pathname in files.keys():
+            hashes = self.lookup(pathname, files[pathname])
+            if hashes:
+                result[pathname] = hashes
+            else:
+                missing.append(pathname)
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for pathname, hashes in zip(missing, executor.map(hash_content, missing)):
+                    st = files[pathname]
+                    self.data['files'][pathname] = [st.st_size, st.st_mtime_ns, hashes[0], hashes[1]]
+                    result[pathname] = hashes
+            self.save()
+        return result
+
+    def save(self):
+        if self.path:
+            # drop files that no longer exist so that the cache does not grow indefinitely
+            for pathname in list(self.data['files'].keys()):
+                if not os.path.exists(pathname):
+                    del self.data['files'][pathname]
+            save_json(self.path, self.data)
+
 class TeaAPI(api.API):
-    def __init__(self, URL, logfile=None, config=None, ca=None, progress=sys.stderr):
+    def __init__(self, URL, logfile=None, config=None, ca=None, progress=sys.stderr, hash_cache=None,
+                 upload_batch_size=None, upload_retries=3, page_workers=4, http_cache=None):
         self._user = None
+        self.page_workers = max(1, page_workers)
+        self.upload_batch_size = upload_batch_size
+        self.upload_retries = upload_retries
         self.progress = progress
         self.config = config
+        self.hash_cache = ContentHashCache(hash_cache)
+        self._repo_cache = {}
         URL = URL.rstrip('/')
-        super().__init__(URL, logfile, ca)
+        super().__init__(URL, logfile, ca, http_cache)
         self.get_token()
 
     def get_token(self):
@@ -88,12 +150,17 @@ class TeaAPI(api.API):
         result = items
         if page_size != item_count:
             pages = int((item_count + page_size - 1)/page_size)  # ceil
-            for page in range(2, pages + 1):
-                items = self.check_get(url, params={
+
+            def get_page(page):
+                return self.check_get(url, params={
                     'limit' : page_size,
                     'page' : page,
                     }).json()
-                result += items
+
+            # the page count is known now, fetch the rest concurrently, one at a time within a batch
+            fetched = self.batch(get_page, range(2, pages + 1), in_flight=self.page_workers)
+            for page in range(2, pages + 1):
+                result += fetched[page]
         assert len(result) == item_count
         return result
 
@@ -112,8 +179,53 @@ class TeaAPI(api.API):
     def repo_path(self, org, repo):
         return '/api/v1/repos/' + org + '/' + repo
 
+    def path_template(self, path):
+        parts = path.split('?', 1)[0].split('/')
+        if parts[:4] == ['', 'api', 'v1', 'users'] and len(parts) > 4:
+            parts[4] = '{org}'
+        if parts[:4] != ['', 'api', 'v1', 'repos'] or len(parts) < 6:
+            return '/'.join(parts)
+        template = ['', 'api', 'v1', 'repos', '{org}', '{repo}']
+        tail = parts[6:]
+        if len(tail) > 1 and tail[0] in ['branches', 'contents']:
+            tail = [tail[0], '{branch}' if tail[0] == 'branches' else '{path}']
+        elif len(tail) > 2 and tail[0:2] == ['git', 'commits']:
+            tail = ['git', 'commits', '{sha}']
+        elif len(tail) > 1 and tail[0] == 'pulls':
+            tail = ['pulls', '{base}', '{head}'] if len(tail) > 2 else ['pulls', '{index}']
+        return '/'.join(template + tail)
+
+    def call(self, method, path, **kwargs):
+        try:
+            return super().call(method, path, **kwargs)
+        finally:
+            if method not in ['GET', 'HEAD']:
+                self.invalidate_repo_path(path)
+
+    def _cached_repo_state(self, kind, org, repo, fetch):
+        """Repository state read during this session, dropped when the repository is modified"""
+        key = (org, repo)
+        state = self._repo_cache.setdefault(key, {})
+        if kind not in state:
+            state[kind] = fetch()
+        return state[kind]
+
+    def invalidate_repo(self, org, repo):
+        self._repo_cache.pop((org, repo), None)
+
+    def invalidate_repo_path(self, path):
+        """Drop the cached state of the repository an API path refers to"""
+        parts = path.split('?', 1)[0].split('/')
+        if len(parts) >= 6 and parts[:4] == ['', 'api', 'v1', 'repos']:
+            self.invalidate_repo(parts[4], parts[5])
+
     def repo_exists(self, org, repo):
-        return self.check_exists(self.repo_path(org, repo))
+        def fetch():
+            r = self.check_exists(self.repo_path(org, repo))
+            if r:
+                _ = r.content  # read the response so that it can be used later
+            return r
+        return self._cached_repo_state('exists', org, repo, fetch)
 
     def fork_repo(self, src, srcrepo, dst, dstrepo):
         if self.repo_exists(src, srcrepo):
@@ -143,13 +255,24 @@ class TeaAPI(api.API):
         return self.repoinfo(dst, dstrepo)
 
     def repoinfo(self, org, repo):
-        r = self.check_get(self.repo_path(org, repo))
-        repoinfo = r.json()
-        return repoinfo
+        def fetch():
+            r = self.check_get(self.repo_path(org, repo))
+            return r.json()
+        return self._cached_repo_state('info', org, repo, fetch)
 
     def repo_branches(self, org, repo):
-        branches = self._page_url(self.repo_path(org, repo) + '/branches')
-        return self._name_dict(branches)
+        def fetch():
+            branches = self._page_url(self.repo_path(org, repo) + '/branches')
+            return self._name_dict(branches)
+        return dict(self._cached_repo_state('branches', org, repo, fetch))
+
+    def repos_exist(self, repos, in_flight=None, return_exceptions=False):
+        """repo_exists() of many (org, repo) pairs, concurrently"""
+        return self.batch(self.repo_exists, repos, in_flight, return_exceptions)
+
+    def repos_branches(self, repos, in_flight=None, return_exceptions=False):
+        """repo_branches() of many (org, repo) pairs, concurrently"""
+        return self.batch(self.repo_branches, repos, in_flight, return_exceptions)
 
     def delete_branch(self, org, repo, branch):
         return self.check_delete(self.repo_path(org, repo) + '/branches/' + branch)
@@ -283,7 +406,103 @@ class TeaAPI(api.API):
         new_content = base64.standard_b64encode(new_content.encode()).decode()
         return self._update_file_content(org, repo, branch, fn, sha, content, new_content)
 
+    def remote_files(self, org, repo, branch, ignored=None):
+        r = self.check_get(self.repo_path(org, repo) + '/contents-ext', params={
+            'ref': branch,
+            'includes': 'lfs_metadata'
+            })
+        filelist = r.json()['dir_contents']
+        files = {}
+        for f in filelist:
+            if not ignored or f['name'] not in ignored:
+                files[f['name']] = f
+        return files
+
+    def contents_body(self, branch, operations, message):
+        """Streamed JSON body of a request to the contents API, byte for byte what json.dumps would produce
+        The 'content' of operations is the pathname of the file to send"""
+        token = 'streamed-content-' + uuid.uuid4().hex
+        contents = {}
+        files = []
+        for op in operations:
+            op = dict(op)
+            if 'content' in op:
+                marker = '%s-%i' % (token, len(contents))
+                contents[marker] = op['content']
+                op['content'] = marker
+            files.append(op)
+        text = json.dumps({ 'branch' : branch, 'files' : files, 'message': message })
+        parts = []
+        for piece in re.split('(' + token + '-[0-9]+)', text):
+            if piece in contents:
+                parts.append((contents[piece], os.stat(contents[piece]).st_size))
+            elif piece:
+                parts.append(piece.encode())
+        description = ' '.join([op['operation'].upper() + ' ' + op['path'] for op in operations])
+        return api.StreamingBody(parts, description, self.metrics)
+
+    def batch_operations(self, operations):
+        """Split operations into batches of at most upload_batch_size bytes of base64 encoded file content
+        Files bigger than the limit are sent in a batch of their own"""
+        batches = [[]]
+        size = 0
+        for op in operations:
+            op_size = (os.stat(op['content']).st_size + 2) // 3 * 4 if 'content' in op else 0
+            if self.upload_batch_size and op_size and batches[-1] and size + op_size > self.upload_batch_size:
+                batches.append([])
+                size = 0
+            batches[-1].append(op)
+            size += op_size
+        return batches if batches[-1] else []
+
+    def pending_operations(self, org, repo, branch, operations):
+        """Drop the operations already applied on the server and refresh the blob sha of the rest"""
+        files = self.remote_files(org, repo, branch)
+        with self.metrics.timer('hash'):
+            hashes = self.hash_cache.hash_files(dict([(op['content'], os.stat(op['content'])) for op in operations if 'content' in op]))
+        result = []
+        for op in operations:
+            op = dict(op)
+            f = files.get(op['path'], None)
+            if 'content' in op:
+                blob, oid = hashes[op['content']]
+                if f and ((f['lfs_oid'] == oid) if f.get('lfs_oid', None) else (f['sha'] == blob)):
+                    continue
+                op.pop('sha', None)
+                op['operation'] = 'create'
+                if f:
+                    op['operation'] = 'update'
+                    op['sha'] = f['sha']
+            else:
+                if not f:
+                    continue
+                op['sha'] = f['sha']
+            result.append(op)
+        return result
+
+    def post_contents(self, org, repo, branch, operations, message):
+        """Post operations to the contents API in size limited batches (one commit each)
+        A failed batch is retried after checking which of its operations were applied"""
+        for batch in self.batch_operations(operations):
+            for attempt in range(self.upload_retries + 1):
+                try:
+                    with self.metrics.timer('contents POST'):
+                        self.check_post(self.repo_path(org, repo) + '/contents', data=self.contents_body(branch, batch, message),
+                                        headers={'Content-Type': 'application/json'}, attempt=attempt)
+                    break
+                except (api.APIError, OSError, http.client.HTTPException) as e:
+                    if attempt >= self.upload_retries or (isinstance(e, api.APIError) and e.status and
+                                                           e.status < 500 and e.status not in [409, 422]):
+                        raise
+                    delay = 2 ** attempt
+                    self.log_progress('Upload of %i files failed: %s\nRetrying in %i s.\n' % (len(batch), e, delay))
+                    time.sleep(delay)
+                    batch = self.pending_operations(org, repo, branch, batch)
+                    if not batch:
+                        break
+
     def update_content(self, org, repo, branch, src, message, ignored_files=None, upload_all=False):
+        src = tar_up_dir(src)
         ign = ['.gitattributes', '.gitignore'] + (ignored_files if ignored_files else [])
         exc = ['.osc', '.git']
 
@@ -297,61 +516,50 @@ class TeaAPI(api.API):
                 return True
             return False
 
-        r = self.check_get(self.repo_path(org, repo) + '/contents-ext', params={
-            'ref': branch,
-            'includes': 'lfs_metadata'
-            })
-        filelist = r.json()['dir_contents']
-        files = {}
-        for f in filelist:
-            if f['name'] not in ign and f['name'] not in exc:
-                files[f['name']] = f
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            hasher = init_repo(tmpdirname, repo, 'whatever')
-            if upload_all:
-                self.log_progress('Forcedly uploading all files.\n')
-                rq = { 'branch' : branch, 'files' : [], 'message': message }
-                for filename in sorted(files.keys()):
-                    if file_ignored(filename):
-                        continue
-                    frq = { 'path' : filename, 'operation' : 'delete', 'sha' : files[filename]['sha'] }
-                    rq['files'].append(frq)
-                    self.log_progress('DELETE %s\n' % (filename))
-                    files.pop(filename, None)
-                if len(rq['files']) > 0:
-                    self.check_post(self.repo_path(org, repo) + '/contents', json=rq)
-            rq = { 'branch' : branch, 'files' : [], 'message': message }
-            for filename in list_files(src):
+        files = self.remote_files(org, repo, branch, ign + exc)
+        if upload_all:
+            self.log_progress('Forcedly uploading all files.\n')
+            operations = []
+            for filename in sorted(files.keys()):
                 if file_ignored(filename):
                     continue
-                pathname = os.path.join(os.getcwd(), src, filename)
-                with open(pathname, 'rb') as fd:
-                    content = fd.read()
-                if files.get(filename):
-                    if files[filename].get('lfs_oid', None):
-                        sha = hashlib.sha256(content).hexdigest()
-                        reference = files[filename]['lfs_oid']
-                    else:
-                        sha = subprocess.check_output(['git', 'hash-object', pathname], cwd=hasher, universal_newlines=True).splitlines()[0]
-                        reference = files[filename]['sha']
-                if not files.get(filename) or reference != sha:
-                    content = base64.standard_b64encode(content).decode()
-                    frq = { 'content' : content, 'path' : filename}
-                    if files.get(filename):
-                        frq['operation'] = 'update'
-                        frq['sha'] = files[filename]['sha']
-                        self.log_progress('UPDATE %s\n' % (filename))
-                    else:
-                        frq['operation'] = 'create'
-                        self.log_progress('CREATE %s\n' % (filename))
-                    rq['files'].append(frq)
-                files.pop(filename, None)
-            for filename in sorted(files.keys()):
-                frq = { 'path' : filename, 'operation' : 'delete', 'sha' : files[filename]['sha'] }
-                rq['files'].append(frq)
+                operations.append({ 'path' : filename, 'operation' : 'delete', 'sha' : files[filename]['sha'] })
                 self.log_progress('DELETE %s\n' % (filename))
-            if len(rq['files']) > 0:
-                self.check_post(self.repo_path(org, repo) + '/contents', json=rq)
+                files.pop(filename, None)
+            self.post_contents(org, repo, branch, operations, message)
+        local_files = [f for f in src.file_list if not file_ignored(f)]
+        pathnames = dict([(f, os.path.join(os.getcwd(), src.directory, f)) for f in local_files])
+        # only files present on the server need to be compared
+        with self.metrics.timer('hash'):
+            hashes = self.hash_cache.hash_files(dict([(pathnames[f], src.files[f]) for f in local_files if files.get(f)]))
+        operations = []
+        for filename in local_files:
+            pathname = pathnames[filename]
+            if files.get(filename):
+                blob, oid = hashes[pathname]
+                if files[filename].get('lfs_oid', None):
+                    sha = oid
+                    reference = files[filename]['lfs_oid']
+                else:
+                    sha = blob
+                    reference = files[filename]['sha']
+            if not files.get(filename) or reference != sha:
+                # the content is streamed from the file when sending the request
+                frq = { 'content' : pathname, 'path' : filename}
+                if files.get(filename):
+                    frq['operation'] = 'update'
+                    frq['sha'] = files[filename]['sha']
+                    self.log_progress('UPDATE %s\n' % (filename))
+                else:
+                    frq['operation'] = 'create'
+                    self.log_progress('CREATE %s\n' % (filename))
+                operations.append(frq)
+            files.pop(filename, None)
+        for filename in sorted(files.keys()):
+            frq = { 'path' : filename, 'operation' : 'delete', 'sha' : files[filename]['sha'] }
+            operations.append(frq)
+            self.log_progress('DELETE %s\n' % (filename))
+        self.post_contents(org, repo, branch, operations, message)
 
     def get_pr(self, org, repo, tgt, src):
         pr =  self.check_exists(self.repo_path(org, repo) + '/pulls/' + tgt + '/' + src)
@@ -1,8 +1,10 @@
-from kutil.config import get_kernel_projects, get_package_archs, get_source_timestamp, read_source_timestamp, get_kernel_project_package, list_files, list_specs
+from kutil.config import get_kernel_projects, get_package_archs, get_source_timestamp, read_source_timestamp, get_kernel_project_package, TarUpDir, default_cache_path
 from obsapi.teaapi import TeaAPI, json_custom_dump, update_maintainership, get_maintainership
 from obsapi.obsapi import OBSAPI, PkgRepo
 import xml.etree.ElementTree as ET
-from obsapi.api import APIError
+from obsapi.api import APIError, Metrics
+import concurrent.futures
+import functools
 import subprocess
 import tempfile
 import difflib
@@ -13,18 +15,43 @@ import os
 
 ignore_kabi_file = 'IGNORE-KABI-BADNESS'
 
+def timed(phase):
+    """Account the run time of the method to phase in the uploader metrics"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.phase(phase):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 class UploaderBase:
+    meta_workers = 4  # concurrent project meta requests
+    # which projects of get_kernel_projects() to build against on each API
+    build_services = { 'https://api.suse.de': 'IBS', 'https://api.opensuse.org': 'OBS' }
     def log_progress(self, string):
         if hasattr(self, 'progress') and self.progress:
             self.progress.write(string)
 
+    def phase(self, name):
+        if getattr(self, 'metrics', None) is None:
+            self.metrics = Metrics()
+        return self.metrics.timer(name)
+
+    def tar_up(self):
+        # parsed once per upload, shared by all the kutil.config helpers
+        if getattr(self, '_tar_up', None) is None or self._tar_up.directory != str(self.data):
+            self._tar_up = TarUpDir(self.data)
+        return self._tar_up
+
+    @timed('upload')
     def upload(self, message=None):
         if not message:
-            message = get_source_timestamp(self.data)
+            message = get_source_timestamp(self.tar_up())
         self.log_progress('Updating .gitattributes to put tarballs into LFS.\n')
         self.tea.update_gitattr(self.user, self.upstream.repo, self.user_branch)
         self.log_progress('Updating branch %s with content of %s\n' % (self.user_branch, self.data))
-        self.tea.update_content(self.user, self.upstream.repo, self.user_branch, self.data, message, [ignore_kabi_file] if self.ignore_kabi_badness else None, self.upload_all)
+        self.tea.update_content(self.user, self.upstream.repo, self.user_branch, self.tar_up(), message, [ignore_kabi_file] if self.ignore_kabi_badness else None, self.upload_all)
         self.commit = self.tea.repo_branches(self.user, self.upstream.repo)[self.user_branch]['commit']['id']
         self.log_progress('commit sha: %s\n' % (self.commit,))
         return self.commit
@@ -32,6 +59,7 @@ class UploaderBase:
     def sync_url(self):
         return self.upstream.api + '/' + self.user + '/' + self.upstream.repo + '?trackingbranch=' + self.user_branch + '#' + self.commit
 
+    @timed('submit')
     def submit(self, message=None):
         return self._submit(self.upstream, message)
 
@@ -63,24 +91,38 @@ class UploaderBase:
         return 'QA_' + r if r not in ['standard', 'pool'] else 'QA'
 
     def get_kernel_projects(self):
-        projects = get_kernel_projects(self.data)
-        if self.obs.url == 'https://api.suse.de':
-            return projects['IBS']
-        elif self.obs.url == 'https://api.opensuse.org':
-            return projects['OBS']
-        else:
+        service = self.build_services.get(self.obs.url, None)
+        if not service:
             raise APIError('Getting build repositories not supported for %s' % (self.obs.url,))
+        return get_kernel_projects(self.tar_up())[service]
+
+    def get_projects_meta(self):
+        """Meta of the kernel build projects fetched concurrently, once per run"""
+        if getattr(self, '_projects_meta', None) is None:
+            projects = self.get_kernel_projects()
+            keys = list(projects.keys())
+
+            def fetch(project):
+                meta = self.obs.project_exists(project)
+                return meta.content if meta else meta
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.meta_workers, len(keys)))) as executor:
+                metas = list(executor.map(fetch, [projects[k] for k in keys]))
+            self._projects_meta = dict([(k, (projects[k], meta)) for k, meta in zip(keys, metas)])
+        return self._projects_meta
 
     def get_project_repo_archs(self, limit_packages=None):
-        if hasattr(self, 'repo_archs'):
-            return self.repo_archs
-        architectures = get_package_archs(self.data, limit_packages)
-        projects = self.get_kernel_projects()
-        projects_meta = {}
-        for k in projects.keys():
-            p = projects[k]
-            meta = self.obs.project_exists(p)
-            projects_meta[k] = (p, meta.content if meta else meta)
+        # the table depends on the packages built, cache it for each selection
+        key = tuple(sorted(limit_packages)) if limit_packages else None
+        if getattr(self, '_repo_archs', None) is None:
+            self._repo_archs = {}
+        if key not in self._repo_archs:
+            self._repo_archs[key] = self._get_project_repo_archs(limit_packages)
+        return self._repo_archs[key]
+
+    def _get_project_repo_archs(self, limit_packages):
+        architectures = get_package_archs(self.tar_up(), limit_packages)
+        projects_meta = self.get_projects_meta()
         results = {}
         for k in projects_meta.keys():
             prj = projects_meta[k][0]
@@ -120,12 +162,11 @@ class UploaderBase:
                         results[k][prj][name] = archs
             else:
                 raise APIError('Could not retrieve metadata for project %s' % (prj,))
-        self.repo_archs = results
         return results
 
     def prjmeta(self, limit_packages=None, rebuild=False, debuginfo=False, maintainers=[]):
         repo_archs = self.get_project_repo_archs(limit_packages)
-        source_timestamp = read_source_timestamp(self.data)
+        source_timestamp = read_source_timestamp(self.tar_up())
         branch = source_timestamp.get('git branch', 'unknown')
         xml = ET.Element('project', name=self.project)
         e = ET.SubElement(xml, 'title')
@@ -177,14 +218,14 @@ class UploaderBase:
 
     def prjconf(self, limit_packages=None, rpm_checks=False, debuginfo=False):
         is_qa_repo = '0'
-        multibuild = '_multibuild' in list_files(self.data)
+        multibuild = '_multibuild' in self.tar_up().files
         repo_archs = self.get_project_repo_archs(limit_packages)
-        package = get_kernel_project_package(self.data)[1]
+        package = get_kernel_project_package(self.tar_up())[1]
         qa_packages = ['kernel-obs-qa', 'kernel-obs-build']
         for r in repo_archs.keys():
             is_qa_repo += '||("%%_repository" == "%s")' % (self.get_qa_repo(r),)
         result = []
-        if '_constraints' not in list_files(self.data):
+        if '_constraints' not in self.tar_up().files:
             disk_needed = 14 if debuginfo else 4
             result.append(
 '''%%ifarch %%ix86 x86_64
@@ -233,10 +274,11 @@ Constraint: hardware:disk:size unit=G %i
             packages = []
         packages = [p[0:-len(ext)] if p.endswith(ext) else p for p in packages]
         packages = packages + [ 'kernel-' + p for p in packages]
-        filelist = list_files(self.data)
+        filelist = self.tar_up().files
         packages = [p for p in packages if p + ext in filelist]
         return packages
 
+    @timed('create_project')
     def create_project(self, maintainers=None, limit_packages=None, debuginfo=None, rpm_checks=None, rebuild=None):
         limit_packages = self.filter_limit_packages(limit_packages)
         self.log_progress('Creating %s...' % (self.project,))
@@ -254,13 +296,14 @@ Constraint: hardware:disk:size unit=G %i
         ET.indent(pkgmeta)
         return ET.tostring(pkgmeta)
 
+    @timed('create_package')
     def create_package(self, limit_packages=None, no_init=False):
         limit_packages = self.filter_limit_packages(limit_packages)
         repo_archs = self.get_project_repo_archs(limit_packages)
-        multibuild = '_multibuild' in list_files(self.data)
-        specs = list_specs(self.data)
+        multibuild = '_multibuild' in self.tar_up().files
+        specs = self.tar_up().specs
         repo_archs = self.get_project_repo_archs(limit_packages)
-        package = get_kernel_project_package(self.data)[1]
+        package = get_kernel_project_package(self.tar_up())[1]
         self.log_progress('Creating %s/%s...' % (self.project, self.package))
         self.log_progress('ok\n')
         self.obs.create_package_meta(self.project, self.package, self.pkgmeta())
@@ -312,6 +355,7 @@ Constraint: hardware:disk:size unit=G %i
             self.obs.delete_package(self.project, s)
             self.log_progress('ok\n')
 
+    @timed('set_git_maintainers')
     def set_git_maintainers(self, maintainers):
         maintfile = '_maintainership.json'
         self.log_progress('Getting scmsync for %s...' % (self.upstream_project,))
@@ -337,6 +381,7 @@ Constraint: hardware:disk:size unit=G %i
                 self._submit(prjrepo, 'Update ' + self.package + ' maintainer list.' if maintainers else
                 'Normalize ' + maintfile + ' formatting\nThe ' + maintfile + ' formatting is not entirely consistent.\nMake the formatting uniform across the whole file to facilitate automated updates.')
 
+    @timed('fork_repo')
     def fork_repo(self, upstream_repo, reset_branch, re_fork):
         upstream_info = self.tea.repo_exists(upstream_repo.org, upstream_repo.repo)
         if upstream_info:
@@ -380,16 +425,22 @@ Constraint: hardware:disk:size unit=G %i
 
 
 class Uploader(UploaderBase):
-    def __init__(self, api, data, user_project, reset_branch=False, re_fork=False, logfile=None, progress=True, ignore_kabi=False, upload_all=False):
+    @timed('init')
+    def __init__(self, api, data, user_project, reset_branch=False, re_fork=False, logfile=None, progress=True, ignore_kabi=False, upload_all=False,
+                 upload_batch_size=None, http_cache=False, ca=None):
         self.progress = sys.stderr if progress else None
         self.data = data
-        self.upstream_project, self.package = get_kernel_project_package(self.data)
+        self.upstream_project, self.package = get_kernel_project_package(self.tar_up())
         self.project = user_project.replace('/',':')
-        self.obs = OBSAPI(api, logfile)
+        http_cache = default_cache_path('bs-upload-kernel-http') if http_cache else None
+        self.obs = OBSAPI(api, logfile, ca=ca, http_cache=http_cache)
+        self.obs.metrics = self.metrics
         self.log_progress('Getting scmsync for %s/%s...' % (self.upstream_project, self.package))
         self.upstream = self.obs.package_repo(self.upstream_project, self.package)
         self.log_progress('%s\n' % (repr(self.upstream),))
-        self.tea = TeaAPI(self.upstream.api, logfile, progress=self.progress)
+        self.tea = TeaAPI(self.upstream.api, logfile, progress=self.progress, hash_cache=default_cache_path('bs-upload-kernel-hashes.json'),
+                          upload_batch_size=upload_batch_size, http_cache=http_cache, ca=ca)
+        self.tea.metrics = self.metrics
         self.log_progress('Getting Gitea user...')
         self.user = self.tea.get_user()
         self.log_progress('%s\n' % (self.user,))
@@ -0,0 +1,132 @@
+"""Micro-benchmarks for the python-bugzilla copy in this tree
+
+Requests are answered by an in-process fake backend so that only the
+client side processing is measured:
+
+    python3 -m tests.bugzilla_bench --bugs 5000
+"""
+from bugzilla.base import Bugzilla
+from bugzilla._util import listify
+import threading
+import argparse
+import random
+import time
+
+
+class FakeBackend:
+    """Answers bug_get() from a list of bug dicts, in shuffled order like
+    a real Bugzilla may, and bug_comments()/bug_history() with one
+    synthetic entry per bug"""
+    def __init__(self, bugs, seed=0, shuffle=True):
+        self.bugs = bugs
+        self.random = random.Random(seed) if shuffle else None
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def call(self, *args):
+        with self.lock:
+            self.calls.append(args)
+
+    @staticmethod
+    def project(bug, paramdict):
+        fields = paramdict.get('include_fields')
+        if not fields:
+            return dict(bug)
+        return {k: v for k, v in bug.items() if k in fields}
+
+    def bug_get(self, bug_ids, aliases, paramdict):
+        self.call('bug_get', list(bug_ids), list(aliases))
+        ids = {int(i) for i in bug_ids}
+        aliases = set(aliases)
+        bugs = [self.project(b, paramdict) for b in self.bugs
+                if b['id'] in ids or aliases.intersection(listify(b.get('alias') or []))]
+        if self.random:
+            self.random.shuffle(bugs)
+        return {'bugs': bugs, 'faults': []}
+
+    def bug_search(self, paramdict):
+        self.call('bug_search', sorted(paramdict.get('include_fields') or []))
+        return {'bugs': [self.project(b, paramdict) for b in self.bugs]}
+
+    def bug_comments(self, bug_ids, paramdict):
+        self.call('bug_comments', list(bug_ids))
+        return {'bugs': {str(i): {'comments': [{'bug_id': int(i), 'text': 'comment on %s' % i}]} for i in bug_ids},
+                'comments': {}}
+
+    def bug_history(self, bug_ids, paramdict):
+        self.call('bug_history', list(bug_ids))
+        return {'bugs': [{'id': int(i), 'history': []} for i in bug_ids]}
+
+
+def fake_bugzilla(bugs):
+    bz = Bugzilla(url=None, use_creds=False)
+    bz._backend = FakeBackend(bugs)
+    return bz
+
+
+def synthetic_bugs(count, seed=0):
+    """Return count bug dicts, a third of them with CVE aliases, and an id
+    list asking for all of them by id or alias in random order"""
+    rnd = random.Random(seed)
+    bugs = []
+    idlist = []
+    for n in range(count):
+        bugid = 1200000 + n
+        alias = ['CVE-2024-%05d' % n] if n % 3 == 0 else []
+        bugs.append({'id': bugid, 'alias': alias, 'summary': 'bug %d' % n,
+                     'status': 'NEW', 'last_change_time': '20240101T00:00:00'})
+        idlist.append(alias[0] if alias and rnd.random() < 0.5 else bugid)
+    rnd.shuffle(idlist)
+    return bugs, idlist
+
+
+def scan_order(idlist, bugs):
+    """The ordering _getbugs used before it indexed the reply, for
+    comparison"""
+    ret = []
+    for idval in idlist:
+        idint, alias = (int(idval), None) if str(idval).isdigit() else (None, str(idval))
+        for bugdict in bugs:
+            if idint and idint != bugdict.get("id", None):
+                continue
+            aliaslist = listify(bugdict.get("alias", None) or [])
+            if alias and alias not in aliaslist:
+                continue
+            ret.append(bugdict)
+            break
+    return ret
+
+
+def measure(fn, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def getbugs_benchmark(count, runs):
+    bugs, idlist = synthetic_bugs(count)
+    bz = fake_bugzilla(bugs)
+    bz.bulk_chunk_size = None
+    reply = bz._backend.bug_get([b['id'] for b in bugs], [], {})['bugs']
+    scan, expected = measure(lambda: scan_order(idlist, reply), runs)
+    bz._backend = type('Backend', (), {'bug_get': lambda self, i, a, p: {'bugs': reply}})()
+    indexed, got = measure(lambda: bz._getbugs(idlist, True), runs)
+    assert [b['id'] for b in got] == [b['id'] for b in expected]
+    print('getbugs reorder of %d bugs: scan %.3fs, indexed %.4fs (%.0fx)' %
+          (count, scan, indexed, scan / indexed if indexed else float('inf')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark client side processing of the bugzilla module')
+    parser.add_argument('--bugs', type=int, default=3000, help='number of synthetic bugs')
+    parser.add_argument('--runs', type=int, default=3, help='best of this many runs')
+    args = parser.parse_args()
+    getbugs_benchmark(args.bugs, args.runs)
+
+
+if __name__ == '__main__':
+    main()
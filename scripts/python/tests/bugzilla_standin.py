@@ -0,0 +1,388 @@
+"""Stand-in for the parts of the Bugzilla XMLRPC and REST APIs used by the
+bugzilla scripts
+
+The stand-in serves bug, comment and history payloads either generated
+here or recorded from a real Bugzilla, over plain HTTP with a
+configurable latency, and counts the requests and connections it sees.
+
+Running this module compares the XMLRPC and REST backends against it:
+
+    python3 -m tests.bugzilla_standin --bugs 500 --latency 20
+    python3 -m tests.bugzilla_standin --record payloads.json --ids 1234,1235
+    python3 -m tests.bugzilla_standin --payloads payloads.json
+"""
+from bugzilla._backendrest import _BackendREST, _update_key
+from bugzilla import Bugzilla
+import socketserver
+import urllib.parse
+import http.server
+import xmlrpc.client
+import collections
+import threading
+import argparse
+import random
+import json
+import time
+import sys
+import re
+
+# Fields holding timestamps, XMLRPC sends them as DateTime
+TIME_FIELDS = ('creation_time', 'last_change_time', 'time', 'when')
+TIME_FORMAT_REST = '%Y-%m-%dT%H:%M:%SZ'
+TIME_FORMAT_XML = '%Y%m%dT%H:%M:%S'
+
+# What kss-dashboard asks for
+BUG_FIELDS = ['id', 'status', 'summary', 'status_whiteboard', 'last_change_time', 'creation_time',
+              'assigned_to', 'url', 'deadline']
+
+
+def synthetic_payloads(count, seed=0):
+    """Payloads of count bugs with comments and history in the REST format"""
+    rnd = random.Random(seed)
+    words = ['kernel', 'fix', 'memory', 'leak', 'use-after-free', 'in', 'the', 'driver', 'net', 'when',
+             'handling', 'netlink', 'request', 'backport', 'patch', 'upstream', 'commit', 'affected']
+
+    def text(n):
+        return ' '.join(rnd.choice(words) for _ in range(n))
+
+    def when(n):
+        return time.strftime(TIME_FORMAT_REST, time.gmtime(1700000000 + n * 3600))
+
+    payloads = {'bugs': [], 'comments': {}, 'history': []}
+    for n in range(count):
+        bugid = 1200000 + n
+        cve = 'CVE-2024-%05d' % (n,)
+        payloads['bugs'].append({
+            'id': bugid, 'alias': [cve], 'status': 'NEW', 'resolution': '',
+            'summary': 'VUL-0: %s: kernel: %s' % (cve, text(8)),
+            'status_whiteboard': 'CVSSv3.1:SUSE:%s:%.1f:(AV:L/AC:L/PR:L/UI:N/S:U/C:H/I:H/A:H)' % (cve, rnd.uniform(3, 9)),
+            'creation_time': when(n), 'last_change_time': when(n + 100),
+            'assigned_to': 'kernel-bugs@suse.de', 'creator': 'smash_bz@suse.de',
+            'url': 'https://smash.suse.de/issue/%i/' % (400000 + n,), 'deadline': None,
+            'product': 'SUSE Security Incidents', 'component': 'Incidents', 'version': 'unspecified',
+            'priority': 'P3 - Medium', 'severity': 'Normal', 'keywords': [], 'blocks': [], 'depends_on': [],
+            'cc': ['security-team@suse.de', 'kernel-bugs@suse.de'], 'flags': [], 'groups': [],
+            'see_also': [], 'is_open': True,
+        })
+        payloads['comments'][str(bugid)] = {'comments': [{
+            'id': bugid * 20 + c, 'bug_id': bugid, 'count': c, 'creator': 'smash_bz@suse.de',
+            'time': when(n + c), 'creation_time': when(n + c), 'is_private': False, 'attachment_id': None,
+            'tags': [], 'text': text(rnd.randint(30, 300)),
+        } for c in range(rnd.randint(3, 15))]}
+        payloads['history'].append({'id': bugid, 'alias': [cve], 'history': [{
+            'when': when(n + h), 'who': 'security-team@suse.de',
+            'changes': [{'field_name': 'assigned_to', 'removed': 'security-team@suse.de',
+                         'added': 'kernel-bugs@suse.de'}],
+        } for h in range(rnd.randint(1, 6))]})
+    return payloads
+
+
+def record(bzapi, ids, path):
+    """Store the bug, comment and history payloads of ids fetched through bzapi in path"""
+    def rest_times(obj):
+        if isinstance(obj, xmlrpc.client.DateTime):
+            return time.strftime(TIME_FORMAT_REST, time.strptime(obj.value, TIME_FORMAT_XML))
+        if isinstance(obj, dict):
+            return {k: rest_times(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [rest_times(v) for v in obj]
+        return obj
+    payloads = {'bugs': [b.get_raw_data() for b in bzapi.getbugs(ids)],
+                'comments': bzapi.get_comments(ids)['bugs'],
+                'history': bzapi.bugs_history_raw(ids)['bugs']}
+    with open(path, 'w') as f:
+        json.dump(rest_times(payloads), f)
+
+
+def xmlrpc_times(obj):
+    if isinstance(obj, dict):
+        return {k: (xmlrpc.client.DateTime(time.strptime(v, TIME_FORMAT_REST))
+                    if k in TIME_FIELDS and isinstance(v, str) else xmlrpc_times(v))
+                for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [xmlrpc_times(v) for v in obj]
+    return obj
+
+
+class StandInError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class BugzillaStandInRequest(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+    routes = [
+        ('GET', '/rest/version', 'rest_version'),
+        ('GET', '/rest/bug', 'rest_bug'),
+        ('GET', '/rest/bug/(?P<bugid>[^/]+)/comment', 'rest_comment'),
+        ('GET', '/rest/bug/(?P<bugid>[^/]+)/history', 'rest_history'),
+        ('POST', '/xmlrpc.cgi', 'xmlrpc'),
+    ]
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.do_request()
+    def do_POST(self):
+        self.do_request()
+
+    def do_request(self):
+        start = time.monotonic()
+        url = urllib.parse.urlparse(self.path)
+        self.query = urllib.parse.parse_qs(url.query)
+        body = b''
+        if 'Content-Length' in self.headers:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        route = 'unknown'
+        content_type = 'application/json'
+        failure = self.server.next_failure()
+        if failure == 'reset':
+            self.server.count(self.command + ' reset', 0)
+            self.close_connection = True
+            return
+        try:
+            if failure:
+                raise StandInError(failure, 'Injected failure')
+            for method, pattern, handler in self.routes:
+                m = re.fullmatch(pattern, url.path)
+                if m and method == self.command:
+                    route = handler
+                    if handler == 'xmlrpc':
+                        route, reply = self.xmlrpc(body)
+                        content_type = 'text/xml'
+                    else:
+                        reply = json.dumps(getattr(self, handler)(**m.groupdict())).encode()
+                    break
+            else:
+                raise StandInError(404, 'Not found')
+            code = 200
+        except StandInError as e:
+            code = e.code
+            reply = json.dumps({'error': True, 'code': e.code, 'message': str(e)}).encode()
+        self.server.count(self.command + ' ' + route, len(reply))
+        self.server.delay(start)
+        self.send_response(code)
+        if code in (429, 503):
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def ids(self, name):
+        """Parameter values, comma separated or repeated"""
+        return [i for v in self.query.get(name, []) for i in v.split(',') if i]
+
+    def rest_version(self):
+        return {'version': '5.0.6'}
+
+    def rest_bug(self):
+        return {'bugs': self.server.find_bugs(self.ids('id') + self.ids('alias'), self.ids('include_fields')),
+                'faults': []}
+
+    def sub_ids(self, bugid):
+        return [bugid] + (self.ids('ids') if self.server.batch_ids else [])
+
+    def rest_comment(self, bugid):
+        return {'bugs': self.server.find_comments(self.sub_ids(bugid)), 'comments': {}}
+
+    def rest_history(self, bugid):
+        return {'bugs': self.server.find_history(self.sub_ids(bugid))}
+
+    def xmlrpc(self, body):
+        params, method = xmlrpc.client.loads(body, use_datetime=False)
+        params = params[0] if params else {}
+        if method == 'Bugzilla.version':
+            result = self.rest_version()
+        elif method == 'Bug.get':
+            result = {'bugs': self.server.find_bugs([str(i) for i in params.get('ids', [])],
+                                                    params.get('include_fields')), 'faults': []}
+        elif method == 'Bug.comments':
+            result = {'bugs': self.server.find_comments([str(i) for i in params.get('ids', [])]), 'comments': {}}
+        elif method == 'Bug.history':
+            result = {'bugs': self.server.find_history([str(i) for i in params.get('ids', [])])}
+        else:
+            return 'xmlrpc ' + method, xmlrpc.client.dumps(
+                xmlrpc.client.Fault(32000, 'Unknown method %s' % (method,)), methodresponse=True).encode()
+        return 'xmlrpc ' + method, xmlrpc.client.dumps((xmlrpc_times(result),), methodresponse=True,
+                                                       allow_none=True).encode()
+
+
+class BugzillaStandIn(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Bugzilla XMLRPC and REST stand-in on a local HTTP port serving payloads
+    as generated by synthetic_payloads() or recorded by record()
+
+    latency is added to every request in seconds. With batch_ids unset
+    the REST comment and history routes ignore the ids parameter, like
+    older Bugzilla versions may. The next requests fail with the HTTP
+    status codes in failures, or have their connection closed without a
+    reply for 'reset'."""
+    daemon_threads = True
+    batch_ids = True
+
+    def __init__(self, payloads, latency=0, verbose=False):
+        self.latency = latency
+        self.verbose = verbose
+        self.bugs = collections.OrderedDict((str(b['id']), b) for b in payloads['bugs'])
+        self.aliases = {a: b for b in payloads['bugs'] for a in b.get('alias') or []}
+        self.comments = payloads['comments']
+        self.history = {str(h['id']): h for h in payloads['history']}
+        self.failures = []
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+        super().__init__(('127.0.0.1', 0), BugzillaStandInRequest)
+        self.thread = None
+
+    def url(self):
+        return 'http://127.0.0.1:%i' % (self.server_address[1],)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'connections': 0, 'requests': collections.Counter(), 'bytes_out': 0}
+
+    def count(self, route, bytes_out):
+        with self.stats_lock:
+            self.stats['requests'][route] += 1
+            self.stats['bytes_out'] += bytes_out
+
+    def next_failure(self):
+        with self.stats_lock:
+            return self.failures.pop(0) if self.failures else None
+
+    def delay(self, start):
+        delay = self.latency - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+
+    def process_request(self, request, client_address):
+        with self.stats_lock:
+            self.stats['connections'] += 1
+        super().process_request(request, client_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread:
+            self.shutdown()
+            self.thread = None
+        self.server_close()
+
+    def bug_ids(self, ids):
+        ret = []
+        for i in ids:
+            bug = self.bugs.get(i) or self.aliases.get(i)
+            if bug and str(bug['id']) not in ret:
+                ret.append(str(bug['id']))
+        return ret
+
+    def find_bugs(self, ids, include_fields=None):
+        bugs = [self.bugs[i] for i in self.bug_ids(ids)]
+        if include_fields:
+            bugs = [{k: v for k, v in b.items() if k in include_fields} for b in bugs]
+        return bugs
+
+    def find_comments(self, ids):
+        return {i: self.comments[i] for i in self.bug_ids(ids) if i in self.comments}
+
+    def find_history(self, ids):
+        return [self.history[i] for i in self.bug_ids(ids) if i in self.history]
+
+
+class LegacyREST(_BackendREST):
+    """The REST backend as it was before it batched comment and history
+    requests and decoded replies from bytes, for comparison"""
+    def _handle_response(self, response):
+        return dict(json.loads(response.text))
+
+    def bug_comments(self, bug_ids, paramdict):
+        ret = {}
+        for bugid in bug_ids:
+            out = self._get("/bug/%s/comment" % bugid, paramdict)
+            _update_key(ret, out, "bugs")
+        return ret
+
+    def bug_history(self, bug_ids, paramdict):
+        ret = {"bugs": []}
+        for bugid in bug_ids:
+            out = self._get("/bug/%s/history" % bugid, paramdict)
+            ret["bugs"].extend(out.get("bugs", []))
+        return ret
+
+
+def connect(server, backend):
+    if backend == 'xmlrpc':
+        return Bugzilla(server.url() + '/xmlrpc.cgi', force_xmlrpc=True, use_creds=False)
+    bz = Bugzilla(server.url() + '/rest/', force_rest=True, use_creds=False)
+    if backend == 'rest-legacy':
+        bz._backend = LegacyREST(bz.url, bz._session)
+    return bz
+
+
+def benchmark(args):
+    if args.payloads:
+        with open(args.payloads) as f:
+            payloads = json.load(f)
+    else:
+        payloads = synthetic_payloads(args.bugs)
+    ids = [b['id'] for b in payloads['bugs']]
+    server = BugzillaStandIn(payloads, latency=args.latency / 1000, verbose=args.verbose).start()
+    calls = [('getbugs', lambda bz: bz.getbugs(ids, include_fields=list(BUG_FIELDS))),
+             ('get_comments', lambda bz: bz.get_comments(ids)),
+             ('bugs_history_raw', lambda bz: bz.bugs_history_raw(ids))]
+    results = []
+    try:
+        for backend in args.backends.split(','):
+            bz = connect(server, backend)
+            bz.bulk_workers = args.workers
+            for name, call in calls:
+                best = None
+                for _ in range(args.runs):
+                    server.reset_stats()
+                    start = time.monotonic()
+                    call(bz)
+                    elapsed = time.monotonic() - start
+                    if best is None or elapsed < best[0]:
+                        best = (elapsed, dict(server.stats))
+                results.append((backend, name) + best)
+            bz.disconnect()
+    finally:
+        server.stop()
+    print('%d bugs, %d comments, %.0f ms latency, best of %d' % (
+        len(ids), sum(len(c['comments']) for c in payloads['comments'].values()), args.latency, args.runs))
+    print('%-12s %-17s %9s %9s %6s %12s' % ('backend', 'call', 'seconds', 'requests', 'conns', 'received'))
+    for backend, name, elapsed, stats in results:
+        print('%-12s %-17s %9.3f %9i %6i %12i' % (backend, name, elapsed, sum(stats['requests'].values()),
+                                                   stats['connections'], stats['bytes_out']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the bugzilla XMLRPC and REST backends against a local stand-in')
+    parser.add_argument('--bugs', type=int, default=500, help='number of synthetic bugs to serve')
+    parser.add_argument('--payloads', help='serve payloads recorded with --record instead of synthetic ones')
+    parser.add_argument('--record', metavar='FILE', help='record the payloads of --ids from the configured bugzilla to FILE and exit')
+    parser.add_argument('--ids', help='comma separated bug ids to record')
+    parser.add_argument('--latency', type=float, default=20, metavar='ms', help='latency added to each request')
+    parser.add_argument('--backends', default='xmlrpc,rest,rest-legacy', help='backends to compare')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent chunks of bulk calls')
+    parser.add_argument('--runs', type=int, default=3, help='best of this many runs')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log requests')
+    args = parser.parse_args()
+    if args.record:
+        if not args.ids:
+            parser.error('--record needs --ids')
+        from bugzilla.utils import get_bugzilla_api
+        record(get_bugzilla_api(), [int(i) for i in args.ids.split(',')], args.record)
+        sys.exit(0)
+    benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
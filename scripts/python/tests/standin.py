@@ -0,0 +1,640 @@
+"""Stateful stand-in for the parts of the OBS and Gitea APIs used by obsapi
+
+Both APIs are served on the same local HTTPS port, the way the test
+environment of OBSAPI.package_repo() expects. Latency and bandwidth of
+the simulated link are configurable so that the effect of connection
+reuse, concurrency and streaming on an upload can be measured locally.
+
+Running this module benchmarks Uploader against the stand-in:
+
+    python3 -m tests.standin --latency 50 --bandwidth 10 --tarball 64
+"""
+import xml.etree.ElementTree as ET
+import socketserver
+import configparser
+import urllib.parse
+import http.server
+import collections
+import threading
+import tempfile
+import argparse
+import fnmatch
+import hashlib
+import base64
+import shutil
+import uuid
+import json
+import time
+import yaml
+import ssl
+import sys
+import os
+import re
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+
+def blob_id(content):
+    return hashlib.sha256(('blob %i\0' % (len(content),)).encode() + content).hexdigest()
+
+def lfs_pointer(content):
+    return ('version https://git-lfs.github.com/spec/v1\noid sha256:%s\nsize %i\n' %
+            (hashlib.sha256(content).hexdigest(), len(content))).encode()
+
+def obs_status(code, summary):
+    return '<status code="%s">\n  <summary>%s</summary>\n</status>\n' % (code, summary)
+
+class StandInError(Exception):
+    def __init__(self, code, message):
+        self.code = code
+        super().__init__(message)
+
+class StandInState:
+    """OBS projects and packages, Gitea repositories, commits and pull requests"""
+
+    def __init__(self, user):
+        self.user = user
+        self.lock = threading.RLock()
+        self.projects = {}  # name -> {'meta', 'config', 'packages': {name -> {file -> bytes}}}
+        self.repos = {}  # (org, repo) -> {'info', 'branches': {name -> commit}}
+        self.commits = {}  # id -> {'files': {path -> bytes}, 'parent', 'message'}
+        self.pulls = {}  # (org, repo, base, head) -> pull request
+
+    def commit(self, parent, files, message):
+        cid = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+        self.commits[cid] = { 'files': files, 'parent': parent, 'message': message }
+        return cid
+
+    def repo(self, org, repo):
+        r = self.repos.get((org, repo), None)
+        if not r:
+            raise StandInError(404, 'The target couldn\'t be found.')
+        return r
+
+    def create_repo(self, org, repo, parent=None, branches=None):
+        if (org, repo) in self.repos:
+            raise StandInError(409, 'The repository with the same name already exists.')
+        branches = dict(branches) if branches else {}
+        info = {
+            'id': len(self.repos) + 1,
+            'name': repo,
+            'full_name': org + '/' + repo,
+            'owner': { 'login': org },
+            'fork': parent is not None,
+            'parent': self.repos[parent]['info'] if parent else None,
+            'empty': not branches,
+            'default_branch': 'master',
+            'object_format_name': 'sha256',
+            }
+        self.repos[(org, repo)] = { 'info': info, 'branches': branches }
+        return info
+
+    def branch_commit(self, org, repo, branch):
+        r = self.repo(org, repo)
+        if branch not in r['branches']:
+            raise StandInError(404, 'Branch %s does not exist.' % (branch,))
+        return r['branches'][branch]
+
+    def lfs_patterns(self, files):
+        patterns = []
+        for line in files.get('.gitattributes', b'').decode().splitlines():
+            fields = line.split()
+            if fields and 'filter=lfs' in fields[1:]:
+                patterns.append(fields[0])
+        return patterns
+
+    def file_entry(self, files, path):
+        content = files[path]
+        entry = { 'name': os.path.basename(path), 'path': path, 'type': 'file', 'size': len(content) }
+        if [p for p in self.lfs_patterns(files) if fnmatch.fnmatch(path, p)]:
+            entry['sha'] = blob_id(lfs_pointer(content))
+            entry['lfs_oid'] = hashlib.sha256(content).hexdigest()
+            entry['lfs_size'] = len(content)
+        else:
+            entry['sha'] = blob_id(content)
+        return entry
+
+    def seed_project(self, project, meta, packages=None):
+        with self.lock:
+            self.projects[project] = { 'meta': meta.encode() if isinstance(meta, str) else meta,
+                                       'config': b'', 'packages': {} }
+            for package in packages if packages else []:
+                self.projects[project]['packages'][package] = {
+                        '_meta': ('<package name="%s" project="%s">\n  <title/>\n  <description/>\n</package>\n' % (package, project)).encode()
+                        }
+
+    def seed_repo(self, org, repo, files, branch='master'):
+        with self.lock:
+            self.create_repo(org, repo, branches={ branch: self.commit(None, dict(files), 'Initial commit') })
+
+
+class StandInRequest(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+    repo_path = '/api/v1/repos/(?P<org>[^/]+)/(?P<repo>[^/]+)'
+    routes = [
+        (['GET'], '/', 'obs_about'),
+        (['GET'], '/about', 'obs_about'),
+        (['GET'], '/source', 'obs_list_projects'),
+        (['GET'], '/source/(?P<project>[^/]+)', 'obs_list_packages'),
+        (['DELETE'], '/source/(?P<project>[^/]+)', 'obs_delete_project'),
+        (['GET', 'PUT'], '/source/(?P<project>[^/]+)/(?P<file>_meta|_config)', 'obs_project_file'),
+        (['POST'], '/source/(?P<project>[^/]+)/(?P<package>[^/]+)', 'obs_package_command'),
+        (['DELETE'], '/source/(?P<project>[^/]+)/(?P<package>[^/]+)', 'obs_delete_package'),
+        (['GET', 'PUT'], '/source/(?P<project>[^/]+)/(?P<package>[^/]+)/(?P<file>[^/]+)', 'obs_package_file'),
+        (['GET'], '/(?P<kind>group|person)/(?P<name>[^/]+)', 'obs_principal'),
+        (['GET'], '/api/v1/user', 'tea_user'),
+        (['POST'], '/api/v1/user/repos', 'tea_create_repo'),
+        (['GET'], '/api/v1/users/(?P<org>[^/]+)/repos', 'tea_list_repos'),
+        (['GET', 'PATCH', 'DELETE'], repo_path, 'tea_repo'),
+        (['POST'], repo_path + '/forks', 'tea_fork'),
+        (['GET', 'POST'], repo_path + '/branches', 'tea_branches'),
+        (['PUT', 'DELETE'], repo_path + '/branches/(?P<branch>.+)', 'tea_branch'),
+        (['GET'], repo_path + '/git/commits/(?P<commit>[0-9a-f]+)', 'tea_commit'),
+        (['POST'], repo_path + '/merge-upstream', 'tea_merge_upstream'),
+        (['GET'], repo_path + '/contents-ext', 'tea_contents_ext'),
+        (['POST'], repo_path + '/contents', 'tea_contents'),
+        (['GET', 'POST', 'PUT'], repo_path + '/contents/(?P<path>.+)', 'tea_file'),
+        (['GET'], repo_path + '/pulls/(?P<base>[^/]+)/(?P<head>.+)', 'tea_get_pull'),
+        (['POST'], repo_path + '/pulls', 'tea_open_pull'),
+        ]
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.do_request()
+    def do_PUT(self):
+        self.do_request()
+    def do_PATCH(self):
+        self.do_request()
+    def do_DELETE(self):
+        self.do_request()
+    def do_POST(self):
+        self.do_request()
+
+    def do_request(self):
+        start = time.monotonic()
+        self.server.enter()
+        url = urllib.parse.urlparse(self.path)
+        self.query = dict([(k, v[0]) for k, v in urllib.parse.parse_qs(url.query).items()])
+        body = b''
+        if 'Content-Length' in self.headers:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.command == 'POST' and self.headers.get('Content-Type', None) == 'application/x-www-form-urlencoded':
+            self.query.update(dict([(k, v[0]) for k, v in urllib.parse.parse_qs(body.decode()).items()]))
+        self.body = body
+        route = 'unknown'
+        try:
+            for methods, pattern, handler in self.routes:
+                m = re.fullmatch(pattern, url.path)
+                if m:
+                    route = handler
+                    if self.command not in methods:
+                        raise StandInError(405, 'Method not allowed')
+                    args = dict([(k, urllib.parse.unquote(v)) for k, v in m.groupdict().items()])
+                    with self.server.state.lock:
+                        reply = getattr(self, handler)(**args)
+                    break
+            else:
+                raise StandInError(404, 'Not found')
+        except StandInError as e:
+            if url.path.startswith('/api/'):
+                reply = (e.code, { 'message': str(e), 'url': self.path })
+            else:
+                reply = (e.code, obs_status('not_found' if e.code == 404 else 'error', str(e)))
+        code, data = reply[0], reply[1]
+        headers = reply[2] if len(reply) > 2 else {}
+        if isinstance(data, (dict, list)):
+            content_type = 'application/json'
+            data = json.dumps(data)
+        else:
+            content_type = 'application/xml; charset=utf-8'
+        data = data.encode() if isinstance(data, str) else data
+        self.server.delay(start, len(body) + len(data))
+        self.server.count(self.command, route, len(body), len(data))  # before the client can see the reply
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        for k in headers.keys():
+            self.send_header(k, headers[k])
+        self.send_header('Content-Length', len(data))
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def json_body(self):
+        try:
+            return json.loads(self.body.decode())
+        except ValueError:
+            raise StandInError(422, 'Invalid JSON body')
+
+    def paged(self, items):
+        limit = min(int(self.query.get('limit', 30)), self.server.page_size)
+        page = int(self.query.get('page', 1))
+        return (200, items[(page - 1) * limit:page * limit], { 'X-Total-Count': str(len(items)) })
+
+    # OBS
+
+    def project(self, project):
+        p = self.server.state.projects.get(project, None)
+        if not p:
+            raise StandInError(404, 'Project %s not found' % (project,))
+        return p
+
+    def package(self, project, package):
+        p = self.project(project)['packages'].get(package, None)
+        if p is None:
+            raise StandInError(404, 'Package %s/%s not found' % (project, package))
+        return p
+
+    def obs_about(self):
+        return (200, '<about>\n  <title>Open Build Service API stand-in</title>\n</about>\n')
+
+    def directory(self, names, count=False):
+        attrs = ' count="%i"' % (len(names),) if count else ''
+        return (200, '<directory%s>\n%s</directory>\n' % (attrs, ''.join(['  <entry name="%s"/>\n' % (n,) for n in names])))
+
+    def obs_list_projects(self):
+        return self.directory(sorted(self.server.state.projects.keys()))
+
+    def obs_list_packages(self, project):
+        return self.directory(sorted(self.project(project)['packages'].keys()), count=True)
+
+    def obs_delete_project(self, project):
+        self.project(project)
+        del self.server.state.projects[project]
+        return (200, obs_status('ok', 'Ok'))
+
+    def obs_project_file(self, project, file):
+        key = file[1:]
+        if self.command == 'GET':
+            return (200, self.project(project)[key])
+        if key == 'meta' and project not in self.server.state.projects:
+            self.server.state.projects[project] = { 'meta': b'', 'config': b'', 'packages': {} }
+        self.project(project)[key] = self.body
+        return (200, obs_status('ok', 'Ok'))
+
+    def obs_package_file(self, project, package, file):
+        if self.command == 'GET':
+            files = self.package(project, package)
+            if file not in files:
+                raise StandInError(404, '%s: no such file' % (file,))
+            return (200, files[file])
+        packages = self.project(project)['packages']
+        if file == '_meta' and package not in packages:
+            packages[package] = {}
+        self.package(project, package)[file] = self.body
+        return (200, obs_status('ok', 'Ok'))
+
+    def obs_delete_package(self, project, package):
+        self.package(project, package)
+        del self.project(project)['packages'][package]
+        return (200, obs_status('ok', 'Ok'))
+
+    def obs_package_command(self, project, package):
+        if self.query.get('cmd', None) != 'showlinked':
+            raise StandInError(400, 'Unknown command')
+        self.package(project, package)
+        linked = []
+        for prj in sorted(self.server.state.projects.keys()):
+            for pkg, files in sorted(self.server.state.projects[prj]['packages'].items()):
+                if '_link' in files:
+                    link = ET.fromstring(files['_link'])
+                    if link.get('package') == package and link.get('project', prj) == project:
+                        linked.append('  <package project="%s" name="%s"/>\n' % (prj, pkg))
+        return (200, '<collection>\n%s</collection>\n' % (''.join(linked),))
+
+    def obs_principal(self, kind, name):
+        if kind == 'person' and name == self.server.state.user:
+            return (200, '<person>\n  <login>%s</login>\n</person>\n' % (name,))
+        raise StandInError(404, '%s %s not found' % (kind, name))
+
+    # Gitea
+
+    def branch_json(self, name, cid):
+        return { 'name': name, 'commit': { 'id': cid, 'message': self.server.state.commits[cid]['message'] } }
+
+    def tea_user(self):
+        return (200, { 'login': self.server.state.user })
+
+    def tea_create_repo(self):
+        data = self.json_body()
+        return (201, self.server.state.create_repo(self.server.state.user, data['name']))
+
+    def tea_list_repos(self, org):
+        repos = self.server.state.repos
+        return self.paged([repos[k]['info'] for k in sorted(repos.keys()) if k[0] == org])
+
+    def tea_repo(self, org, repo):
+        r = self.server.state.repo(org, repo)
+        if self.command == 'DELETE':
+            del self.server.state.repos[(org, repo)]
+            return (204, b'')
+        if self.command == 'PATCH':
+            r['info'].update(self.json_body())
+        return (200, r['info'])
+
+    def tea_fork(self, org, repo):
+        state = self.server.state
+        data = self.json_body()
+        src = state.repo(org, repo)
+        return (202, state.create_repo(data.get('organization', state.user), data.get('name', repo),
+                                       parent=(org, repo), branches=src['branches']))
+
+    def tea_branches(self, org, repo):
+        r = self.server.state.repo(org, repo)
+        if self.command == 'GET':
+            return self.paged([self.branch_json(b, r['branches'][b]) for b in sorted(r['branches'].keys())])
+        data = self.json_body()
+        branch = data['new_branch_name']
+        if branch in r['branches']:
+            raise StandInError(409, 'The branch %s already exists.' % (branch,))
+        ref = data.get('old_ref_name', r['info']['default_branch'])
+        if ref in r['branches']:
+            ref = r['branches'][ref]
+        elif ref not in self.server.state.commits:
+            raise StandInError(404, 'The old branch does not exist.')
+        r['branches'][branch] = ref
+        r['info']['empty'] = False
+        return (201, self.branch_json(branch, ref))
+
+    def tea_branch(self, org, repo, branch):
+        cid = self.server.state.branch_commit(org, repo, branch)
+        r = self.server.state.repo(org, repo)
+        if self.command == 'DELETE':
+            del r['branches'][branch]
+            return (204, b'')
+        data = self.json_body()
+        if data.get('old_commit_id', cid) != cid:
+            raise StandInError(409, 'Branch %s moved.' % (branch,))
+        if data['new_commit_id'] not in self.server.state.commits:
+            raise StandInError(404, 'Commit does not exist.')
+        r['branches'][branch] = data['new_commit_id']
+        return (200, self.branch_json(branch, data['new_commit_id']))
+
+    def tea_commit(self, org, repo, commit):
+        self.server.state.repo(org, repo)
+        if commit not in self.server.state.commits:
+            raise StandInError(404, 'sha not found')
+        return (200, { 'sha': commit, 'commit': { 'message': self.server.state.commits[commit]['message'] } })
+
+    def tea_merge_upstream(self, org, repo):
+        state = self.server.state
+        r = state.repo(org, repo)
+        branch = self.json_body()['branch']
+        if not r['info']['parent']:
+            raise StandInError(400, 'Repository is not a fork.')
+        parent = r['info']['parent']['full_name'].split('/')
+        r['branches'][branch] = state.branch_commit(parent[0], parent[1], branch)
+        return (200, { 'merge_type': 'fast-forward' })
+
+    def tea_contents_ext(self, org, repo):
+        state = self.server.state
+        files = state.commits[state.branch_commit(org, repo, self.query['ref'])]['files']
+        return (200, { 'dir_contents': [state.file_entry(files, path) for path in sorted(files.keys())] })
+
+    def apply_operations(self, org, repo, branch, operations, message):
+        state = self.server.state
+        parent = state.branch_commit(org, repo, branch)
+        files = dict(state.commits[parent]['files'])
+        for op in operations:
+            path = op['path']
+            if op['operation'] == 'create':
+                if path in files:
+                    raise StandInError(422, 'repository file already exists [path: %s]' % (path,))
+            elif path not in files:
+                raise StandInError(404, 'file does not exist [path: %s]' % (path,))
+            elif op.get('sha', None) != state.file_entry(files, path)['sha']:
+                raise StandInError(409, 'sha does not match [given: %s]' % (op.get('sha', None),))
+            if op['operation'] == 'delete':
+                del files[path]
+            else:
+                files[path] = base64.standard_b64decode(op['content'])
+        cid = state.commit(parent, files, message)
+        state.repo(org, repo)['branches'][branch] = cid
+        return { 'commit': { 'sha': cid, 'message': message },
+                 'files': [state.file_entry(files, op['path']) for op in operations if op['path'] in files] }
+
+    def tea_contents(self, org, repo):
+        data = self.json_body()
+        return (201, self.apply_operations(org, repo, data['branch'], data['files'], data.get('message', 'Update files')))
+
+    def tea_file(self, org, repo, path):
+        state = self.server.state
+        if self.command == 'GET':
+            files = state.commits[state.branch_commit(org, repo, self.query['ref'])]['files']
+            if path not in files:
+                raise StandInError(404, 'object does not exist [id: , rel_path: %s]' % (path,))
+            entry = state.file_entry(files, path)
+            entry.update({ 'encoding': 'base64', 'content': base64.standard_b64encode(files[path]).decode() })
+            return (200, entry)
+        data = self.json_body()
+        op = { 'path': path, 'content': data['content'], 'operation': 'update' if self.command == 'PUT' else 'create' }
+        if 'sha' in data:
+            op['sha'] = data['sha']
+        return (201 if self.command == 'POST' else 200,
+                self.apply_operations(org, repo, data['branch'], [op], data.get('message', 'Update ' + path)))
+
+    def tea_get_pull(self, org, repo, base, head):
+        state = self.server.state
+        state.repo(org, repo)
+        pr = state.pulls.get((org, repo, base, head), None)
+        if not pr:
+            raise StandInError(404, 'The target couldn\'t be found.')
+        return (200, pr)
+
+    def tea_open_pull(self, org, repo):
+        state = self.server.state
+        state.repo(org, repo)
+        data = self.json_body()
+        key = (org, repo, data['base'], data['head'])
+        if key in state.pulls:
+            raise StandInError(409, 'pull request already exists for these targets')
+        number = len(state.pulls) + 1
+        state.pulls[key] = {
+            'number': number,
+            'title': data['title'],
+            'body': data.get('body', ''),
+            'html_url': '%s/%s/%s/pulls/%i' % (self.server.url(), org, repo, number),
+            'merged': False,
+            'closed_at': None,
+            }
+        return (201, state.pulls[key])
+
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """OBS and Gitea API stand-in on a local HTTPS port
+
+    latency is added to every request in seconds, bandwidth limits the
+    transfer rate of request and response bodies in bytes per second."""
+    daemon_threads = True
+    page_size = 50  # Gitea default maximum
+
+    def __init__(self, latency=0, bandwidth=None, user='tester', verbose=False):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.verbose = verbose
+        self.state = StandInState(user)
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+        super().__init__(('127.0.0.1', 0), StandInRequest)
+        self.socket = self.get_ssl_context().wrap_socket(self.socket, server_side=True)
+        self.thread = None
+
+    def get_ssl_context(self):
+        if sys.version_info.major == 3 and sys.version_info.minor < 6:  # SLE 12
+            self.servercert = os.path.join(testdir, 'api/certificate12.pem')
+            serverkey = os.path.join(testdir, 'api/certkey12.pem')
+        else:
+            self.servercert = os.path.join(testdir, 'api/certificate.pem')
+            serverkey = os.path.join(testdir, 'api/certkey.pem')
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER if hasattr(ssl, 'PROTOCOL_TLS_SERVER') else ssl.PROTOCOL_TLSv1_2)
+        context.load_cert_chain(self.servercert, serverkey)
+        try:
+            context.set_ciphers("@SECLEVEL=1:ALL")
+        except ssl.SSLError:  # not available on SLE12
+            None
+        return context
+
+    def url(self):
+        return 'https://127.0.0.1:%i' % (self.server_address[1],)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = { 'connections': 0, 'requests': collections.Counter(), 'bytes_in': 0, 'bytes_out': 0,
+                           'in_flight': 0, 'max_in_flight': 0 }
+
+    def enter(self):
+        with self.stats_lock:
+            self.stats['in_flight'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+
+    def count(self, method, route, bytes_in, bytes_out):
+        with self.stats_lock:
+            self.stats['in_flight'] -= 1
+            self.stats['requests'][method + ' ' + route] += 1
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+
+    def delay(self, start, size):
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        delay -= time.monotonic() - start
+        if delay > 0:
+            time.sleep(delay)
+
+    def process_request(self, request, client_address):
+        with self.stats_lock:
+            self.stats['connections'] += 1
+        super().process_request(request, client_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        from obsapi.uploader import UploaderBase
+        if self.thread:
+            self.shutdown()
+            self.thread = None
+        UploaderBase.build_services.pop(self.url(), None)
+        self.server_close()
+
+    def write_config(self, home):
+        """osc and tea configuration for the stand-in in home
+        The stand-in serves the openSUSE build projects to the uploader"""
+        from obsapi.uploader import UploaderBase
+        UploaderBase.build_services[self.url()] = 'OBS'
+        config = configparser.ConfigParser(delimiters=('='), interpolation=None)
+        config[self.url()] = { 'user': self.state.user, 'pass': 'standin' }
+        with open(os.path.join(home, '.oscrc'), 'w') as f:
+            config.write(f)
+        os.makedirs(os.path.join(home, '.config/tea'), exist_ok=True)
+        with open(os.path.join(home, '.config/tea/config.yml'), 'w') as f:
+            f.write(yaml.dump({ 'logins': [{ 'name': 'standin', 'url': self.url(), 'token': 'standin' }] }))
+
+    def seed_upload(self, data, testdata='Kernel:HEAD'):
+        """Create the upstream project, package and repository for uploading the tar-up directory data
+        The build project metas are taken from the uploader tests"""
+        from kutil.config import get_kernel_project_package
+        project, package = get_kernel_project_package(data)
+        with open(os.path.join(testdir, 'api/test_repos.yaml'), 'r') as f:
+            metas = yaml.safe_load(f)[testdata]['in']
+        for prj in metas.keys():
+            self.state.seed_project(prj, metas[prj])
+        if project not in self.state.projects:
+            self.state.seed_project(project, '<project name="%s"/>\n' % (project,))
+        self.state.seed_project(project, self.state.projects[project]['meta'], [package])
+        self.state.seed_repo('pool', package, { 'README': b'kernel-source stand-in\n' })
+        return (project, package)
+
+
+def benchmark(args):
+    from obsapi.uploader import Uploader
+    tmp = tempfile.TemporaryDirectory()
+    data = os.path.join(tmp.name, 'data')
+    shutil.copytree(args.data, data)
+    if args.tarball:
+        with open(os.path.join(data, 'linux-standin.tar.bz2'), 'wb') as f:
+            for _ in range(args.tarball):
+                f.write(os.urandom(1 << 20))
+    environ = dict(os.environ)
+    os.environ['HOME'] = tmp.name
+    os.environ['XDG_CACHE_HOME'] = os.path.join(tmp.name, 'cache')
+    server = StandInServer(latency=args.latency / 1000, bandwidth=args.bandwidth * (1 << 20) if args.bandwidth else None,
+                           verbose=args.verbose).start()
+    try:
+        server.write_config(tmp.name)
+        server.seed_upload(data)
+        results = []
+        for run in range(args.runs):
+            if run and args.tarball:  # a new tarball in every run after the first one
+                with open(os.path.join(data, 'linux-standin.tar.bz2'), 'r+b') as f:
+                    f.write(os.urandom(1 << 10))
+            server.reset_stats()
+            timings = collections.OrderedDict()
+            start = time.monotonic()
+            ul = Uploader(server.url(), data, args.project, progress=args.verbose, ca=server.servercert,
+                          upload_batch_size=args.upload_batch_size << 20, http_cache=args.http_cache)
+            timings['init'] = time.monotonic() - start
+            for phase in ['upload', 'create_project', 'create_package']:
+                start = time.monotonic()
+                getattr(ul, phase)()
+                timings[phase] = time.monotonic() - start
+            results.append((timings, dict(server.stats)))
+    finally:
+        server.stop()
+        os.environ.clear()
+        os.environ.update(environ)
+        tmp.cleanup()
+    phases = list(results[0][0].keys())
+    print('%-4s %s %9s %9s %6s %12s %12s' % ('run', ' '.join(['%14s' % (p,) for p in phases]), 'total',
+                                             'requests', 'conns', 'sent', 'received'))
+    for run, (timings, stats) in enumerate(results):
+        print('%-4i %s %9.3f %9i %6i %12i %12i' % (run + 1, ' '.join(['%14.3f' % (timings[p],) for p in phases]),
+                                                   sum(timings.values()), sum(stats['requests'].values()),
+                                                   stats['connections'], stats['bytes_in'], stats['bytes_out']))
+    if args.verbose:
+        for run, (timings, stats) in enumerate(results):
+            print('\nrun %i requests:' % (run + 1,))
+            for route, count in sorted(stats['requests'].items()):
+                print('%6i %s' % (count, route))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bs-upload-kernel against a local OBS and Gitea stand-in')
+    parser.add_argument('--data', default=os.path.join(testdir, 'kutil/rpm/krnf'), help='tar-up directory to upload')
+    parser.add_argument('--project', default='home:tester:kernel', help='OBS project to upload to')
+    parser.add_argument('--latency', type=float, default=50, metavar='ms', help='latency added to each request')
+    parser.add_argument('--bandwidth', type=float, default=0, metavar='MiB/s', help='transfer rate limit, 0 for unlimited')
+    parser.add_argument('--tarball', type=int, default=0, metavar='MiB', help='add a random tarball of this size to the upload')
+    parser.add_argument('--upload-batch-size', type=int, default=0, metavar='MiB', help='split the upload into commits of at most this much base64 encoded content, 0 for a single commit')
+    parser.add_argument('--http-cache', action='store_true', help='keep API responses on disk for conditional requests')
+    parser.add_argument('--runs', type=int, default=2, help='number of consecutive uploads')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show uploader progress and requests')
+    benchmark(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
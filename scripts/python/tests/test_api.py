@@ -1,30 +1,39 @@
-from obsapi.teaapi import TeaAPI, json_custom_dump, update_maintainership, get_maintainership
+from obsapi.teaapi import TeaAPI, json_custom_dump, update_maintainership, get_maintainership, hash_content, ContentHashCache
+from kutil.config import init_repo
 from kutil.config import get_package_archs, get_kernel_projects, uniq
 from obsapi.obsapi import OBSAPI, PkgRepo, process_scmsync
-from obsapi.uploader import UploaderBase
+from obsapi.uploader import UploaderBase, Uploader
+from tests.standin import StandInServer, StandInRequest
 import xml.etree.ElementTree as ET
 from difflib import unified_diff
-from obsapi.api import APIError
+from obsapi.api import APIError, KeepAliveHTTPSHandler
 from threading import Thread
 import email.message
 import configparser
 import urllib.parse
+import urllib.error
 import email.policy
 import http.cookies
 import http.server
+import socketserver
+import subprocess
 import tempfile
 import unittest
+import hashlib
 import random
 import base64
 import shutil
 import types
 import json
+import time
 import yaml
 import bz2
 import ssl
 import sys
 import os
 
+sleep = time.sleep
+
 def cookies_to_dict(cookies):
     res = {}
     for k in cookies.keys():
@@ -48,7 +57,7 @@ class TestRequest(http.server.BaseHTTPRequestHandler):
         self.do_request()
 
     def do_request(self):
-        data = self.server.data[self.server.index]
+        data = self.server.next_request(self.command, self.path)
         self.server.index += 1
         self.check_request(data)
         self.send_reply(data)
@@ -129,7 +138,7 @@ class TestRequest(http.server.BaseHTTPRequestHandler):
                 else:
                     self.send_header('set-cookie', c + '=' + cookies[c] + '; Path=/; Max-Age=86400; Secure; HttpOnly;')
 
-        for hdr in ['Content-Type', 'www-authenticate', 'location', 'X-Total-Count']:
+        for hdr in ['Content-Type', 'www-authenticate', 'location', 'X-Total-Count', 'ETag']:
             if hdr in headers:
                 for value in headers.get_all(hdr):
                     self.send_header(hdr, value)
@@ -141,21 +150,100 @@ class TestRequest(http.server.BaseHTTPRequestHandler):
             self.wfile.write(body)
             self.wfile.flush()
         else:
+            self.send_header('Content-Length', 0)
             self.end_headers()
 
 
+class KeepAliveTestRequest(TestRequest):
+    __test__ = False  # not a unit test class
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+
+
+class PagingTestRequest(TestRequest):
+    """Serve server.items split into pages of at most server.page_size items like gitea does"""
+    __test__ = False  # not a unit test class
+
+    def do_request(self):
+        self.server.index += 1
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        limit = min(int(query['limit'][0]), self.server.page_size)
+        page = int(query.get('page', ['1'])[0])
+        self.server.pages.append(page)
+        self.send_reply({
+            'code': 200,
+            'reason': 'OK',
+            'headers': [{'Content-Type': 'application/json'}, {'X-Total-Count': str(len(self.server.items))}],
+            'json': self.server.items[(page - 1) * limit:page * limit],
+            })
+
+
+class ConditionalTestRequest(TestRequest):
+    """Serve server.items with an ETag, reply 304 when the client has the current version"""
+    __test__ = False  # not a unit test class
+
+    def do_request(self):
+        self.server.index += 1
+        etag = '"%s"' % (hashlib.sha256(json.dumps(self.server.items).encode()).hexdigest(),)
+        self.server.conditional.append(self.headers.get('If-None-Match', None))
+        data = {
+            'code': 200,
+            'reason': 'OK',
+            'headers': [{'Content-Type': 'application/json'}, {'ETag': etag}, {'Set-Cookie': 'session=secret'}],
+            'json': self.server.items,
+            }
+        if self.headers.get('If-None-Match', None) == etag:
+            data = { 'code': 304, 'reason': 'Not Modified', 'headers': [{'ETag': etag}] }
+        self.send_reply(data)
+
+
 class TestServer(http.server.HTTPServer):
     __test__ = False  # not a unit test class
 
-    def __init__(self, address, requast, data):
+    def __init__(self, address, requast, data, any_order=False):
         self.index = 0
+        self.any_order = any_order
+        self.served = set()
+        self.connections = 0
         with open(data, 'rb') as f:
             self.data = list(yaml.load_all(f, Loader=yaml.SafeLoader))
         super().__init__(address, requast)
 
+    def next_request(self, method, path):
+        """The next logged request, or with any_order the first one not served yet that matches
+        for tests of concurrently issued requests which may arrive in any order"""
+        if not self.any_order:
+            return self.data[self.index]
+        pending = [i for i in range(len(self.data)) if i not in self.served]
+        parsed_path = urllib.parse.urlparse(path)
+        for i in pending:
+            parsed_url = urllib.parse.urlparse(self.data[i]['url'])
+            if (self.data[i]['method'] == method and parsed_url.path == parsed_path.path and
+                urllib.parse.parse_qs(parsed_url.query) == urllib.parse.parse_qs(parsed_path.query)):
+                break
+        else:
+            i = pending[0]  # mismatch reported by check_request
+        self.served.add(i)
+        return self.data[i]
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+class KeepAliveTestServer(socketserver.ThreadingMixIn, TestServer):
+    """A thread per connection, the client opens a new connection while another one is idle"""
+    __test__ = False  # not a unit test class
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        socketserver.ThreadingMixIn.process_request(self, request, client_address)
+
 class ServerThread():
-    def __init__(self, data):
-        self.httpd = TestServer(('', 0), TestRequest, data)
+    def __init__(self, data, keepalive=False, handler=None, any_order=False):
+        if not handler:
+            handler = KeepAliveTestRequest if keepalive else TestRequest
+        self.httpd = (KeepAliveTestServer if keepalive else TestServer)(('', 0), handler, data, any_order)
         self.httpd.socket = self.get_ssl_context().wrap_socket(self.httpd.socket, server_side=True)
 
     def get_ssl_context(self):
@@ -332,6 +420,33 @@ class TestMisc(unittest.TestCase):
         for data in testexcept:
             self.assertRaises(Exception)
 
+    def test_hash_content(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            hasher = init_repo(tmpdir, 'repo', 'whatever')
+            for fn in ['tests/api/binary_garbage', 'tests/api/content/update/added.tar.bz2', '/dev/null']:
+                blob = subprocess.check_output(['git', 'hash-object', os.path.abspath(fn)], cwd=hasher, universal_newlines=True).splitlines()[0]
+                with open(fn, 'rb') as f:
+                    oid = hashlib.sha256(f.read()).hexdigest()
+                self.assertEqual(hash_content(fn), (blob, oid))
+
+    def test_content_hash_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'file')
+            cache_file = os.path.join(tmpdir, 'cache.json')
+            with open(fn, 'w') as f:
+                f.write('foo')
+            reference = hash_content(fn)
+            self.assertEqual(ContentHashCache(cache_file).hash_files({fn: os.stat(fn)}), {fn: reference})
+            st = os.stat(fn)
+            with open(fn, 'w') as f:
+                f.write('bar')
+            os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns))
+            # same size and mtime, the cached value from the previous upload is used
+            self.assertEqual(ContentHashCache(cache_file).hash_files({fn: os.stat(fn)}), {fn: reference})
+            os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+            self.assertEqual(ContentHashCache(cache_file).hash_files({fn: os.stat(fn)}), {fn: hash_content(fn)})
+            self.assertNotEqual(hash_content(fn), reference)
+
 class APITest(unittest.TestCase):
     def log_cycle(self, test_fn, orig_log):
         tmpdir = tempfile.TemporaryDirectory()
@@ -411,7 +526,7 @@ class TestTea(APITest):
 
     def test_list_repos(self):
         def test_fn(inlog, outlog):
-            st = ServerThread(inlog)
+            st = ServerThread(inlog, any_order=True)
             st.start_server(teaconfig=self.config)
             api = TeaAPI(st.url(), config=self.config, ca=st.servercert, logfile=outlog)
             reference = ['kernel-source', 'kernel-livepatch-MICRO-6-0-RT_Update_10', 'kernel-livepatch-MICRO-6-0-RT_Update_11', 'kernel-livepatch-MICRO-6-0-RT_Update_12', 'kernel-livepatch-MICRO-6-0-RT_Update_4', 'kernel-livepatch-MICRO-6-0-RT_Update_5', 'kernel-livepatch-MICRO-6-0-RT_Update_6', 'kernel-livepatch-MICRO-6-0-RT_Update_7', 'kernel-livepatch-MICRO-6-0-RT_Update_8', 'kernel-livepatch-MICRO-6-0-RT_Update_9', 'kernel-livepatch-MICRO-6-0_Update_10', 'kernel-livepatch-MICRO-6-0_Update_11', 'kernel-livepatch-MICRO-6-0_Update_12', 'kernel-livepatch-MICRO-6-0_Update_13', 'kernel-livepatch-MICRO-6-0_Update_4', 'kernel-livepatch-MICRO-6-0_Update_5', 'kernel-livepatch-MICRO-6-0_Update_6', 'kernel-livepatch-MICRO-6-0_Update_7', 'kernel-livepatch-MICRO-6-0_Update_8', 'kernel-livepatch-MICRO-6-0_Update_9', 'kgraft-patch-SLE12-SP5_Update_64', 'kgraft-patch-SLE12-SP5_Update_65', 'kgraft-patch-SLE12-SP5_Update_66', 'kgraft-patch-SLE12-SP5_Update_67', 'kgraft-patch-SLE12-SP5_Update_68', 'kgraft-patch-SLE12-SP5_Update_69', 'kgraft-patch-SLE12-SP5_Update_70', 'kgraft-patch-SLE12-SP5_Update_71', 'kgraft-patch-SLE12-SP5_Update_72', 'kgraft-patch-SLE12-SP5_Update_73', 'kgraft-patch-SLE12-SP5_Update_74', 'kgraft-patch-SLE12-SP5_Update_75', 'kernel-livepatch-SLE15-SP4_Update_35', 'kernel-livepatch-SLE15-SP4_Update_36', 'kernel-livepatch-SLE15-SP4_Update_37', 'kernel-livepatch-SLE15-SP4_Update_38', 'kernel-livepatch-SLE15-SP4_Update_39', 'kernel-livepatch-SLE15-SP4_Update_40', 'kernel-livepatch-SLE15-SP4_Update_41', 'kernel-livepatch-SLE15-SP4_Update_42', 'kernel-livepatch-SLE15-SP4_Update_43', 'kernel-livepatch-SLE15-SP4_Update_44', 'kernel-livepatch-SLE15-SP4_Update_45', 'kernel-livepatch-SLE15-SP4_Update_46', 'kernel-livepatch-SLE15-SP4_Update_47', 'kernel-livepatch-SLE15-SP5_Update_22', 'kernel-livepatch-SLE15-SP5_Update_23', 'kernel-livepatch-SLE15-SP5_Update_24', 'kernel-livepatch-SLE15-SP5_Update_25', 'kernel-livepatch-SLE15-SP5_Update_26', 'kernel-livepatch-SLE15-SP5_Update_27', 'kernel-livepatch-SLE15-SP5_Update_28', 'kernel-livepatch-SLE15-SP5_Update_29', 'kernel-livepatch-SLE15-SP5_Update_30', 'kernel-livepatch-SLE15-SP5_Update_31', 'kernel-livepatch-SLE15-SP5_Update_32', 'kernel-livepatch-SLE15-SP5_Update_33', 'kernel-livepatch-SLE15-SP6_Update_10', 'kernel-livepatch-SLE15-SP6_Update_11', 'kernel-livepatch-SLE15-SP6_Update_12', 'kernel-livepatch-SLE15-SP6_Update_13', 'kernel-livepatch-SLE15-SP6_Update_14', 'kernel-livepatch-SLE15-SP6_Update_15', 'kernel-livepatch-SLE15-SP6_Update_16', 'kernel-livepatch-SLE15-SP6_Update_17', 'kernel-livepatch-SLE15-SP6_Update_18', 'kernel-livepatch-SLE15-SP6_Update_7', 'kernel-livepatch-SLE15-SP6_Update_8', 'kernel-source-rt', 'kernel-livepatch-SLE16_Update_3', 'kernel-livepatch-SLE16_Update_2', 'kernel-livepatch-SLFO-Main_Update_0', 'kernel-livepatch-SLFO-Main-RT_Update_0', 'kernel-livepatch-SLE15-SP6_Update_9', 'kernel-livepatch-SLE15-SP7-RT_Update_0', 'kernel-livepatch-SLE15-SP7-RT_Update_1', 'kernel-livepatch-SLE15-SP7-RT_Update_2', 'kernel-livepatch-SLE15-SP7-RT_Update_3', 'kernel-livepatch-SLE15-SP7-RT_Update_4', 'kernel-livepatch-SLE15-SP7-RT_Update_5', 'kernel-livepatch-SLE15-SP7-RT_Update_6', 'kernel-livepatch-SLE15-SP7-RT_Update_7', 'kernel-livepatch-SLE15-SP7_Update_0', 'kernel-livepatch-SLE15-SP7_Update_1', 'kernel-livepatch-SLE15-SP7_Update_2', 'kernel-livepatch-SLE15-SP7_Update_3', 'kernel-livepatch-SLE15-SP7_Update_4', 'kernel-livepatch-SLE15-SP7_Update_5', 'kernel-livepatch-SLE15-SP7_Update_6', 'kernel-livepatch-SLE15-SP7_Update_7', 'kernel-livepatch-SLE16-RT_Update_0', 'kernel-livepatch-SLE16-RT_Update_1', 'kernel-livepatch-SLE16-RT_Update_2', 'kernel-livepatch-SLE16-RT_Update_3', 'kernel-livepatch-SLE16_Update_0', 'kernel-livepatch-SLE16_Update_1', 'kernel-source-longterm', 'kernel-source-vanilla', 'kernel-livepatch-MICRO-6-0-RT_Update_2', 'kernel-livepatch-MICRO-6-0-RT_Update_3', 'kernel-livepatch-MICRO-6-0_Update_2', 'kernel-livepatch-MICRO-6-0_Update_3', 'kgraft-patch-SLE12-SP5_Update_76', 'kernel-livepatch-SLE15-SP4_Update_48', 'kernel-livepatch-SLE15-SP5_Update_34', 'kernel-livepatch-SLE15-SP6_Update_19', 'kernel-livepatch-SLE15-SP7-RT_Update_8', 'kernel-livepatch-SLE15-SP7_Update_8', 'kernel-livepatch-SLE16-RT_Update_4', 'kernel-livepatch-SLE16_Update_4', 'SLFO', 'kernel-livepatch-MICRO-6-0-RT_Update_14', 'kernel-livepatch-MICRO-6-0-RT_Update_17', 'kgraft-patch-SLE12-SP5_Update_77', 'kernel-livepatch-SLE15-SP4_Update_49', 'kernel-livepatch-SLE15-SP5_Update_35', 'kernel-livepatch-SLE15-SP6_Update_20', 'kernel-livepatch-SLE15-SP7-RT_Update_9', 'kernel-livepatch-SLE15-SP7_Update_9', 'kernel-livepatch-SLE16-RT_Update_5', 'kernel-livepatch-SLE16_Update_5', 'kernel-livepatch-MICRO-6-0-RT_Update_13', 'kernel-livepatch-MICRO-6-0_Update_14', 'kgraft-patch-SLE12-SP5_Update_78', 'kernel-livepatch-SLE15-SP4_Update_50', 'kernel-livepatch-SLE15-SP5_Update_36', 'kernel-livepatch-SLE15-SP6_Update_21', 'kernel-livepatch-SLE15-SP7-RT_Update_10', 'kernel-livepatch-SLE15-SP7_Update_10', 'kernel-livepatch-SLE16-RT_Update_6', 'kernel-livepatch-SLE16_Update_6', 'SLFO_Kernel', 'kernel-livepatch-MICRO-6-0-RT_Update_15', 'kernel-livepatch-MICRO-6-0-RT_Update_19', 'kgraft-patch-SLE12-SP5_Update_79', 'kernel-livepatch-SLE15-SP5_Update_37', 'kernel-livepatch-SLE15-SP6_Update_22', 'kernel-livepatch-SLE15-SP7-RT_Update_11', 'kernel-livepatch-SLE15-SP7_Update_11', 'kernel-livepatch-SLE16-RT_Update_7', 'kernel-livepatch-SLE16_Update_7', 'kernel-livepatch-MICRO-6-0-RT_Update_18', 'kernel-livepatch-MICRO-6-0_Update_16', 'kernel-livepatch-MICRO-6-0_Update_17', 'kernel-livepatch-MICRO-6-0_Update_18']
@@ -547,6 +662,164 @@ foobar''')
             self.assertTrue(st.data_consumed)
         self.log_cycle(test_fn, 'tests/api/branch_roll_forward')
 
+    def test_keep_alive(self):
+        for keepalive in [False, True]:
+            log = os.path.join(self.tmpdir.name, 'log')
+            st = ServerThread('tests/api/branch_new', keepalive=keepalive)
+            st.start_server(teaconfig=self.config)
+            api = TeaAPI(st.url(), config=self.config, ca=st.servercert, logfile=log)
+            api.create_or_reset_branch('michals', 'testrepo', 'downstream', 'testbranch', '60298bc4bf915a41f8f16f64d05a4125b434ca63112c53ba6779b039123c6db6', True)
+            self.assertTrue(st.data_consumed)
+            api.logfile.flush()
+            with open(log, 'rb') as f:
+                requests = list(yaml.load_all(f, Loader=yaml.SafeLoader))
+            os.unlink(log)
+            # requests that are not idempotent always take a new connection
+            new = [i == 0 or not keepalive or r['method'] != 'GET' for i, r in enumerate(requests)]
+            self.assertEqual(st.httpd.connections, len([n for n in new if n]))
+            if keepalive:
+                self.assertIn('reused', [r['connection'] for r in requests])
+            self.assertEqual([r['connection'] for r in requests], ['new' if n else 'reused' for n in new])
+            for r in requests:
+                self.assertTrue(r['duration'] >= 0)
+            st.stop_server()
+
+    def test_repo_cache(self):
+        st = ServerThread('tests/api/branch_new')
+        st.start_server(teaconfig=self.config)
+        api = TeaAPI(st.url(), config=self.config, ca=st.servercert)
+        branches = api.repo_branches('michals', 'testrepo')
+        self.assertEqual(api.repo_branches('michals', 'testrepo'), branches)
+        self.assertEqual(st.httpd.index, 1)
+        # the branch list is not fetched again, creating the branch drops it
+        api.create_or_reset_branch('michals', 'testrepo', 'downstream', 'testbranch', '60298bc4bf915a41f8f16f64d05a4125b434ca63112c53ba6779b039123c6db6', True)
+        self.assertTrue(st.data_consumed)
+        self.assertNotIn(('michals', 'testrepo'), api._repo_cache)
+        st.stop_server()
+
+    def test_http_cache(self):
+        st = ServerThread('/dev/null', handler=ConditionalTestRequest)
+        st.httpd.items = [{'name': 'testrepo'}]
+        st.httpd.conditional = []
+        st.httpd.data = [None] * 4
+        st.start_server(teaconfig=self.config)
+        cache = os.path.join(self.tmpdir.name, 'http')
+        api = TeaAPI(st.url(), config=self.config, ca=st.servercert, http_cache=cache)
+        path = '/api/v1/users/michals/repos'
+        self.assertEqual(api.check_get(path).json(), [{'name': 'testrepo'}])
+        self.assertEqual(len(os.listdir(cache)), 1)
+        with open(os.path.join(cache, os.listdir(cache)[0]), 'r') as f:
+            self.assertEqual([h[0] for h in json.load(f)['headers']], ['Content-Type', 'ETag'])
+        # another process sharing the cache
+        api = TeaAPI(st.url(), config=self.config, ca=st.servercert, http_cache=cache)
+        r = api.check_get(path)
+        self.assertTrue(r.from_cache)
+        self.assertEqual(r.status, 200)
+        self.assertEqual(r.json(), [{'name': 'testrepo'}])
+        self.assertEqual(r.headers['Content-Type'], 'application/json')
+        st.httpd.items = [{'name': 'testrepo'}, {'name': 'other'}]
+        r = api.check_get(path)
+        self.assertFalse(getattr(r, 'from_cache', False))
+        self.assertEqual(r.json(), st.httpd.items)
+        self.assertTrue(api.check_get(path).from_cache)
+        self.assertTrue(st.data_consumed)
+        self.assertEqual([c is not None for c in st.httpd.conditional], [False, True, True, True])
+        st.stop_server()
+
+    def test_page_url(self):
+        st = ServerThread('/dev/null', handler=PagingTestRequest)
+        st.httpd.items = [{'name': 'branch%i' % (i,)} for i in range(23)]
+        st.httpd.page_size = 5
+        st.httpd.pages = []
+        st.httpd.data = [None] * 5
+        st.start_server(teaconfig=self.config)
+        api = TeaAPI(st.url(), config=self.config, ca=st.servercert)
+        self.assertEqual(api._page_url('/api/v1/repos/michals/testrepo/branches'), st.httpd.items)
+        self.assertTrue(st.data_consumed)
+        self.assertEqual(sorted(st.httpd.pages), [1, 2, 3, 4, 5])
+        st.stop_server()
+
+    def test_contents_body(self):
+        st = ServerThread('/dev/null')
+        st.start_server(teaconfig=self.config)
+        st.stop_server()
+        api = TeaAPI(st.url(), config=self.config, ca=st.servercert)
+        src = os.path.abspath('tests/api/content/update')
+        operations = [
+                { 'content': os.path.join(src, 'added.tar.bz2'), 'path': 'added.tar.bz2', 'operation': 'create' },
+                { 'content': os.path.join(src, 'outdated'), 'path': 'outdated', 'operation': 'update', 'sha': 'cafe' },
+                { 'path': 'to_be_removed', 'operation': 'delete', 'sha': 'dead' },
+                ]
+        reference = []
+        for op in operations:
+            op = dict(op)
+            if 'content' in op:
+                with open(op['content'], 'rb') as f:
+                    op['content'] = base64.standard_b64encode(f.read()).decode()
+            reference.append(op)
+        reference = json.dumps({ 'branch': 'testbranch', 'files': reference, 'message': 'Update flies' }).encode()
+        body = api.contents_body('testbranch', operations, 'Update flies')
+        self.assertEqual(len(body), len(reference))
+        self.assertEqual(bytes(body), reference)
+        self.assertEqual(bytes(body), reference)  # can be re-sent
+
+        self.assertEqual(api.batch_operations(operations), [operations])
+        self.assertEqual(api.batch_operations([]), [])
+        api.upload_batch_size = 340
+        self.assertEqual(api.batch_operations(operations), [operations])
+        # the limit counts the content as sent, 252 bytes of the files take 340 in base64
+        api.upload_batch_size = 339
+        self.assertEqual(api.batch_operations(operations), [operations[0:1], operations[1:]])
+        api.upload_batch_size = 1
+        self.assertEqual(api.batch_operations(operations), [operations[0:1], operations[1:]])
+
+    def test_contents_retry(self):
+        st = ServerThread('/dev/null')
+        st.start_server(teaconfig=self.config)
+        st.stop_server()
+        api = TeaAPI(st.url(), config=self.config, ca=st.servercert, progress=None, upload_batch_size=1)
+        src = os.path.abspath('tests/api/content/update')
+        added = os.path.join(src, 'added')
+        outdated = os.path.join(src, 'outdated')
+        operations = [
+                { 'content': added, 'path': 'added', 'operation': 'create' },
+                { 'content': outdated, 'path': 'outdated', 'operation': 'update', 'sha': 'old' },
+                { 'path': 'to_be_removed', 'operation': 'delete', 'sha': 'gone' },
+                ]
+        remote = { 'outdated': { 'sha': 'old' }, 'to_be_removed': { 'sha': 'gone' } }
+        posted = []
+        failures = [OSError('connection reset'), APIError('server error', status=502), APIError('conflict', status=409)]
+        attempts = []
+        def check_post(path, data=None, headers=None, attempt=0):
+            attempts.append(attempt)
+            request = json.loads(bytes(data).decode())
+            apply = failures.pop(0) if failures else None
+            # the first failure loses the response of a successful request
+            if not isinstance(apply, APIError):
+                for f in request['files']:
+                    if f['operation'] == 'delete':
+                        del remote[f['path']]
+                    else:
+                        remote[f['path']] = { 'sha': hash_content(os.path.join(src, f['path']))[0] }
+                posted.append([(f['operation'], f['path']) for f in request['files']])
+            if apply:
+                raise apply
+        api.check_post = check_post
+        api.remote_files = lambda org, repo, branch, ignored=None: dict(remote)
+        time.sleep = lambda delay: None
+        try:
+            api.post_contents('michals', 'testrepo', 'testbranch', operations, 'Update flies')
+        finally:
+            time.sleep = sleep
+        self.assertEqual(posted, [[('create', 'added')], [('update', 'outdated'), ('delete', 'to_be_removed')]])
+        self.assertEqual(attempts, [0, 0, 1, 2])
+        self.assertEqual(remote, { 'added': { 'sha': hash_content(added)[0] }, 'outdated': { 'sha': hash_content(outdated)[0] } })
+
+        failures = [APIError('forbidden', status=403)]
+        with self.assertRaisesRegex(APIError, 'forbidden'):
+            api.post_contents('michals', 'testrepo', 'testbranch', operations[0:1], 'Update flies')
+
+
 
 class TestOBS(APITest):
     def setUp(self):
@@ -812,6 +1085,26 @@ Available credentials:  password: True  SSH key: False$'''
             self.assertTrue(st.data_consumed)
         self.log_cycle(test_fn, 'tests/api/obsapi_list_packages')
 
+    def test_iter_projects(self):
+        log = os.path.join(self.tmpdir.name, 'log')
+        with open(log, 'wb') as f:
+            for fn in ['tests/api/obsapi_list_projects', 'tests/api/obsapi_list_packages']:
+                with open(fn, 'rb') as src:
+                    f.write(src.read())
+        st = ServerThread(log, keepalive=True)
+        st.start_server(obsconfig=self.config)
+        api = OBSAPI(st.url(), config=self.config, cookiejar=self.cookiejar, ca=st.servercert)
+        projects = api.iter_projects()
+        self.assertEqual(next(projects), 'AlmaLinux:10')
+        projects.close()
+        # the short listing arrived complete with the first chunk, its connection is reused
+        packages = api.iter_project_packages('Kernel:tools')
+        self.assertEqual(next(packages), 'ShellCheck')
+        self.assertEqual(len(list(packages)), 112)
+        self.assertTrue(st.data_consumed)
+        self.assertEqual(st.httpd.connections, 1)
+        st.stop_server()
+
     def test_list_links(self):
         def test_fn(inlog, outlog):
             st = ServerThread(inlog)
@@ -859,8 +1152,10 @@ class FakeRequest:
 class FakeOBS:
     def __init__(self, prjmeta):
         self.prjmeta = prjmeta
+        self.requested = []
 
     def project_exists(self, project):
+        self.requested.append(project)
         prj = self.prjmeta.get(project, None)
         return FakeRequest(prj) if prj else None
 
@@ -892,6 +1187,33 @@ class TestUploader(unittest.TestCase):
                 ul.obs.url = 'https://api.opensuse.org'
             self.assertEqual(ul.get_project_repo_archs(), self.testdata[project]['out'])
 
+    def test_repo_archs_cache(self):
+        project = 'Devel:Kernel:SLE15-SP6'
+        ul = UploaderBase()
+        ul.obs = FakeOBS(self.testdata[project]['in'])
+        ul.obs.url = 'https://api.suse.de'
+        ul.project = project
+        ul.data = 'tests/kutil/rpm/krn'
+        self.assertEqual(ul.get_project_repo_archs(), self.testdata[project]['out'])
+        self.assertEqual(ul.get_project_repo_archs(), self.testdata[project]['out'])
+        requested = list(ul.obs.requested)
+        self.assertEqual(sorted(requested), sorted(set(ul.get_kernel_projects().values())))
+        # a different package selection gives a different table from the same meta
+        zfcpdump = ul.get_project_repo_archs(['zfcpdump'])
+        self.assertNotEqual(zfcpdump, self.testdata[project]['out'])
+        self.assertEqual([a for r in zfcpdump.values() for p in r.values() for archs in p.values() for a in archs], ['s390x'])
+        self.assertEqual(ul.obs.requested, requested)
+
+    def test_build_service(self):
+        ul = UploaderBase()
+        ul.obs = FakeOBS({})
+        ul.data = 'tests/kutil/rpm/krn'
+        ul.obs.url = 'https://api.opensuse.org'
+        self.assertEqual(ul.get_kernel_projects(), get_kernel_projects(ul.data)['OBS'])
+        ul.obs.url = 'https://127.0.0.1:1'
+        with self.assertRaisesRegex(APIError, '^Getting build repositories not supported for https://127.0.0.1:1'):
+            ul.get_kernel_projects()
+
     def test_prjmeta_factory(self):
         ul = UploaderBase()
         project = 'Devel:Kernel:master'
@@ -1230,3 +1552,169 @@ BuildFlags: !nouseforbuild:kernel-obs-build
 %endif
 '''
         self.printdiff(reference, ul.prjconf(debuginfo=True, rpm_checks=True))
+
+
+class TestStandIn(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.environ = dict(os.environ)
+        os.environ['HOME'] = self.tmpdir.name
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpdir.name, 'cache')
+        self.server = StandInServer().start()
+        self.server.write_config(self.tmpdir.name)
+
+    def tearDown(self):
+        self.server.stop()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.tmpdir.cleanup()
+
+    def test_upload(self):
+        data = 'tests/kutil/rpm/krnf'
+        state = self.server.state
+        self.assertEqual(self.server.seed_upload(data), ('openSUSE:Factory', 'kernel-source'))
+        for run in range(2):
+            self.server.reset_stats()
+            ul = Uploader(self.server.url(), data, 'home:tester:kernel', progress=False, ca=self.server.servercert)
+            commit = ul.upload()
+            ul.create_project()
+            ul.create_package()
+            self.assertEqual(state.repos[('tester', 'kernel-source')]['branches']['home/tester/kernel'], commit)
+            files = state.commits[commit]['files']
+            self.assertEqual(sorted(files.keys()), sorted(['.gitattributes'] + os.listdir(data)))
+            for fn in os.listdir(data):
+                with open(os.path.join(data, fn), 'rb') as f:
+                    self.assertEqual(files[fn], f.read())
+            project = state.projects['home:tester:kernel']
+            self.assertEqual(ET.fromstring(project['meta']).get('name'), 'home:tester:kernel')
+            self.assertIn(b'Substitute: kernel-dummy', project['config'])
+            self.assertIn(b'#' + commit.encode(), project['packages']['kernel-source']['_meta'])
+            self.assertEqual(ET.fromstring(project['packages']['kernel-default']['_link']).get('package'), 'kernel-source')
+            # nothing changed, nothing is uploaded again
+            self.assertEqual(self.server.stats['requests']['POST tea_contents'], 1 - run)
+            self.assertEqual(self.server.stats['requests']['POST tea_fork'], 1 - run)
+            summary = dict([((g['method'], g['path']), g) for g in ul.metrics.summary()])
+            self.assertEqual(sum([g['count'] for g in summary.values()]), sum(self.server.stats['requests'].values()))
+            self.assertEqual(sum([g['sent'] for g in summary.values()]), self.server.stats['bytes_in'])
+            self.assertEqual(sum([g['received'] for g in summary.values()]), self.server.stats['bytes_out'])
+            self.assertEqual(summary.get(('POST', '/api/v1/repos/{org}/{repo}/contents'), {}).get('count', 0), 1 - run)
+            self.assertEqual(summary[('PUT', '/source/{project}/{package}/_link')]['count'], 15)
+            for phase in ['init', 'fork_repo', 'upload', 'hash', 'create_project', 'create_package']:
+                self.assertIn(phase, ul.metrics.phases)
+            self.assertIn('PUT /source/{project}/_meta', ul.metrics.format_summary())
+            json.dumps(ul.metrics.json())
+
+    def test_batch(self):
+        state = self.server.state
+        pairs = [('openSUSE:Factory', 'package%i' % (i,)) for i in range(12)]
+        state.seed_project('openSUSE:Factory', '<project name="openSUSE:Factory"/>\n', [p for _, p in pairs[0:8]])
+        for i in range(4):
+            state.seed_repo('pool', 'package%i' % (i,), { 'README': b'' })
+        self.server.latency = 0.05
+        obs = OBSAPI(self.server.url(), ca=self.server.servercert)
+        tea = TeaAPI(self.server.url(), ca=self.server.servercert)
+        self.server.reset_stats()
+        start = time.monotonic()
+        exists = obs.packages_exist(pairs, in_flight=3)
+        self.assertLess(time.monotonic() - start, len(pairs) * self.server.latency)
+        self.assertEqual(list(exists.keys()), pairs)
+        self.assertEqual([not not exists[p] for p in pairs], [True] * 8 + [False] * 4)
+        self.assertEqual(self.server.stats['max_in_flight'], 3)
+        self.assertLessEqual(self.server.stats['connections'], 3)
+        repos = obs.package_repos(pairs)
+        self.assertEqual(repos[pairs[0]], PkgRepo(self.server.url(), 'pool', 'package0', None, None))
+        self.assertEqual([not not r for r in tea.repos_exist([(r.org, r.repo) for r in repos.values()]).values()], [True] * 4 + [False] * 8)
+        self.assertEqual(obs.packages_links([]), {})
+        with self.assertRaisesRegex(APIError, 'package8 not found'):
+            obs.packages_links(pairs)
+        links = obs.packages_links(pairs, return_exceptions=True)
+        self.assertEqual(links[pairs[0]], [])
+        self.assertIsInstance(links[pairs[11]], APIError)
+        self.assertEqual(links[pairs[11]].status, 404)
+
+    def test_keep_alive_pool(self):
+        state = self.server.state
+        pairs = [('openSUSE:Factory', 'package%i' % (i,)) for i in range(48)]
+        state.seed_project('openSUSE:Factory', '<project name="openSUSE:Factory"/>\n', [p for _, p in pairs[0:24]])
+        self.server.latency = 0.02
+        obs = OBSAPI(self.server.url(), ca=self.server.servercert)
+        # more requests in flight than idle connections kept
+        for run in range(2):
+            exists = obs.packages_exist(pairs, in_flight=4 * KeepAliveHTTPSHandler.max_idle)
+            self.assertEqual([not not exists[p] for p in pairs], [True] * 24 + [False] * 24)
+        for idle in obs._https_handler._pool.values():
+            self.assertLessEqual(len(idle), KeepAliveHTTPSHandler.max_idle)
+
+    def test_keep_alive_abandoned(self):
+        state = self.server.state
+        for i in range(4000):
+            state.seed_project('project%i' % (i,), '<project name="project%i"/>\n' % (i,))
+        obs = OBSAPI(self.server.url(), ca=self.server.servercert)
+        self.server.reset_stats()
+        projects = obs.iter_projects()
+        self.assertEqual(next(projects), 'project0')
+        projects.close()
+        # the connection of the listing abandoned before its end is not reused
+        self.assertEqual(len(obs.list_projects()), 4000)
+        self.assertEqual(self.server.stats['connections'], 2)
+        self.assertEqual(len(obs.list_projects()), 4000)
+        self.assertEqual(self.server.stats['connections'], 2)
+
+    def test_keep_alive_resend(self):
+        class ShortKeepAlive(StandInRequest):
+            timeout = 0.2
+        self.server.RequestHandlerClass = ShortKeepAlive
+        obs = OBSAPI(self.server.url(), ca=self.server.servercert)
+        obs.check_get('/about')
+        sleep(0.5)  # the server closes the idle connection
+        self.server.reset_stats()
+        r = obs.check_get('/about')
+        self.assertFalse(r.reused)
+        self.assertEqual(self.server.stats['connections'], 1)
+        # a closed connection that is not noticed in time is re-sent for idempotent requests
+        obs._https_handler._dropped = lambda conn: False
+        sleep(0.5)
+        r = obs.check_get('/about')
+        self.assertTrue(r.reused is False and r.resent)
+        # the server may process a request before closing the connection, a POST never takes a reused one
+        sleep(0.5)
+        self.server.reset_stats()
+        r = obs.post('/source/openSUSE:Factory/kernel-source')
+        self.assertFalse(r.reused or r.resent)
+        self.assertEqual(self.server.stats['requests']['POST obs_package_command'], 1)
+        self.server.RequestHandlerClass = StandInRequest
+        obs.check_get('/about')
+        r = obs.post('/source/openSUSE:Factory/kernel-source')
+        self.assertFalse(r.reused)
+
+    def test_keep_alive_idle_timeout(self):
+        obs = OBSAPI(self.server.url(), ca=self.server.servercert)
+        self.server.reset_stats()
+        obs.check_get('/about')
+        self.assertTrue(obs.check_get('/about').reused)
+        obs._https_handler.idle_timeout = 0.1
+        sleep(0.2)
+        self.assertFalse(obs.check_get('/about').reused)
+        self.assertEqual(self.server.stats['connections'], 2)
+
+    def test_batch_paging(self):
+        state = self.server.state
+        repos = [('pool', 'package%i' % (i,)) for i in range(12)]
+        for org, repo in repos:
+            state.seed_repo(org, repo, { 'README': b'' })
+            for i in range(120):
+                state.repos[(org, repo)]['branches']['branch%i' % (i,)] = state.repos[(org, repo)]['branches']['master']
+        self.server.latency = 0.02
+        tea = TeaAPI(self.server.url(), ca=self.server.servercert)
+        self.server.reset_stats()
+        # more requests in flight than idle connections kept, each listing is paged
+        in_flight = 2 * KeepAliveHTTPSHandler.max_idle
+        branches = tea.repos_branches(repos, in_flight=in_flight)
+        self.assertEqual([len(branches[r]) for r in repos], [121] * len(repos))
+        self.assertEqual(self.server.stats['requests']['GET tea_branches'], 3 * len(repos))
+        self.assertLessEqual(self.server.stats['max_in_flight'], in_flight)
+        # paging alone is still concurrent
+        self.server.reset_stats()
+        tea._repo_cache.clear()
+        self.assertEqual(len(tea.repo_branches(*repos[0])), 121)
+        self.assertEqual(self.server.stats['max_in_flight'], 2)
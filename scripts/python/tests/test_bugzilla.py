@@ -0,0 +1,491 @@
+from tests.bugzilla_bench import FakeBackend, fake_bugzilla, synthetic_bugs
+from tests.bugzilla_standin import BugzillaStandIn, synthetic_payloads, connect
+from bugzilla._session import _TokenBucket
+from bugzilla.cache import BugCache
+import bugzilla
+import importlib.machinery
+import requests
+import importlib.util
+import xmlrpc.client
+import contextlib
+import threading
+import tempfile
+import unittest
+import shutil
+import time
+import io
+import os
+
+
+class TestGetbugs(unittest.TestCase):
+    def setUp(self):
+        self.bugs = [
+            {'id': 3, 'alias': ['CVE-2024-0003'], 'summary': 'three'},
+            {'id': 1, 'alias': [], 'summary': 'one'},
+            {'id': 2, 'alias': 'CVE-2024-0002', 'summary': 'two'},
+            {'id': 4, 'alias': None, 'summary': 'four'},
+        ]
+        self.bz = fake_bugzilla(self.bugs)
+
+    def summaries(self, idlist):
+        return [b['summary'] for b in self.bz._getbugs(idlist, True)]
+
+    def test_order(self):
+        self.assertEqual(self.summaries([1, '2', 4, 3]), ['one', 'two', 'four', 'three'])
+        self.assertEqual(self.summaries(['CVE-2024-0002', 1, 'CVE-2024-0003']), ['two', 'one', 'three'])
+        self.assertEqual(self.bz._backend.calls, [('bug_get', [1, '2', 4, 3], []), ('bug_get', [1], ['CVE-2024-0002', 'CVE-2024-0003'])])
+
+    def test_missing(self):
+        self.assertEqual(self.summaries([5, 'CVE-2024-0004', 2, 'CVE-2024-0001']), ['two'])
+        self.assertEqual(self.summaries([]), [])
+
+    def test_duplicates(self):
+        self.assertEqual(self.summaries([2, 'CVE-2024-0002', 2]), ['two', 'two', 'two'])
+        # the first bug in the reply wins when the server repeats an id
+        self.bz._backend = FakeBackend(self.bugs, shuffle=False)
+        self.bz._backend.bugs.append({'id': 1, 'alias': ['CVE-2024-0003'], 'summary': 'again'})
+        self.assertEqual(self.summaries([1, 'CVE-2024-0003']), ['one', 'three'])
+
+    def test_getbugs(self):
+        bugs = self.bz.getbugs([4, 'CVE-2024-0003'])
+        self.assertEqual([b.id for b in bugs], [4, 3])
+        self.assertEqual(bugs[1].summary, 'three')
+
+    def test_synthetic(self):
+        bugs, idlist = synthetic_bugs(500)
+        self.bz._backend = FakeBackend(bugs)
+        got = self.bz._getbugs(idlist, True)
+        self.assertEqual(len(got), len(idlist))
+        for idval, bug in zip(idlist, got):
+            if isinstance(idval, int):
+                self.assertEqual(bug['id'], idval)
+            else:
+                self.assertIn(idval, bug['alias'])
+
+
+class TestBulkFetch(unittest.TestCase):
+    def setUp(self):
+        self.bugs, self.idlist = synthetic_bugs(50)
+        self.bz = fake_bugzilla(self.bugs)
+        self.bz.bulk_chunk_size = 8
+
+    def chunks(self, method):
+        return sorted(c for c in self.bz._backend.calls if c[0] == method)
+
+    def test_getbugs(self):
+        got = self.bz._getbugs(self.idlist, True)
+        self.assertEqual(len(got), 50)
+        for idval, bug in zip(self.idlist, got):
+            self.assertIn(idval, (bug['id'], bug['alias'][0] if bug['alias'] else None))
+        calls = self.chunks('bug_get')
+        self.assertEqual(len(calls), 7)
+        self.assertTrue(all(len(c[1]) + len(c[2]) <= 8 for c in calls))
+
+    def test_comments(self):
+        ids = [b['id'] for b in self.bugs]
+        comments = self.bz.get_comments(ids)
+        self.assertEqual(sorted(comments['bugs']), sorted(str(i) for i in ids))
+        self.assertEqual(comments['comments'], {})
+        self.assertEqual(comments['bugs'][str(ids[3])]['comments'][0]['bug_id'], ids[3])
+        calls = self.chunks('bug_comments')
+        self.assertEqual(len(calls), 7)
+        self.assertEqual(sorted(i for c in calls for i in c[1]), sorted(ids))
+
+    def test_history(self):
+        ids = [b['id'] for b in self.bugs]
+        history = self.bz.bugs_history_raw(ids)
+        self.assertEqual([h['id'] for h in history['bugs']], ids)
+        self.assertEqual(len(self.chunks('bug_history')), 7)
+
+    def test_unchunked(self):
+        self.bz.bulk_chunk_size = None
+        self.bz.bugs_history_raw([1, 2, 3])
+        self.bz.get_comments([])
+        self.assertEqual(self.bz._backend.calls, [('bug_history', [1, 2, 3]), ('bug_comments', [])])
+
+
+class TestBugCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='bugcache-')
+        self.path = os.path.join(self.tmpdir, 'bugs.sqlite')
+        self.bugs, self.idlist = synthetic_bugs(20)
+        for b in self.bugs:
+            b['last_change_time'] = xmlrpc.client.DateTime('20240101T00:00:00')
+        self.bz = fake_bugzilla(self.bugs)
+        self.bz._backend = FakeBackend(self.bugs, shuffle=False)
+        self.fields = ['id', 'summary', 'status', 'last_change_time']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def cache(self):
+        self.bz._backend.calls = []
+        return BugCache(self.bz, self.path)
+
+    def touch(self, n, **kwargs):
+        self.bugs[n]['last_change_time'] = xmlrpc.client.DateTime('20240202T00:00:%02d' % n)
+        self.bugs[n].update(kwargs)
+
+    def fetched(self, method='bug_get'):
+        return sorted(i for c in self.bz._backend.calls if c[0] == method for i in c[1])
+
+    def test_query(self):
+        cache = self.cache()
+        bugs = cache.query({'include_fields': self.fields})
+        self.assertEqual([b.summary for b in bugs], [b['summary'] for b in self.bugs])
+        self.assertEqual(self.fetched(), sorted(b['id'] for b in self.bugs))
+        self.assertEqual((cache.hits, cache.misses), (0, 20))
+        cache.close()
+
+        self.touch(3, summary='changed')
+        self.touch(7)
+        cache = self.cache()
+        bugs = cache.query({'include_fields': self.fields})
+        self.assertEqual(self.bz._backend.calls[0], ('bug_search', ['alias', 'id', 'last_change_time']))
+        self.assertEqual(self.fetched(), [self.bugs[3]['id'], self.bugs[7]['id']])
+        self.assertEqual((cache.hits, cache.misses), (18, 2))
+        self.assertEqual(bugs[3].summary, 'changed')
+        self.assertEqual([b.id for b in bugs], [b['id'] for b in self.bugs])
+        self.assertIsInstance(bugs[0].last_change_time, xmlrpc.client.DateTime)
+        self.assertEqual(str(bugs[7].last_change_time), '20240202T00:00:07')
+
+        # asking for more fields refetches, and remembers them
+        bugs = cache.query({'include_fields': self.fields + ['alias']})
+        self.assertEqual(bugs[0].alias, self.bugs[0]['alias'])
+        self.assertEqual(len(self.fetched()), 2 + 20)
+        cache.query({'include_fields': ['id', 'summary']})
+        cache.query({'include_fields': ['id', 'alias']})
+        self.assertEqual(len(self.fetched()), 2 + 20)
+        cache.query({})
+        self.assertEqual(len(self.fetched()), 2 + 20 + 20)
+        cache.query({'include_fields': self.fields})
+        self.assertEqual(len(self.fetched()), 2 + 20 + 20)
+
+    def test_getbugs(self):
+        ref = fake_bugzilla(self.bugs)
+        cache = self.cache()
+        ids = [self.idlist[5], self.idlist[2], 999]
+        bugs = cache.getbugs(ids, include_fields=self.fields)
+        self.assertEqual(len(bugs), 2)
+        self.assertEqual([b.id for b in bugs], [b.id for b in ref.getbugs(ids)])
+        wanted = {b.id for b in bugs}
+        self.touch(min(n for n, b in enumerate(self.bugs) if b['id'] not in wanted))
+        cache = self.cache()
+        self.assertEqual([b.id for b in cache.getbugs(ids, include_fields=self.fields)], [b.id for b in bugs])
+        # only the probe for the last_change_time
+        self.assertEqual(self.bz._backend.calls, [('bug_get', ids, [])])
+
+    def test_comments_history(self):
+        ref = fake_bugzilla(self.bugs)
+        ids = [b['id'] for b in self.bugs]
+        cache = self.cache()
+        self.assertEqual(cache.get_comments(ids), ref.get_comments(ids))
+        self.assertEqual(cache.bugs_history_raw(ids), ref.bugs_history_raw(ids))
+        self.assertEqual(self.fetched('bug_comments'), ids)
+
+        self.touch(4)
+        cache = self.cache()
+        self.assertEqual(cache.get_comments(ids[:10]), ref.get_comments(ids[:10]))
+        self.assertEqual(cache.bugs_history_raw(ids), ref.bugs_history_raw(ids))
+        self.assertEqual(self.fetched('bug_comments'), [ids[4]])
+        self.assertEqual(self.fetched('bug_history'), [ids[4]])
+        # the stamps of the probed bugs are reused by later calls
+        self.assertEqual(len([c for c in self.bz._backend.calls if c[0] == 'bug_get']), 2)
+
+    def test_permissions(self):
+        self.path = os.path.join(self.tmpdir, 'cache', 'bugs.sqlite')
+        self.cache().close()
+        self.assertEqual(os.stat(os.path.dirname(self.path)).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        # a cache created with looser permissions is fixed
+        os.chmod(self.path, 0o644)
+        self.cache().close()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+
+class TestBackends(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.payloads = synthetic_payloads(30)
+        cls.ids = [b['id'] for b in cls.payloads['bugs']]
+        cls.server = BugzillaStandIn(cls.payloads).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.batch_ids = True
+        self.server.reset_stats()
+
+    def fetch(self, backend, ids):
+        bz = connect(self.server, backend)
+        bz.bulk_chunk_size = 12
+        try:
+            bugs = bz.getbugs(ids, include_fields=['id', 'alias', 'summary', 'last_change_time'])
+            return ([b.get_raw_data() for b in bugs], bz.get_comments(ids),
+                    bz.bugs_history_raw(ids), bz.get_comments(ids[:3], include_fields=['id', 'text']))
+        finally:
+            bz.disconnect()
+
+    def requests(self, route):
+        return self.server.stats['requests'][route]
+
+    def test_rest(self):
+        ids = self.ids[:25] + ['CVE-2024-00027']
+        bugs, comments, history, _ = self.fetch('rest', ids)
+        self.assertEqual([b['id'] for b in bugs], self.ids[:25] + [self.ids[27]])
+        self.assertEqual(sorted(bugs[0]), ['alias', 'id', 'last_change_time', 'summary'])
+        self.assertEqual(bugs[4], {k: self.payloads['bugs'][4][k] for k in bugs[4]})
+        self.assertEqual(comments['bugs'], {str(i): self.payloads['comments'][str(i)] for i in self.ids[:25] + [self.ids[27]]})
+        self.assertEqual(history['bugs'], self.payloads['history'][:25] + [self.payloads['history'][27]])
+        # one request per chunk of 12
+        self.assertEqual(self.requests('GET rest_comment'), 3 + 1)
+        self.assertEqual(self.requests('GET rest_history'), 3)
+        # kept alive, at most one per concurrent chunk
+        self.assertLessEqual(self.server.stats['connections'], 3)
+
+    def test_rest_unbatched(self):
+        self.server.batch_ids = False
+        ids = self.ids[:20]
+        _, comments, history, _ = self.fetch('rest', ids)
+        self.assertEqual(sorted(comments['bugs']), sorted(str(i) for i in ids))
+        self.assertEqual([h['id'] for h in history['bugs']], ids)
+        self.assertEqual(self.requests('GET rest_comment'), 20 + 3)
+        self.assertEqual(self.requests('GET rest_history'), 20)
+
+    def test_xmlrpc(self):
+        ids = self.ids[:25]
+        rest = self.fetch('rest', ids)
+        xml = self.fetch('xmlrpc', ids)
+        self.assertEqual([b['id'] for b in xml[0]], ids)
+        self.assertIsInstance(xml[0][0]['last_change_time'], xmlrpc.client.DateTime)
+        self.assertEqual(sorted(xml[1]['bugs']), sorted(rest[1]['bugs']))
+        self.assertEqual([h['id'] for h in xml[2]['bugs']], ids)
+        self.assertEqual(self.requests('POST xmlrpc Bug.comments'), 3 + 1)
+
+
+class TestSession(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.payloads = synthetic_payloads(10)
+        cls.ids = [b['id'] for b in cls.payloads['bugs']]
+        cls.server = BugzillaStandIn(cls.payloads).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.failures = []
+        self.server.reset_stats()
+
+    def connect(self, backend):
+        bz = connect(self.server, backend)
+        bz._session._backoff = 0.01
+        return bz
+
+    def test_retry(self):
+        for backend in ('rest', 'xmlrpc'):
+            bz = self.connect(backend)
+            self.server.failures = [429, 'reset', 502, 503]
+            self.assertEqual(len(bz.get_comments(self.ids)['bugs']), 10)
+            stats = bz.get_request_stats()
+            self.assertEqual((stats['retries'], stats['throttled'], stats['server_errors'], stats['connection_errors']),
+                             (4, 2, 1, 1), backend)
+            self.assertEqual(stats['requests'], 1 + 5, backend)
+
+            self.server.failures = [500] * 6
+            with self.assertRaises(Exception):
+                bz.bugs_history_raw(self.ids)
+            self.assertEqual(bz.get_request_stats()['retries'], 4 + 5)
+
+    def test_no_retry_update(self):
+        # an update may have been applied when the server failed
+        bz = self.connect('xmlrpc')
+        self.server.failures = [502]
+        with self.assertRaises(requests.HTTPError) as cm:
+            bz._proxy.Bug.update({'ids': [self.ids[0]]})
+        self.assertEqual(cm.exception.response.status_code, 502)
+        # but not when it said it was throttling us
+        self.server.failures = [429, 'reset']
+        with self.assertRaises(Exception):
+            bz._proxy.Bug.update({'ids': [self.ids[0]]})
+        self.assertEqual(bz.get_request_stats()['retries'], 1)
+        self.assertEqual(self.server.stats['requests']['POST xmlrpc Bug.update'], 0)
+
+    def test_limits(self):
+        bz = self.connect('rest')
+        bz._session._bucket = _TokenBucket(20, 5)
+        bz._session._slots = threading.BoundedSemaphore(2)
+        self.server.latency = 0.02
+        try:
+            start = time.monotonic()
+            bz.bulk_chunk_size = 1
+            bz.bulk_workers = 8
+            bz.bugs_history_raw(self.ids * 2)
+            elapsed = time.monotonic() - start
+        finally:
+            self.server.latency = 0
+        stats = bz.get_request_stats()
+        self.assertEqual(stats['max_in_flight'], 2)
+        self.assertGreater(stats['concurrency_wait'], 0)
+        self.assertGreater(stats['rate_wait'], 0)
+        # 20 requests, 15 of them beyond the burst at 20/s
+        self.assertGreaterEqual(elapsed, 0.7)
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.bugs, self.idlist = synthetic_bugs(30)
+        self.bz = fake_bugzilla(self.bugs)
+        self.bz.bug_autorefresh = True
+        self.ids = [b['id'] for b in self.bugs]
+        self.fetched = self.bz.getbugs(self.ids, include_fields=['id', 'summary'])
+        self.bz._backend.calls = []
+
+    def test_autorefresh(self):
+        self.assertEqual([b.status for b in self.fetched], ['NEW'] * 30)
+        self.assertEqual(len(self.bz._backend.calls), 30)
+        self.assertEqual(self.bz.implicit_refreshes, {'status': 30})
+
+    def test_prefetch(self):
+        self.assertEqual(self.bz.prefetch_bugs(self.fetched, ['status', 'last_change_time']), 30)
+        self.assertEqual(self.bz._backend.calls, [('bug_get', self.ids, [])])
+        self.assertEqual([b.status for b in self.fetched], ['NEW'] * 30)
+        self.assertEqual(self.fetched[3].summary, 'bug 3')
+        # nothing missing, nothing to fetch
+        self.assertEqual(self.bz.prefetch_bugs(self.fetched, ['summary', 'short_desc', 'status']), 0)
+        self.assertEqual(self.bz.prefetch_bugs(self.fetched[:2] + [self.bz.getbugs([self.ids[5]], include_fields=['id'])[0]], 'status'), 1)
+        self.assertEqual(len(self.bz._backend.calls), 3)
+        # a field the server doesn't know is not refreshed bug by bug either
+        self.bz.prefetch_bugs(self.fetched, ['deadline'])
+        self.assertFalse(hasattr(self.fetched[0], 'deadline'))
+        self.assertEqual(len(self.bz._backend.calls), 4)
+        self.assertEqual(self.bz.implicit_refreshes, {})
+
+    def test_strict(self):
+        self.bz.bug_autorefresh_strict = True
+        with self.assertRaises(bugzilla.BugRefreshError) as e:
+            self.fetched[0].status
+        self.assertIn("Bug %i missing attribute 'status'" % self.ids[0], str(e.exception))
+        self.assertFalse(hasattr(self.fetched[0], 'status'))
+        self.assertEqual(getattr(self.fetched[0], 'status', None), None)
+        self.assertEqual(self.bz._backend.calls, [])
+        self.bz.prefetch_bugs(self.fetched, ['status'])
+        self.assertEqual(self.fetched[0].status, 'NEW')
+
+
+class TestDispatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        loader = importlib.machinery.SourceFileLoader('dispatch_cves', os.path.join(os.path.dirname(__file__), '..', 'dispatch-cves'))
+        spec = importlib.util.spec_from_loader(loader.name, loader)
+        cls.dispatch = importlib.util.module_from_spec(spec)
+        loader.exec_module(cls.dispatch)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='dispatch-')
+        self.bz = fake_bugzilla([])
+        self.updates = []
+        self.failing = set()
+        self.lost = set()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        def update_bugs(ids, vals):
+            with self.lock:
+                self.updates.append((sorted(ids), vals['assigned_to']))
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.05)
+            with self.lock:
+                self.in_flight -= 1
+            if self.lost.intersection(ids):
+                raise requests.ConnectionError('connection to bugzilla lost')
+            if self.failing.intersection(ids):
+                raise bugzilla.BugzillaError('update of %s failed' % (ids,), code=101)
+        self.bz.update_bugs = update_bugs
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def bug_update(self, bug, comment, email, **state):
+        path = os.path.join(self.tmpdir, str(bug))
+        with open(path, 'w') as f:
+            f.write(comment)
+        b = self.dispatch.BugUpdate(path, bug, [comment], '', email, 'developer')
+        b.__dict__.update(state)
+        return b
+
+    def test_dispatch(self):
+        todo = [self.bug_update(1, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(2, 'fix in foo\n', 'dev1@suse.de'),
+                self.bug_update(3, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(4, 'fix in bar\n', 'dev2@suse.de', already_dispatched=True),
+                self.bug_update(5, 'fix in baz\n', 'dev2@suse.de'),
+                self.bug_update(6, 'fix in qux\n', 'dev3@suse.de')]
+        self.failing = {5}
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            self.dispatch.dispatch_to_bugzilla(self.bz, todo, False, jobs=4)
+        # four update calls, run concurrently
+        self.assertEqual(self.max_in_flight, 4)
+        self.assertEqual(sorted(self.updates), [([1, 3], 'security@suse.de'), ([2], 'dev1@suse.de'),
+                                                ([5], 'dev2@suse.de'), ([6], 'dev3@suse.de')])
+        self.assertEqual(out.getvalue().splitlines(), ['OK: https://bugzilla.suse.com/show_bug.cgi?id=%i#c0' % i for i in (1, 2, 3, 6)])
+        self.assertEqual(err.getvalue().splitlines(), ['Failed to update bsc#5: update of [5] failed (code=101)'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['4', '5'])
+
+    def test_dispatch_group_failure(self):
+        todo = [self.bug_update(1, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(2, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(3, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(4, 'fix in foo\n', 'dev1@suse.de')]
+        self.failing = {2}
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            self.dispatch.dispatch_to_bugzilla(self.bz, todo, False, jobs=4)
+        # the failed group is retried one bug at a time
+        self.assertEqual(sorted(self.updates), [([1], 'security@suse.de'), ([1, 2, 3], 'security@suse.de'),
+                                                ([2], 'security@suse.de'), ([3], 'security@suse.de'),
+                                                ([4], 'dev1@suse.de')])
+        self.assertEqual(out.getvalue().splitlines(), ['OK: https://bugzilla.suse.com/show_bug.cgi?id=%i#c0' % i for i in (1, 3, 4)])
+        self.assertEqual(err.getvalue().splitlines(), ['Failed to update bsc#2: update of [2] failed (code=101)'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['2'])
+
+    def test_dispatch_group_lost(self):
+        todo = [self.bug_update(1, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(2, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(3, 'fix in foo\n', 'dev1@suse.de')]
+        self.lost = {2}
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            self.dispatch.dispatch_to_bugzilla(self.bz, todo, False, jobs=4)
+        # the group may have been updated, it is reported failed as a whole and not sent again
+        self.assertEqual(sorted(self.updates), [([1, 2], 'security@suse.de'), ([3], 'dev1@suse.de')])
+        self.assertEqual(out.getvalue().splitlines(), ['OK: https://bugzilla.suse.com/show_bug.cgi?id=3#c0'])
+        self.assertEqual(err.getvalue().splitlines(), ['Failed to update bsc#%i: connection to bugzilla lost' % i for i in (1, 2)])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['1', '2'])
+
+    def test_dispatch_group_http_rejected(self):
+        todo = [self.bug_update(1, 'NO ACTION NEEDED\n', 'security@suse.de'),
+                self.bug_update(2, 'NO ACTION NEEDED\n', 'security@suse.de')]
+
+        def update_bugs(ids, vals):
+            self.updates.append(sorted(ids))
+            if 2 in ids:
+                response = requests.Response()
+                response.status_code = 400
+                raise requests.HTTPError('400 Client Error', response=response)
+        self.bz.update_bugs = update_bugs
+        err = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(err):
+            self.dispatch.dispatch_to_bugzilla(self.bz, todo, False, jobs=4)
+        # an error reply of the REST API rejects the request, the bugs are tried one at a time
+        self.assertEqual(self.updates, [[1, 2], [1], [2]])
+        self.assertEqual(err.getvalue().splitlines(), ['Failed to update bsc#2: 400 Client Error'])
@@ -0,0 +1,102 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from kutil import cvedb
+from kutil.cvedb import CveDB, CveDBError
+
+
+CVE2BUGZILLA = """\
+CVE-2024-26581,BUGZILLA:1220337
+CVE-2024-26581,BUGZILLA:1220400
+CVE-2024-26582,SUSE-SU-2024:1234-1,BUGZILLA:1220338
+CVE-2024-2658,BUGZILLA:1219000
+"""
+
+CVSS_SCORES = """\
+CVE-2024-26581:
+  cvss3:
+    score: 4.7
+    vector: CVSS:3.1/AV:L/AC:H/PR:L/UI:N/S:U/C:N/I:N/A:H
+CVE-2024-26582:
+  cvss3:
+    vector: CVSS:3.1/AV:L/AC:L/PR:L/UI:N/S:U/C:H/I:H/A:H
+    score: '7.8'
+'CVE-2024-26583':
+  cvss4:
+    vector: CVSS:4.0/AV:L
+    vector_v3: CVSS:3.1/AV:L
+    comment: none
+    score: 5.5
+"""
+
+
+class TestCveDB(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="ks_cvedb")
+        self.write('cve2bugzilla', CVE2BUGZILLA)
+        self.write('cve2cvss', CVSS_SCORES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content, age=0):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        t = time.time() - age
+        os.utime(path, (t, t))
+
+    def test_lookup(self):
+        db = CveDB(self.tmpdir)
+        self.assertEqual(db.bugs(['CVE-2024-26581', 'cve-2024-26582', 'CVE-2024-2658', 'CVE-2024-1']),
+                         {'CVE-2024-26581': 1220337, 'CVE-2024-26582': 1220338, 'CVE-2024-2658': 1219000})
+        self.assertEqual(db.scores(['CVE-2024-26581', 'CVE-2024-26582', 'CVE-2024-26583', 'CVE-2024-2658']),
+                         {'CVE-2024-26581': '4.7', 'CVE-2024-26582': '7.8'})
+        db.close()
+
+    def test_reimport(self):
+        db = CveDB(self.tmpdir)
+        self.assertEqual(db.bugs(['CVE-2024-1']), {})
+        db.close()
+
+        # a changed feed is imported again, an unchanged one is not
+        self.write('cve2bugzilla', CVE2BUGZILLA + "CVE-2024-1,BUGZILLA:1\n")
+        with mock.patch.object(cvedb, 'parse_cvss_scores') as parse:
+            db = CveDB(self.tmpdir)
+            self.assertEqual(db.bugs(['CVE-2024-1', 'CVE-2024-26581']),
+                             {'CVE-2024-1': 1, 'CVE-2024-26581': 1220337})
+            self.assertEqual(db.scores(['CVE-2024-26581']), {'CVE-2024-26581': '4.7'})
+            parse.assert_not_called()
+            db.close()
+
+    def test_expire(self):
+        self.write('cve2bugzilla', CVE2BUGZILLA, age=2 * 86400)
+        reply = io.BytesIO(b"CVE-2024-1,BUGZILLA:1\n")
+        with mock.patch('urllib.request.urlopen', return_value=reply) as urlopen:
+            db = CveDB(self.tmpdir)
+            self.assertEqual(db.bugs(['CVE-2024-1', 'CVE-2024-26581']), {'CVE-2024-1': 1})
+            self.assertEqual(db.scores(['CVE-2024-26581']), {'CVE-2024-26581': '4.7'})
+            db.bugs(['CVE-2024-1'])
+            self.assertEqual(urlopen.call_count, 1)
+            db.close()
+
+    def test_fetch_failure(self):
+        self.write('cve2bugzilla', CVE2BUGZILLA, age=2 * 86400)
+        with mock.patch('urllib.request.urlopen', side_effect=OSError('unreachable')):
+            # the expired feed is used
+            db = CveDB(self.tmpdir, refresh=True)
+            self.assertEqual(db.bugs(['CVE-2024-26581']), {'CVE-2024-26581': 1220337})
+            db.close()
+
+            os.unlink(os.path.join(self.tmpdir, 'cve2cvss'))
+            db = CveDB(self.tmpdir)
+            with self.assertRaises(CveDBError):
+                db.scores(['CVE-2024-26581'])
+            db.close()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['cve.sqlite', 'cve2bugzilla'])
+
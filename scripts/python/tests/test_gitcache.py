@@ -0,0 +1,151 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import kutil.pygit2_wrapper as git
+from kutil import gitcache
+from kutil.config import load_json
+from kutil.gitcache import CommitStats, get_hashdict, patch_blobs, read_all_tags
+
+A = 'a' * 40
+B = 'b' * 40
+C = 'c' * 40
+D = 'd' * 40
+
+
+def patch(*tags):
+    return 'From: test\nSubject: test\n' + ''.join('%s\n' % (t,) for t in tags) + '\n---\n'
+
+
+class GitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="ks_gitcache")
+        self.repo = os.path.join(self.tmpdir, 'repo')
+        self.git('init', '-q', self.repo)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        return subprocess.check_output(('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com') + args,
+                                       cwd=self.tmpdir if args[0] == 'init' else self.repo).decode().strip()
+
+    def write(self, path, content):
+        path = os.path.join(self.repo, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def commit(self, msg):
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', msg)
+        return self.git('rev-parse', 'HEAD')
+
+
+class TestHashdict(GitTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patches = os.path.join(self.repo, 'patches.suse')
+        self.cache = os.path.join(self.tmpdir, 'hashdict.json')
+        self.write('patches.suse/one.patch', patch('Git-commit: ' + A))
+        self.write('patches.suse/sub/two.patch', patch('Git-commit: ' + B, 'Alt-commit: ' + C))
+        self.write('patches.suse/bad.patch', patch('Git-commit: not-a-sha'))
+        self.write('series.conf', 'patches.suse/one.patch\n')
+        self.commit('initial')
+
+    def blob(self, path):
+        return self.git('hash-object', os.path.join('patches.suse', path))
+
+    def test_blobs(self):
+        cache = dict()
+        blobs = patch_blobs(self.patches, cache)
+        self.assertEqual(blobs, dict((p, self.blob(p)) for p in ['one.patch', 'sub/two.patch', 'bad.patch']))
+        self.assertEqual(cache['tree'], self.git('rev-parse', 'HEAD:patches.suse'))
+
+        # the worktree overrides the tree of HEAD: changed, deleted and untracked files
+        self.write('patches.suse/one.patch', patch('Git-commit: ' + D))
+        os.unlink(os.path.join(self.patches, 'bad.patch'))
+        self.write('patches.suse/new.patch', patch())
+        self.write('patches.suse/newdir/three.patch', patch())
+        self.write('series.conf', 'patches.suse/new.patch\n')
+        blobs = patch_blobs(self.patches, cache)
+        self.assertEqual(blobs, dict((p, self.blob(p)) for p in ['one.patch', 'sub/two.patch', 'new.patch', 'newdir/three.patch']))
+        self.assertEqual(cache['files']['bad.patch'], self.git('rev-parse', 'HEAD:patches.suse/bad.patch'))
+
+    def test_tree_change(self):
+        cache = dict()
+        patch_blobs(self.patches, cache)
+        first = cache['tree']
+        # the tree is walked once as long as its id is the same
+        cache['files']['stale.patch'] = '0' * 40
+        self.assertIn('stale.patch', patch_blobs(self.patches, cache))
+
+        self.write('patches.suse/one.patch', patch('Git-commit: ' + D))
+        self.commit('update')
+        blobs = patch_blobs(self.patches, cache)
+        self.assertNotEqual(cache['tree'], first)
+        self.assertNotIn('stale.patch', blobs)
+        self.assertEqual(blobs['one.patch'], self.blob('one.patch'))
+
+    def test_not_a_repository(self):
+        shutil.rmtree(os.path.join(self.repo, '.git'))
+        with self.assertRaises(git.GitError):
+            patch_blobs(self.patches, dict())
+
+    def test_hashdict(self):
+        expected = {
+            A: os.path.join(self.patches, 'one.patch'),
+            B: os.path.join(self.patches, 'sub/two.patch'),
+            C: os.path.join(self.patches, 'sub/two.patch'),
+        }
+        self.assertEqual(get_hashdict(self.patches, self.cache), expected)
+        self.assertEqual(read_all_tags(self.patches), expected)
+        self.assertEqual(load_json(self.cache)['blobs'][self.blob('one.patch')], [A])
+
+        # only the changed patches are read again
+        self.write('patches.suse/one.patch', patch('Git-commit: ' + D))
+        with mock.patch.object(gitcache, 'read_tags', wraps=gitcache.read_tags) as read_tags:
+            hashdict = get_hashdict(self.patches, self.cache)
+        read_tags.assert_called_once_with(self.patches, ['one.patch'])
+        self.assertEqual(hashdict, { D: expected[A], B: expected[B], C: expected[C] })
+
+        # the blobs no longer used are dropped from the cache
+        self.commit('update')
+        os.unlink(os.path.join(self.patches, 'sub/two.patch'))
+        with mock.patch.object(gitcache, 'read_tags') as read_tags:
+            hashdict = get_hashdict(self.patches, self.cache)
+            read_tags.assert_not_called()
+        self.assertEqual(hashdict, { D: expected[A] })
+        self.assertEqual(sorted(load_json(self.cache)['blobs'].keys()),
+                         sorted([self.blob('one.patch'), self.blob('bad.patch')]))
+
+
+class TestCommitStats(GitTestCase):
+    def test_stats(self):
+        self.write('a', 'one\ntwo\n')
+        self.write('b', 'three\n')
+        self.commit('initial')
+        self.write('a', 'one\n2\n3\n')
+        self.write('c/d', 'four\n')
+        os.unlink(os.path.join(self.repo, 'b'))
+        head = self.commit('change')
+        cache = os.path.join(self.tmpdir, 'stats.json')
+
+        stats = CommitStats(git.Repository(self.repo), cache)
+        expected = {'added': 3, 'removed': 2, 'files': 3, 'paths': ['a', 'c/d']}
+        self.assertEqual(stats.get('HEAD'), expected)
+        self.assertEqual(stats.get(head[:12]), expected)
+        self.assertEqual(load_json(cache), None)
+        stats.save()
+        self.assertEqual(load_json(cache), { head: expected })
+
+        # a later run takes the stats from the cache, merged with what other runs stored
+        with open(cache, 'w') as f:
+            f.write('{"%s": {"added": 1, "removed": 0, "files": 1, "paths": ["x"]}, "%s": {}}' % (head, A))
+        stats = CommitStats(git.Repository(self.repo), cache)
+        self.assertEqual(stats.get('HEAD')['paths'], ['x'])
+        stats.save()
+        self.assertEqual(sorted(load_json(cache).keys()), sorted([head, A]))
@@ -1,10 +1,12 @@
-from kutil.config import read_config_sh, get_kernel_project_package, list_files, list_specs, get_kernel_projects, get_package_archs, SrcVersion, compute_patchversion
+from kutil.config import read_config_sh, get_kernel_project_package, list_files, list_specs, get_kernel_projects, get_package_archs, SrcVersion, compute_patchversion, PatchversionCache, git_blob_id, TarUpDir, get_source_timestamp
+from kutil import config as kutil_config
 from kutil import pathlib_compat
 from pathlib import Path
 import subprocess
 import tempfile
 import unittest
 import shutil
+import os
 
 class MiscTests(unittest.TestCase):
     def test_config_sh(self):
@@ -88,6 +90,25 @@ another file
         self.assertEqual(get_package_archs('tests/kutil/rpm/klp'),
                           ['x86_64'])
 
+    def test_tar_up_dir(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            data = os.path.join(tmpdir, 'krn')
+            shutil.copytree('tests/kutil/rpm/krn', data)
+            tar_up = TarUpDir(data)
+            self.assertEqual(list_files(tar_up), list_files(data))
+            self.assertEqual(list_specs(tar_up), list_specs(data))
+            self.assertEqual(get_kernel_project_package(tar_up), ('SUSE:SLE-15-SP6:Update', 'kernel-source'))
+            self.assertEqual(get_package_archs(tar_up), get_package_archs(data))
+            timestamp = get_source_timestamp(tar_up)
+            # everything is parsed once and shared between the helpers
+            for f in os.listdir(data):
+                os.unlink(os.path.join(data, f))
+            self.assertEqual(read_config_sh(tar_up)['variant'], '')
+            self.assertEqual(get_kernel_projects(tar_up)['OBS'], {'': 'SUSE:SLE-15-SP6:GA', 'ARM': 'openSUSE:Step:15-SP6'})
+            self.assertEqual(get_package_archs(tar_up, ['kernel-zfcpdump']), ['s390x'])
+            self.assertEqual(get_source_timestamp(tar_up), timestamp)
+            self.assertEqual(list_files(data), [])
+
     def test_srcversion(self):
         self.assertRaises(Exception, SrcVersion('1.2.4el4'))
         testdata = [
@@ -195,6 +216,83 @@ patches.suse/sublevel_4 # change sublevel
         ver = compute_patchversion(self.rpmdir, self.base, self.base)
         self.assertEqual('1.2.4', str(ver))
 
+    def test_compute_fn_cache(self):
+        self.config_sh.write_text('SRCVERSION=1.2')
+        self.series_conf.write_text('''
+patches.suse/sublevel_4_before
+patches.suse/sublevel_4 # change sublevel
+''')
+        cache_file = self.base / 'cache.json'
+        replayed = []
+        orig_filter = kutil_config.filter_makefile_patches
+        def filter_makefile_patches(patchdir, patches):
+            replayed.append(list(patches))
+            return orig_filter(patchdir, patches)
+        kutil_config.filter_makefile_patches = filter_makefile_patches
+        try:
+            ver = compute_patchversion(self.rpmdir, self.base, self.base, PatchversionCache(str(cache_file)))
+            self.assertEqual('1.2.4', str(ver))
+            self.assertEqual(replayed.pop(), ['patches.suse/sublevel_4_before', 'patches.suse/sublevel_4'])
+            # unchanged series, nothing to replay
+            ver = compute_patchversion(self.rpmdir, self.base, self.base, PatchversionCache(str(cache_file)))
+            self.assertEqual('1.2.4', str(ver))
+            self.assertEqual(replayed.pop(), [])
+            # appended patch, only the new patch is replayed
+            self.series_conf.write_text('''
+patches.suse/sublevel_4_before
+patches.suse/sublevel_4 # change sublevel
+patches.suse/no_extraversion.diff
+''')
+            ver = compute_patchversion(self.rpmdir, self.base, self.base, PatchversionCache(str(cache_file)))
+            self.assertEqual(replayed.pop(), ['patches.suse/no_extraversion.diff'])
+            self.assertEqual('1.2.4', str(ver))
+            # removed patch in the middle, replay from the first changed entry
+            self.series_conf.write_text('''
+patches.suse/sublevel_4_before
+patches.suse/no_extraversion.diff
+''')
+            ver = compute_patchversion(self.rpmdir, self.base, self.base, PatchversionCache(str(cache_file)))
+            self.assertEqual(replayed.pop(), ['patches.suse/no_extraversion.diff'])
+            self.assertEqual('1.2.0', str(ver))
+            # changed source version invalidates the whole chain
+            self.config_sh.write_text('SRCVERSION=1.3')
+            ver = compute_patchversion(self.rpmdir, self.base, self.base, PatchversionCache(str(cache_file)))
+            self.assertEqual(replayed.pop(), ['patches.suse/sublevel_4_before', 'patches.suse/no_extraversion.diff'])
+            self.assertEqual('1.3.0', str(ver))
+        finally:
+            kutil_config.filter_makefile_patches = orig_filter
+
+    def test_compute_fn_cache_missing_patch(self):
+        self.config_sh.write_text('SRCVERSION=1.2')
+        self.series_conf.write_text('''
+patches.suse/no_such.patch
+''')
+        with self.assertRaisesRegex(RuntimeError, 'no_such[.]patch'):
+            ver = compute_patchversion(self.rpmdir, self.base, self.base, PatchversionCache(str(self.base / 'cache.json')))
+
+    def test_compute_fn_cache_prune(self):
+        self.config_sh.write_text('SRCVERSION=1.2')
+        cache_file = str(self.base / 'cache.json')
+        series = []
+        for i in range(PatchversionCache.max_series + 2):
+            series.append(self.base / ('series%i' % (i,)))
+            series[-1].mkdir()
+            (series[-1] / 'series.conf').write_text('patches.suse/sublevel_4\n')
+            ver = compute_patchversion(self.rpmdir, series[-1], self.base, PatchversionCache(cache_file))
+            self.assertEqual('1.2.4', str(ver))
+        # only the series used most recently are kept
+        self.assertEqual(list(PatchversionCache(cache_file).data['series'].keys()),
+                         [str(s / 'series.conf') for s in series[2:]])
+        # and only those that still exist
+        shutil.rmtree(series[2])
+        compute_patchversion(self.rpmdir, series[3], self.base, PatchversionCache(cache_file))
+        self.assertEqual(list(PatchversionCache(cache_file).data['series'].keys()),
+                         [str(s / 'series.conf') for s in series[4:] + series[3:4]])
+
+    def test_blob_id(self):
+        blob = subprocess.check_output(['git', 'hash-object', '--no-filters', self.patches_orig / 'sublevel_4']).decode().strip()
+        self.assertEqual(git_blob_id(str(self.patches_orig / 'sublevel_4')), blob)
+
     def test_empty(self):
         def test_fn(pipe, out, err):
             self.assertNotEqual(0, pipe.returncode)
@@ -0,0 +1,92 @@
+import types
+import unittest
+from unittest import mock
+
+from kutil import scheduler
+from kutil.scheduler import MemoryScheduler, parse_size, JOB_RSS_GUESS, MEMORY_RESERVE
+
+G = 1 << 30
+
+
+def running(*rss):
+    return [types.SimpleNamespace(rss=r) for r in rss]
+
+
+class TestParseSize(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_size('16G'), 16 * G)
+        self.assertEqual(parse_size('4k'), 4096)
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('1T'), 1 << 40)
+
+    def test_invalid(self):
+        for size in ['16X', 'G', '', '0', '-1M', '1.5G']:
+            with self.assertRaises(ValueError, msg=size):
+                parse_size(size)
+
+
+class TestMemoryScheduler(unittest.TestCase):
+    def admit(self, s, jobs, available=None):
+        with mock.patch.object(scheduler, 'read_meminfo', return_value=available):
+            return s.admit(jobs)
+
+    def test_admit_nothing_running(self):
+        # a job always runs, even if it is not expected to fit
+        s = MemoryScheduler(4, budget=G // 2)
+        self.assertTrue(self.admit(s, [], available=G // 2))
+        self.assertFalse(self.admit(s, running(0), available=16 * G))
+
+    def test_admit_workers(self):
+        s = MemoryScheduler(2)
+        self.assertTrue(self.admit(s, running(0)))
+        self.assertFalse(self.admit(s, running(0, 0)))
+
+    def test_admit_budget(self):
+        s = MemoryScheduler(8, budget=3 * G)
+        self.assertTrue(self.admit(s, running(0, 0), available=16 * G))
+        self.assertFalse(self.admit(s, running(0, 0, 0), available=16 * G))
+        # a job using more than expected counts with its current RSS
+        self.assertFalse(self.admit(s, running(0, 2 * G), available=16 * G))
+
+    def test_admit_available(self):
+        s = MemoryScheduler(8)
+        self.assertEqual(s.estimate(), JOB_RSS_GUESS)
+        # the new job, what the running jobs may still grow by and the reserve
+        self.assertTrue(self.admit(s, running(0), available=3 * G))
+        self.assertFalse(self.admit(s, running(0, 0), available=3 * G))
+        self.assertTrue(self.admit(s, running(G, G), available=2 * G))
+        # the largest peak seen is expected from now on
+        s.peaks = [G // 2, 2 * G]
+        self.assertEqual(s.estimate(), 2 * G)
+        self.assertFalse(self.admit(s, running(G), available=4 * G - 1))
+        self.assertTrue(self.admit(s, running(G), available=4 * G))
+
+    def test_run(self):
+        s = MemoryScheduler(2)
+        jobs = [('echo one', 'one'), ('echo two >&2; exit 3', 'two'), ('echo three', 'three')]
+        with mock.patch.object(scheduler, 'POLL_INTERVAL', 0.01):
+            results = dict((job[1], res) for job, res, wall, peak in s.run(jobs))
+        self.assertEqual(sorted(results.keys()), ['one', 'three', 'two'])
+        self.assertEqual((results['one'].returncode, results['one'].stdout), (0, 'one\n'))
+        self.assertEqual((results['two'].returncode, results['two'].stderr), (3, 'two\n'))
+        self.assertEqual(len(s.peaks), 3)
+        self.assertLessEqual(s.most_running, 2)
+
+    def test_unsampled_peak(self):
+        # a job ending before its RSS is sampled does not make the next ones look free
+        s = MemoryScheduler(32)
+        with mock.patch.object(scheduler, 'POLL_INTERVAL', 0):
+            for job, res, wall, peak in s.run([('true', 'a')]):
+                pass
+        self.assertEqual(s.estimate(), JOB_RSS_GUESS)
+        self.assertFalse(self.admit(s, running(*[3 * G] * 20), available=MEMORY_RESERVE + JOB_RSS_GUESS - 1))
+        self.assertTrue(self.admit(s, running(*[3 * G] * 20), available=MEMORY_RESERVE + JOB_RSS_GUESS))
+
+    def test_final_sample(self):
+        # the process tree is sampled once more right before the job is reaped
+        s = MemoryScheduler(1)
+        with mock.patch.object(scheduler, 'POLL_INTERVAL', 0), \
+             mock.patch.object(scheduler, 'tree_rss', side_effect=lambda pids: dict((p, 2 * G) for p in pids)):
+            peaks = [peak for job, res, wall, peak in s.run([('true', 'a')])]
+        self.assertEqual(peaks, [2 * G])
+        self.assertEqual(s.estimate(), 2 * G)
@@ -0,0 +1,81 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from kutil.vulns import VulnsIndex
+
+
+class TestVulnsIndex(unittest.TestCase):
+    FILES = {
+        'cve/published/2024/CVE-2024-26581.sha1': 'aaaa0001\n',
+        'cve/published/2024/CVE-2024-26581.vulnerable': 'bbbb0001\nbbbb0002\n',
+        'cve/published/2024/CVE-2024-26581.json': '{}\n',
+        'cve/published/2024/CVE-2024-265810.sha1': 'aaaa0002\naaaa0003\n',
+        'cve/rejected/2024/CVE-2024-26583.sha1': 'aaaa0004\n',
+        'cve/reserved/2024/CVE-2024-26584': '',
+        'README': 'CVE-2024-26585.sha1\n',
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="ks_vulns")
+        self.repo = os.path.join(self.tmpdir, 'vulns')
+        self.db = os.path.join(self.tmpdir, 'vulns.sqlite')
+        self.git('init', '-q', self.repo)
+        for path, content in self.FILES.items():
+            self.write(path, content)
+        self.commit('initial')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        subprocess.check_call(('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com') + args,
+                              cwd=self.tmpdir if args[0] == 'init' else self.repo)
+
+    def write(self, path, content):
+        path = os.path.join(self.repo, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def commit(self, msg):
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', msg)
+
+    def test_lookup(self):
+        index = VulnsIndex(self.repo, db_path=self.db)
+        self.assertEqual(index.lookup(['CVE-2024-26581', 'cve-2024-26583', 'CVE-2024-26584', 'CVE-2024-26585']), {
+            'CVE-2024-26581': {'published': ['aaaa0001'], 'vulnerable': ['bbbb0001', 'bbbb0002']},
+            'CVE-2024-26583': {'rejected': ['aaaa0004']},
+        })
+        self.assertEqual(index.cve2sha('CVE-2024-265810'), ['aaaa0002', 'aaaa0003'])
+        self.assertEqual(index.cve2sha('CVE-2024-26583'), ['aaaa0004'])
+        self.assertEqual(index.cve2sha('CVE-2024-26584'), [])
+        self.assertEqual(index.sha2cve('aaaa0003'), ['CVE-2024-265810'])
+        self.assertEqual(index.sha2cve('AAAA000'), ['CVE-2024-26581', 'CVE-2024-265810', 'CVE-2024-26583'])
+        self.assertEqual(index.sha2cve('bbbb0001'), [])
+        index.close()
+
+    def test_trees(self):
+        index = VulnsIndex(self.repo, db_path=self.db)
+        first = index.tree
+        index.close()
+
+        self.write('cve/published/2024/CVE-2024-26581.sha1', 'aaaa0005\n')
+        self.commit('update')
+        index = VulnsIndex(self.repo, db_path=self.db)
+        self.assertEqual(index.cve2sha('CVE-2024-26581'), ['aaaa0005'])
+        index.close()
+        index = VulnsIndex(self.repo, rev='HEAD^', db_path=self.db)
+        self.assertEqual(index.tree, first)
+        self.assertEqual(index.cve2sha('CVE-2024-26581'), ['aaaa0001'])
+
+        # an already indexed tree is not walked again
+        with mock.patch('kutil.vulns.walk_vulns_tree') as walk:
+            index = VulnsIndex(self.repo, db_path=self.db)
+            self.assertEqual(index.cve2sha('CVE-2024-26581'), ['aaaa0005'])
+            walk.assert_not_called()
+        index.close()